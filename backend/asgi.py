@@ -0,0 +1,218 @@
+import asyncio
+import contextlib
+import functools
+import itertools
+import re
+
+import asyncpg
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+import cache
+import db
+import http_cache
+import profiles
+import responses
+import script
+
+# Async serving mode:
+#
+#     uvicorn asgi:app --workers 4
+#
+# Handlers that run several independent queries are served here, with each
+# query on its own connection from an asyncpg pool, so a request takes as
+# long as its slowest query rather than the sum of them. The bowler skill
+# profile is a single query (see profiles.py) but is served here too so it
+# does not hold a worker thread. Every other route falls through to the
+# Flask app in script.py. The SQL is shared with the Flask handlers, and so
+# are the response cache, ETags and compression (see cached below).
+
+pool = None
+
+
+# psycopg2 uses %s placeholders, asyncpg uses $1, $2, ...
+@functools.lru_cache(maxsize=None)
+def numbered(sql):
+    counter = itertools.count(1)
+    return re.sub(r'%s', lambda _: '${}'.format(next(counter)), sql)
+
+
+async def fetch(sql, *args):
+    async with pool.acquire(timeout=db.POOL_TIMEOUT) as conn:
+        return [dict(row) for row in await conn.fetch(numbered(sql), *args)]
+
+
+async def fetchone(sql, *args):
+    rows = await fetch(sql, *args)
+    return rows[0] if rows else None
+
+
+# Same JSON rendering as the Flask handlers (Decimal as string, sorted keys)
+def json_response(data, status_code=200):
+    return Response(script.app.json.dumps(data), status_code=status_code, media_type='application/json')
+
+
+# Flask-CORS covers the mounted Flask app; the async routes get the same
+# origins here so the two never both set the header
+def cors(handler):
+    @functools.wraps(handler)
+    async def wrapper(request):
+        response = await handler(request)
+        origin = request.headers.get('origin')
+        if origin in script.CORS_ORIGINS:
+            response.headers['Access-Control-Allow-Origin'] = origin
+            vary = response.headers.get('Vary')
+            response.headers['Vary'] = vary + ', Origin' if vary else 'Origin'
+        return response
+    return wrapper
+
+
+# What the Flask app does for its cached routes: the response cache
+# (cache.py), ETag/Last-Modified and 304s (http_cache.py) and compression
+# (responses.py). Those read the Flask request, so each step runs in a Flask
+# request context made from this request, on a worker thread as it may
+# query the dataset version.
+def cached(ttl=cache.DEFAULT_TTL):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            context = functools.partial(
+                script.app.test_request_context, request.url.path, query_string=request.url.query,
+                method=request.method, headers=list(request.headers.items()))
+            version, response = await run_in_threadpool(_cached_response, context)
+            if response is None:
+                result = await handler(request)
+                response = await run_in_threadpool(_store_response, context, result, version, ttl)
+            return response
+        return wrapper
+    return decorator
+
+
+# (dataset version, finished response or None), see cache.cached_response
+def _cached_response(context):
+    with context():
+        response = http_cache.not_modified()
+        if response is not None:
+            return None, _finish(response)
+        version, response = cache.cached_response()
+        return version, None if response is None else _finish(response)
+
+
+def _store_response(context, result, version, ttl):
+    with context():
+        response = script.app.response_class(result.body, status=result.status_code, mimetype=result.media_type)
+        cache.store_response(response, version, ttl)
+        return _finish(response)
+
+
+# Validators, then compression (which adjusts the ETag), as the Flask app's
+# after_request hooks run them
+def _finish(flask_response):
+    flask_response = responses.compress_response(http_cache.add_validators(flask_response))
+    response = Response(flask_response.get_data(), status_code=flask_response.status_code)
+    response.raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in flask_response.headers.items()]
+    return response
+
+
+def int_arg(request, name):
+    try:
+        return int(request.query_params.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+@cors
+@cached()
+async def player_stats(request):
+    player = request.query_params.get('player')
+    batting_stats, bowling_stats, profile = await asyncio.gather(
+        fetchone(script.PLAYER_BATTING_SQL, player),
+        fetchone(script.PLAYER_BOWLING_SQL, player),
+        fetchone(script.PLAYER_PROFILE_SQL, player),
+    )
+    return json_response(script.player_stats_payload(batting_stats, bowling_stats, profile))
+
+
+@cors
+@cached()
+async def match_summary(request):
+    match_id = int_arg(request, 'match_id')
+    if match_id is None:
+        return json_response({"error": "match_id must be an integer"}, 400)
+    innings, key_performances = await asyncio.gather(
+        fetch(script.MATCH_INNINGS_SQL, match_id),
+        fetch(script.MATCH_KEY_PERFORMANCES_SQL, match_id),
+    )
+    return json_response({"innings": innings, "key_performances": key_performances})
+
+
+@cors
+@cached()
+async def season_overview(request):
+    year = int_arg(request, 'year')
+    if year is None:
+        return json_response({"error": "year must be an integer"}, 400)
+    team_performance, top_scorers, top_bowlers = await asyncio.gather(
+        fetch(script.SEASON_TEAMS_SQL, year, year),
+        fetch(script.SEASON_TOP_SCORERS_SQL, year),
+        fetch(script.SEASON_TOP_BOWLERS_SQL, year),
+    )
+    return json_response(script.season_overview_payload(team_performance, top_scorers, top_bowlers))
+
+
+@cors
+@cached()
+async def bowler_skill_profile(request):
+    player = request.query_params.get('player')
+    if not player:
+        return json_response({"error": "Missing player"}, 400)
+    row = await fetchone(profiles.BOWLER_PROFILE_SQL, player)
+    return json_response(profiles.bowler_payload(row))
+
+
+async def pool_exhausted(request, exc):
+    return json_response({"error": "no database connection available after {:.1f}s".format(db.POOL_TIMEOUT)}, 503)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global pool
+    params = db.db_params
+    pool = await asyncpg.create_pool(
+        host=params['host'],
+        database=params['database'],
+        user=params['user'],
+        password=params['password'],
+        port=params['port'],
+        ssl=params['sslmode'],
+        min_size=db.POOL_MIN,
+        max_size=db.POOL_MAX,
+        max_inactive_connection_lifetime=db.POOL_RECYCLE,
+    )
+    try:
+        yield
+    finally:
+        await pool.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/player-stats', player_stats),
+        Route('/api/match-summary', match_summary),
+        Route('/api/season-overview', season_overview),
+        Route('/api/bowler-skill-profile', bowler_skill_profile),
+        Mount('/', WSGIMiddleware(script.app)),
+    ],
+    exception_handlers={asyncio.TimeoutError: pool_exhausted},
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run("asgi:app", workers=4)
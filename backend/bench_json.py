@@ -0,0 +1,69 @@
+import argparse
+import functools
+import json
+import random
+import time
+from decimal import Decimal
+
+import serialization
+
+# Serialization time and bytes on the wire for a /api/batscatter-shaped
+# payload: Flask's default encoder against serialization.dumps, per-row
+# objects against ?format=columns, and each compressed.
+#
+#     python bench_json.py --rows 2500
+
+
+# Rows as RealDictCursor returns them for the scatter endpoints
+def scatter_rows(count, seed=0):
+    rng = random.Random(seed)
+    return [{
+        "batsman": "Player {:05d}".format(i),
+        "strike_rate": Decimal(rng.randint(4000, 13000)) / 100,
+        "average": Decimal(rng.randint(500, 6000)) / 100,
+    } for i in range(count)]
+
+
+# What Flask's DefaultJSONProvider does with these rows
+flask_dumps = functools.partial(json.dumps, default=str, sort_keys=True, separators=(",", ":"))
+
+
+def best_ms(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API JSON encoding and compression")
+    parser.add_argument('--rows', type=int, default=2500, help="rows in the payload")
+    parser.add_argument('--repeat', type=int, default=50, help="runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    rows = scatter_rows(args.rows)
+    columns = serialization.to_columns(rows)
+    cases = [
+        ("flask json, rows", lambda: flask_dumps(rows).encode()),
+        ("{}, rows".format(serialization.ENCODER), lambda: serialization.dumps(rows)),
+        ("{}, columns".format(serialization.ENCODER), lambda: serialization.dumps(columns)),
+    ]
+    assert json.loads(cases[0][1]()) == json.loads(cases[1][1]()), "encoders disagree"
+
+    print("{:,} rows, encoder: {}".format(args.rows, serialization.ENCODER))
+    print("{:<22} {:>10} {:>10}".format("", "encode ms", "bytes") + "".join(
+        " {:>10} {:>10}".format(coding + " ms", coding + " bytes") for coding in serialization.COMPRESSORS))
+    for name, encode in cases:
+        body = encode()
+        line = "{:<22} {:>10.2f} {:>10,}".format(name, best_ms(encode, args.repeat), len(body))
+        for coding in serialization.COMPRESSORS:
+            compressed = serialization.compress(body, coding)
+            line += " {:>10.2f} {:>10,}".format(
+                best_ms(lambda: serialization.compress(body, coding), args.repeat), len(compressed))
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import gc
+import random
+import sys
+import tracemalloc
+from decimal import Decimal
+
+import numpy as np
+
+import columnar
+
+# Memory held by the columnar engine's table per million balls, with text
+# columns as object arrays of the driver's strings (as the engine first
+# stored them) against dictionary-encoded codes, and whether a dataset of
+# --balls balls fits in --budget-mb.
+#
+#     python bench_memory.py --rows 1000000 --balls 1500000 --budget-mb 512
+
+TYPES = {
+    "p_match": "integer", "year": "integer", "wagonzone": "integer", "batruns": "integer", "ballfaced": "integer",
+    "bowlruns": "integer", "score": "integer", "ball_id": "integer", "control": "numeric", "out": "boolean",
+    "is_dot": "boolean", "is_boundary": "boolean", "is_bowler_wicket": "boolean",
+}
+
+TEAMS = ["India", "Australia", "England", "Pakistan", "South Africa", "New Zealand", "Sri Lanka", "West Indies",
+         "Bangladesh", "Afghanistan", "Zimbabwe", "Ireland", "Netherlands", "Scotland"]
+VALUES = {
+    "team_bat": TEAMS,
+    "team_bowl": TEAMS,
+    "bat_hand": ["RHB", "LHB"],
+    "bowl_kind": ["pace bowler", "spin bowler", "mixture/unknown"],
+    "bowl_style": ["RF", "RFM", "RM", "LF", "LFM", "LM", "OB", "LB", "SLA", "LWS", "RMF", "LMF"],
+    "phase": ["Powerplay", "Middle Overs", "Death Overs"],
+    "line": ["ON_THE_STUMPS", "OUTSIDE_OFFSTUMP", "WIDE_OUTSIDE_OFFSTUMP", "DOWN_LEG", None],
+    "length": ["FULL", "GOOD_LENGTH", "SHORT_OF_A_GOOD_LENGTH", "SHORT", "YORKER", "FULL_TOSS", None],
+    "shot": ["DEFENDED", "DRIVE", "CUT", "PULL", "FLICK", "PUSH", "SWEEP", "LEFT", "STEERED", None],
+    "outcome": ["no run", "run", "four", "six", "out", "wide", "no ball", "leg bye", "bye"],
+}
+
+
+# Column name -> values as the driver returns them: a new str per row
+def synthetic(rows, players=2500, seed=0):
+    rng = random.Random(seed)
+    names = ["{}. {}son".format(chr(65 + i % 26), "Player{:04d}".format(i)) for i in range(players)]
+    data = {name: [] for name in columnar.COLUMNS}
+    for i in range(rows):
+        for name, values in VALUES.items():
+            value = rng.choice(values)
+            data[name].append(None if value is None else value.encode().decode())
+        data["bat"].append(rng.choice(names).encode().decode())
+        data["bowl"].append(rng.choice(names).encode().decode())
+        data["p_match"].append(i // 550)
+        data["year"].append(2002 + i * 22 // rows)
+        data["wagonzone"].append(rng.randint(0, 8))
+        runs = rng.choice([0, 0, 0, 1, 1, 2, 4, 6])
+        for name in ("batruns", "bowlruns", "score"):
+            data[name].append(runs)
+        data["ballfaced"].append(1)
+        data["ball_id"].append(i)
+        data["control"].append(Decimal(rng.choice(["0.0", "1.0"])))
+        data["out"].append(rng.random() < 0.03)
+        data["is_dot"].append(runs == 0)
+        data["is_boundary"].append(runs >= 4)
+        data["is_bowler_wicket"].append(rng.random() < 0.025)
+    return data
+
+
+# The table as the loader used to build it: text as object arrays of the
+# fetched strings plus a NULL mask, and the int64 codes Table.dictionary()
+# then kept for each text column once queried
+def object_table(data):
+    columns, valid, scales = {}, {}, {}
+    for name in list(data):
+        values = data.pop(name)
+        if name in TYPES:
+            array, not_null, scale = columnar._build_column(values, TYPES[name])
+        else:
+            array = np.array(["" if v is None else v for v in values], dtype=object)
+            not_null = array != ""
+            not_null, scale = (None if not_null.all() else not_null), None
+            columns[name + " codes"] = np.unique(array, return_inverse=True)[1].astype(np.int64)
+        columns[name] = array
+        if not_null is not None:
+            valid[name] = not_null
+        if scale is not None:
+            scales[name] = scale
+    return columns, valid, scales
+
+
+# The table as load() builds it now
+def encoded_table(data):
+    columns, valid, scales, categories = {}, {}, {}, {}
+    for name in list(data):
+        values = data.pop(name)
+        if name in TYPES:
+            array, not_null, scale = columnar._build_column(values, TYPES[name])
+            columns[name] = array
+            if not_null is not None:
+                valid[name] = not_null
+            if scale is not None:
+                scales[name] = scale
+        else:
+            encoder = columnar._Encoder()
+            encoder.extend(values)
+            categories[name], columns[name] = encoder.finish()
+    return columnar.build_table(columns, valid, scales, 0, categories)
+
+
+# Bytes still allocated once build(data) has returned and the input lists
+# are gone, counting the strings the table keeps
+def retained(build, rows):
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    data = synthetic(rows)
+    result = build(data)
+    del data
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return result, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the columnar engine's memory per million balls")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="synthetic balls to build")
+    parser.add_argument('--balls', type=int, default=1_500_000, help="balls in the full dataset")
+    parser.add_argument('--budget-mb', type=float, default=512, help="memory available to the table")
+    args = parser.parse_args()
+
+    per_million = 1_000_000 / args.rows / 2 ** 20
+    _, before = retained(object_table, args.rows)
+    table, after = retained(encoded_table, args.rows)
+    print("{:,} balls".format(args.rows))
+    print("{:<18} {:>12}".format("", "MB / M balls"))
+    print("{:<18} {:>12.1f}".format("object arrays", before * per_million))
+    print("{:<18} {:>12.1f}".format("dictionary codes", after * per_million))
+    print("{:<18} {:>12.1f}".format("  (Table.nbytes)", table.nbytes() * per_million))
+    print("text columns: " + ", ".join("{} {}".format(name, table.columns[name].dtype)
+                                       for name in table.categories))
+
+    projected = after * args.balls / args.rows / 2 ** 20
+    fits = projected <= args.budget_mb
+    print("{:,} balls: {:.0f} MB of a {:.0f} MB budget, {}".format(
+        args.balls, projected, args.budget_mb, "fits" if fits else "DOES NOT FIT"))
+    return 0 if fits else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import argparse
+import functools
+import json
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import Json, RealDictCursor
+
+import db
+
+# Global percentile benchmarks for the compare pages. They only change when a
+# new dataset is loaded, so they are computed once per dataset version (the
+# latest odi_ingest_log entry), stored as JSON and served by lookup.
+
+# Seconds between checks for a new dataset version
+REFRESH_INTERVAL = float(os.getenv("BENCHMARK_REFRESH_INTERVAL", 60))
+# Whether the first request starts the refresher; the index advisor turns
+# it off so its replay runs only the requests' own SQL
+REFRESH_ENABLED = os.getenv("BENCHMARK_REFRESH_ENABLED", "1") == "1"
+# pg_advisory_lock key, so only one worker computes a given version
+LOCK_KEY = 720401
+
+BENCHMARKS_SQL = """
+    CREATE TABLE IF NOT EXISTS benchmarks (
+        name VARCHAR NOT NULL,
+        version INTEGER NOT NULL,
+        payload JSONB NOT NULL,
+        computed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (name, version)
+    )
+"""
+
+# Phase names as the frontend expects them in the benchmark payloads
+PHASE_LABEL = "CASE phase WHEN 'Middle Overs' THEN 'Middle' WHEN 'Death Overs' THEN 'Death' ELSE phase END"
+
+
+def batting_benchmarks(cur):
+    cur.execute("""
+        WITH player_phase_stats AS (
+            SELECT
+                player,
+                {phase} AS phase,
+                SUM(runs)::FLOAT AS total_runs,
+                SUM(balls_faced)::FLOAT AS total_balls,
+                SUM(boundaries)::FLOAT AS boundaries,
+                SUM(dots)::FLOAT AS dots,
+                SUM(out_flags)::FLOAT AS outs,
+                SUM(deliveries)::FLOAT AS total_balls_faced
+            FROM player_phase
+            WHERE role = 'bat'
+            GROUP BY player, phase
+        ),
+        aggregated AS (
+            SELECT
+                player,
+                phase,
+                (total_runs / NULLIF(total_balls, 0)) * 100 AS sr,
+                (boundaries / NULLIF(total_balls_faced, 0)) * 100 AS boundary_pct,
+                (dots / NULLIF(total_balls_faced, 0)) * 100 AS dot_pct,
+                ((total_balls_faced - boundaries - dots) / NULLIF(total_balls_faced, 0)) * 100 AS sri,
+                (total_runs / NULLIF(outs, 0)) AS average
+            FROM player_phase_stats
+        )
+        SELECT
+            phase,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY sr)::NUMERIC, 2) AS sr_95,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY boundary_pct)::NUMERIC, 2) AS boundary_95,
+            ROUND(PERCENTILE_CONT(0.05) WITHIN GROUP (ORDER BY dot_pct)::NUMERIC, 2) AS dot_95,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY sri)::NUMERIC, 2) AS sri_95,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY average)::NUMERIC, 2) AS avg_95
+        FROM aggregated
+        GROUP BY phase
+    """.format(phase=PHASE_LABEL))
+    rows = cur.fetchall()
+
+    cur.execute("""
+        WITH player_agg AS (
+            SELECT
+                player,
+                SUM(runs)::NUMERIC AS total_runs,
+                SUM(deliveries)::NUMERIC AS total_balls,
+                SUM(boundaries)::NUMERIC AS boundaries,
+                SUM(dots)::NUMERIC AS dots,
+                SUM(singles)::NUMERIC AS singles,
+                SUM(boundary_runs)::NUMERIC AS boundary_runs
+            FROM player_phase
+            WHERE role = 'bat'
+            GROUP BY player
+        ),
+        derived AS (
+            SELECT
+                player,
+                ROUND(
+                    (0.4 * ((total_runs - boundary_runs) / NULLIF((total_balls - boundaries), 0)) * 100)
+                    + (0.4 * (singles / NULLIF(total_balls, 0) * 100))
+                    + (0.2 * (100 - (dots / NULLIF(total_balls, 0) * 100))),
+                    2
+                ) AS sri,
+                ROUND((boundaries / NULLIF(total_balls, 0)) * 100, 2) AS boundary_pct
+            FROM player_agg
+        )
+        SELECT
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY sri)::NUMERIC, 2) AS sri_95_global,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY boundary_pct)::NUMERIC, 2) AS boundary_95_global
+        FROM derived
+    """)
+    return {"phase": {row["phase"]: row for row in rows}, "global": cur.fetchone()}
+
+
+def bowling_benchmarks(cur):
+    cur.execute("""
+        SELECT
+            phase,
+            ROUND(PERCENTILE_CONT(0.05) WITHIN GROUP (ORDER BY economy)::NUMERIC, 2) AS econ_95,
+            ROUND(PERCENTILE_CONT(0.05) WITHIN GROUP (ORDER BY strike_rate)::NUMERIC, 2) AS sr_95,
+            ROUND(PERCENTILE_CONT(0.05) WITHIN GROUP (ORDER BY average)::NUMERIC, 2) AS avg_95
+        FROM (
+            SELECT
+                {phase} AS phase,
+                (SUM(score)::FLOAT / NULLIF(SUM(ball_ids), 0)) * 6 AS economy,
+                (CAST(SUM(ball_ids) AS FLOAT) / NULLIF(SUM(bowler_wickets), 0)) AS strike_rate,
+                (SUM(bowl_runs)::FLOAT / NULLIF(SUM(bowler_wickets), 0)) AS average
+            FROM player_phase
+            WHERE role = 'bowl'
+            GROUP BY phase, player
+        ) sub
+        GROUP BY phase
+    """.format(phase=PHASE_LABEL))
+    rows = cur.fetchall()
+
+    cur.execute("""
+        SELECT
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY dot_pct)::NUMERIC, 2) AS dot_95_global,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY wicket_pct)::NUMERIC, 2) AS wicket_95_global,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY bei)::NUMERIC, 2) AS bei_95_global
+        FROM (
+            SELECT
+                player,
+                (SUM(dots)::NUMERIC / SUM(deliveries)) * 100 AS dot_pct,
+                (SUM(out_flags)::NUMERIC / SUM(deliveries)) * 100 AS wicket_pct,
+                (
+                    (0.3 * (100 - ((SUM(score)::NUMERIC / NULLIF(SUM(ball_ids), 0)) * 6))) +
+                    (0.3 * ((SUM(dots)::NUMERIC / SUM(deliveries) * 100))) +
+                    (0.2 * ((SUM(out_flags)::NUMERIC / SUM(deliveries) * 100))) +
+                    (0.2 * (100 - (SUM(boundaries)::NUMERIC / SUM(deliveries) * 100)))
+                ) AS bei
+            FROM player_phase
+            WHERE role = 'bowl'
+            GROUP BY player
+        ) sub
+    """)
+    return {"phase": {row["phase"]: row for row in rows}, "global": cur.fetchone()}
+
+
+BENCHMARKS = {
+    "batting": batting_benchmarks,
+    "bowling": bowling_benchmarks,
+}
+
+# NUMERIC values are stored as strings, which is how the API has always
+# rendered them
+_dumps = functools.partial(json.dumps, default=str)
+
+
+def dataset_version(cur):
+    return dataset_stamp(cur)[0]
+
+
+# (version, loaded_at) of the latest load; (0, None) before the first one
+def dataset_stamp(cur):
+    cur.execute("SELECT to_regclass('odi_ingest_log') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0, None
+    cur.execute("SELECT version, loaded_at FROM odi_ingest_log ORDER BY version DESC LIMIT 1")
+    row = cur.fetchone()
+    return tuple(row) if row else (0, None)
+
+
+def _computed(cur, version):
+    cur.execute("SELECT COUNT(*) FROM benchmarks WHERE version = %s", (version,))
+    return cur.fetchone()[0] == len(BENCHMARKS)
+
+
+# Compute every benchmark for the current dataset version unless it is
+# already stored or another process is computing it. Older versions are
+# removed once the new one is in place. Returns the version computed, if any.
+def refresh(conn, force=False):
+    with conn.cursor() as cur:
+        cur.execute(BENCHMARKS_SQL)
+        version = dataset_version(cur)
+        if _computed(cur, version) and not force:
+            return None
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            return None
+        try:
+            # Another process may have finished between the check and the lock
+            if _computed(cur, version) and not force:
+                return None
+            for name, compute in BENCHMARKS.items():
+                with conn.cursor(cursor_factory=RealDictCursor) as dict_cur:
+                    payload = compute(dict_cur)
+                cur.execute("""
+                    INSERT INTO benchmarks (name, version, payload) VALUES (%s, %s, %s)
+                    ON CONFLICT (name, version) DO UPDATE SET payload = EXCLUDED.payload, computed_at = now()
+                """, (name, version, Json(payload, dumps=_dumps)))
+                cur.execute("DELETE FROM benchmarks WHERE name = %s AND version < %s", (name, version))
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+    return version
+
+
+# Version of the latest stored payload, None if there is none
+def stored_version(conn, name):
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT MAX(version) FROM benchmarks WHERE name = %s", (name,))
+            return cur.fetchone()[0]
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return None
+
+
+def _latest(conn, name):
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT payload FROM benchmarks WHERE name = %s ORDER BY version DESC LIMIT 1", (name,))
+            row = cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return None
+    return row[0] if row else None
+
+
+# Latest stored payload. Until the background job has caught up with a new
+# load this is the previous version's; only the very first request on an
+# empty table computes inline. None means another process is computing it.
+def get(conn, name):
+    payload = _latest(conn, name)
+    if payload is None:
+        refresh(conn)
+        payload = _latest(conn, name)
+    return payload
+
+
+class Refresher(threading.Thread):
+    def __init__(self, pool, interval=REFRESH_INTERVAL):
+        super().__init__(name="benchmark-refresher", daemon=True)
+        self.pool = pool
+        self.interval = interval
+
+    def run(self):
+        while True:
+            try:
+                conn = self.pool.connection()
+                try:
+                    version = refresh(conn)
+                finally:
+                    conn.close()
+                if version is not None:
+                    print("Benchmarks computed for dataset version {}".format(version))
+            except Exception as e:
+                print("Benchmark refresh failed:", e)
+            time.sleep(self.interval)
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start(pool, interval=REFRESH_INTERVAL):
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = Refresher(pool, interval)
+            _refresher.start()
+    return _refresher
+
+
+# Start the refresher with the first request, in whichever process serves it
+def init_app(app, pool):
+    @app.before_request
+    def start_benchmark_refresher():
+        if _refresher is None and REFRESH_ENABLED:
+            start(pool)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the global benchmark tables")
+    parser.add_argument('--force', action='store_true', help="recompute even if the current version is stored")
+    args = parser.parse_args()
+    conn = psycopg2.connect(**db.db_params)
+    conn.autocommit = True
+    version = refresh(conn, force=args.force)
+    conn.close()
+    print("Computed version {}".format(version) if version is not None else "Benchmarks are up to date")
@@ -0,0 +1,382 @@
+import collections
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from flask import current_app, g, jsonify, request
+
+import benchmarks
+
+# Response cache for the Flask routes. The data only changes when server.py
+# loads a new dataset, so responses are kept per endpoint and query string
+# until the dataset version (the latest odi_ingest_log entry) changes, their
+# endpoint's TTL runs out or they are evicted as least recently used.
+#
+#     @app.route('/api/teams')
+#     @cache.cached(ttl=cache.LIST_TTL)
+#     def get_teams(): ...
+#
+# Entries live in a backend chosen by CACHE_BACKEND:
+#   memory  per-process LRU (the default)
+#   file    a directory shared by every worker on the host, on /dev/shm
+#           where it exists
+#   redis   a Redis server at CACHE_REDIS_URL shared by every host; configure
+#           the server with maxmemory-policy allkeys-lru for eviction
+# With file or redis a response computed by one worker is served by all of
+# them, so the hit rate does not fall as workers are added.
+
+BACKEND = os.getenv("CACHE_BACKEND", "memory")
+REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_DIR = os.getenv("CACHE_DIR") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "odi-cache")
+# Most entries kept per process (memory) or per host (file)
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 2048))
+# Seconds a response is served from the cache, by default and for the
+# pick-lists (teams, players, seasons, matches)
+DEFAULT_TTL = float(os.getenv("CACHE_TTL", 3600))
+LIST_TTL = float(os.getenv("CACHE_LIST_TTL", 86400))
+# Seconds between checks of the dataset version
+VERSION_INTERVAL = float(os.getenv("CACHE_VERSION_INTERVAL", 5))
+
+
+# Entries are stored as bytes: the response as rendered, so a hit costs no
+# serialization at all
+def encode_response(mimetype, body):
+    return b"R" + mimetype.encode() + b"\n" + body
+
+
+# (mimetype, body) of a stored response
+def decode(data):
+    mimetype, _, body = data[1:].partition(b"\n")
+    return mimetype.decode(), body
+
+
+class MemoryBackend:
+    # Thread-safe LRU map of (version, key) -> (expires_at, data)
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, version, key):
+        with self._lock:
+            entry = self._entries.get((version, key))
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[(version, key)]
+                return None
+            self._entries.move_to_end((version, key))
+            return entry[1]
+
+    def set(self, version, key, data, ttl):
+        with self._lock:
+            self._entries[(version, key)] = (time.time() + ttl, data)
+            self._entries.move_to_end((version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, version):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+class FileBackend:
+    # One file per entry under <directory>/<version>/, written to a temporary
+    # name and renamed so no worker ever reads a partial entry. A file's mtime
+    # is its expiry time and its atime is bumped on every hit, for eviction.
+
+    def __init__(self, directory=CACHE_DIR, max_entries=MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, version, key):
+        return os.path.join(self.directory, str(version), hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, version, key):
+        path = self._path(version, key)
+        try:
+            expires = os.stat(path).st_mtime
+            if expires <= time.time():
+                os.unlink(path)
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, (time.time(), expires))
+            return data
+        except FileNotFoundError:
+            return None
+
+    def set(self, version, key, data, ttl):
+        path = self._path(version, key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        now = time.time()
+        os.utime(tmp, (now, now + ttl))
+        os.replace(tmp, path)
+        self._writes += 1
+        if self._writes % 64 == 0:
+            self._evict(directory)
+
+    # Drop the least recently read entries once a version holds too many
+    def _evict(self, directory):
+        entries = []
+        for entry in os.scandir(directory):
+            try:
+                entries.append((entry.stat().st_atime, entry.path))
+            except FileNotFoundError:
+                pass
+        for _, path in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.unlink(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+
+    # Remove every other version's entries
+    def invalidate(self, version):
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.name != str(version):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def metrics(self):
+        entries = sum(len(files) for _, _, files in os.walk(self.directory))
+        return {"entries": entries, "max_entries": self.max_entries, "evictions": self.evictions,
+                "directory": self.directory}
+
+
+class RedisBackend:
+    # Keys are namespaced by version and expire with their TTL, so an old
+    # version's entries age out on their own
+
+    def __init__(self, url=REDIS_URL, prefix="odi:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, version, key):
+        return "{}{}:{}".format(self.prefix, version, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, version, key):
+        return self.client.get(self._key(version, key))
+
+    def set(self, version, key, data, ttl):
+        self.client.set(self._key(version, key), data, px=int(ttl * 1000))
+
+    def invalidate(self, version):
+        pass
+
+    def metrics(self):
+        info = self.client.info("stats")
+        return {"evictions": info.get("evicted_keys"), "expirations": info.get("expired_keys")}
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "file": FileBackend,
+    "redis": RedisBackend,
+}
+
+
+class ResponseCache:
+    # The dataset version and this process's lookup counts, in front of a
+    # storage backend
+
+    def __init__(self, pool, backend, version_interval=VERSION_INTERVAL):
+        self.pool = pool
+        self.backend = backend
+        self.version_interval = version_interval
+
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded_at = None
+        self._version_checked = 0.0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "errors": 0,
+        }
+
+    def _load_version(self):
+        conn = self.pool.connection()
+        try:
+            with conn.cursor() as cur:
+                return benchmarks.dataset_stamp(cur)
+        finally:
+            conn.close()
+
+    # Current dataset version, read from the database at most once per
+    # version_interval. A change invalidates the older entries.
+    def version(self):
+        now = time.monotonic()
+        if now - self._version_checked < self.version_interval:
+            return self._version
+        version, loaded_at = self._load_version()
+        with self._lock:
+            self._version_checked = now
+            self._loaded_at = loaded_at
+            changed = version != self._version
+            if changed and self._version is not None:
+                self.stats["invalidations"] += 1
+            self._version = version
+        if changed:
+            self.backend.invalidate(version)
+        return version
+
+    # When the current version was loaded (None before the first load)
+    def loaded_at(self):
+        self.version()
+        return self._loaded_at
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    # A failing backend (Redis restarting, a full disk) degrades to misses
+    def get(self, version, key):
+        try:
+            data = self.backend.get(version, key)
+        except Exception as e:
+            print("Cache read failed:", e)
+            self._count("errors")
+            data = None
+        self._count("misses" if data is None else "hits")
+        return None if data is None else decode(data)
+
+    # `version` is the one read before the response was computed: something
+    # computed while a new dataset was loaded is not stored under the new
+    # version
+    def set(self, version, key, data, ttl=DEFAULT_TTL):
+        if version != self.version():
+            return
+        try:
+            self.backend.set(version, key, data, ttl)
+        except Exception as e:
+            print("Cache write failed:", e)
+            self._count("errors")
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["version"] = self._version
+        stats["backend"] = type(self.backend).__name__
+        try:
+            stats.update(self.backend.metrics())
+        except Exception as e:
+            stats["backend_error"] = str(e)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0
+        return stats
+
+
+_cache = None
+
+
+# Endpoint plus query args, sorted so that parameter order does not matter.
+# Values are kept as given: the handlers treat '' and a missing arg differently.
+def request_key():
+    args = sorted((name, value) for name, values in request.args.lists() for value in values)
+    return "{}?{}".format(request.path, urlencode(args))
+
+
+# The current route's revision (see cached), computed once per request
+def revision():
+    compute = getattr(current_app.view_functions.get(request.endpoint), "revision", None)
+    if compute is None:
+        return None
+    if "cache_revision" not in g:
+        g.cache_revision = compute()
+    return g.cache_revision
+
+
+def cache_key():
+    value = revision()
+    return request_key() if value is None else "{}#{}".format(request_key(), value)
+
+
+def dataset_version():
+    return _cache.version()
+
+
+def dataset_loaded_at():
+    return _cache.loaded_at()
+
+
+# (dataset version, stored response) for the current request. The response
+# is None if there is none or the request was sent with Cache-Control:
+# no-cache; the version is what store_response() needs for the response
+# computed instead.
+def cached_response():
+    if _cache is None:
+        return None, None
+    version = _cache.version()
+    if request.cache_control.no_cache:
+        return version, None
+    hit = _cache.get(version, cache_key())
+    if hit is None:
+        return version, None
+    mimetype, body = hit
+    return version, current_app.response_class(body, mimetype=mimetype)
+
+
+# Store the response to the current request, computed from dataset version
+# `version`; only 200 responses are kept
+def store_response(response, version, ttl=DEFAULT_TTL):
+    if _cache is not None and response.status_code == 200:
+        _cache.set(version, cache_key(), encode_response(response.mimetype, response.get_data()), ttl)
+
+
+# Serve the wrapped route from the cache. Flask-CORS adds its headers on the
+# way out. A request sent with Cache-Control: no-cache is recomputed (and the
+# fresh response stored). Cached routes are also the ones that get ETags (see
+# http_cache.py), as their response depends only on the request and the
+# dataset version. asgi.py applies the same to its async routes.
+#
+# A response that can change within one dataset version names what it also
+# depends on with `revision`, a function called once per request whose value
+# becomes part of the key.
+def cached(ttl=DEFAULT_TTL, revision=None):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version, hit = cached_response()
+            if hit is not None:
+                return hit
+            response = current_app.make_response(view(*args, **kwargs))
+            store_response(response, version, ttl)
+            return response
+        wrapper.cacheable = True
+        wrapper.revision = revision
+        return wrapper
+    return decorator
+
+
+def init_app(app, pool, backend=BACKEND):
+    global _cache
+    _cache = ResponseCache(pool, BACKENDS[backend]())
+
+    @app.route('/api/cache-stats')
+    def get_cache_stats():
+        return jsonify(_cache.metrics())
+
+    return _cache
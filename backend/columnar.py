@@ -0,0 +1,863 @@
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import benchmarks
+import db
+import metrics
+
+# In-memory columnar engine. With ODI_ENGINE=memory every process loads the
+# odi_db columns the API aggregates into NumPy arrays, and the queries built
+# by metrics.select() are answered from them with vectorized filter and
+# group-by kernels instead of a round trip to Postgres. The rows come back in
+# the same shape and types RealDictCursor gives (ints, Decimals rounded like
+# ROUND(..., 2), None for NULL), so handlers and their JSON are unchanged.
+#
+# Anything the engine cannot answer (plain SQL, an unfamiliar predicate) and
+# every query until the current dataset version is loaded goes to Postgres
+# as before. parity.py compares the two engines endpoint by endpoint.
+#
+# Rows are stored sorted by batter, and a second permutation orders them by
+# bowler, each with per-player offsets (see Table.index), so a query for one
+# player starts from that player's balls instead of scanning every row.
+#
+# With ODI_ENGINE=memory (or --snapshot) server.py writes each dataset
+# version's table as a snapshot (see save_snapshot) that workers map
+# read-only: a worker starts serving from memory in milliseconds, and all
+# workers share one copy in the page cache. Without a snapshot a worker
+# loads the table from Postgres itself.
+
+ENGINE = os.getenv("ODI_ENGINE", "postgres")
+# Rows fetched per round trip while loading
+LOAD_CHUNK = int(os.getenv("COLUMNAR_LOAD_CHUNK", 100_000))
+# Relative to this file, so the loader and the workers agree whatever their
+# working directory
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.getenv("COLUMNAR_SNAPSHOT_DIR", "columnar-snapshots"))
+# Older snapshots kept besides the newest, for workers still on that version
+SNAPSHOT_KEEP = int(os.getenv("COLUMNAR_SNAPSHOT_KEEP", 1))
+SNAPSHOT_FORMAT = 1
+
+# odi_db columns the engine keeps; any missing from the table are skipped
+COLUMNS = [
+    "p_match", "year", "bat", "bowl", "team_bat", "team_bowl", "bat_hand", "bowl_kind", "bowl_style",
+    "phase", "line", "length", "shot", "wagonzone", "outcome", "out", "batruns", "ballfaced", "bowlruns",
+    "score", "ball_id", "control", "is_dot", "is_boundary", "is_bowler_wicket",
+]
+
+# Columns with a per-value row index; the rows are stored sorted by the first
+INDEXES = ["bat", "bowl"]
+# An ILIKE matching more players than this scans the table instead
+MAX_LOOKUP_CODES = 256
+
+INTEGER_TYPES = {"smallint", "integer", "bigint"}
+DECIMAL_TYPES = {"numeric", "double precision", "real"}
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Table:
+    # One array per column. Text columns are dictionary encoded: the array
+    # holds small unsigned codes into categories[name], the column's sorted
+    # distinct values, with NULL stored as '' (the loader never stores ''
+    # itself, so NULL is code 0 when present). NUMERIC columns are int64
+    # scaled by 10 ** scales[name] so sums stay exact. valid[name] marks the
+    # non-NULL rows of every other column that has NULLs.
+
+    def __init__(self, columns, valid, scales, version, categories=None, indexes=None):
+        self.columns = columns
+        self.valid = valid
+        self.scales = scales
+        self.version = version
+        self.categories = categories or {}
+        self.rows = len(next(iter(columns.values()))) if columns else 0
+        self._predicates = {}
+        self._indexes = indexes or {}
+
+    def column(self, name):
+        if name not in self.columns:
+            raise Unsupported("column {} is not loaded".format(name))
+        return self.columns[name]
+
+    def is_text(self, name):
+        return name in self.categories
+
+    def _nullable_text(self, name):
+        categories = self.categories.get(name)
+        return categories is not None and len(categories) > 0 and categories[0] == ""
+
+    def not_null(self, name):
+        if self._nullable_text(name):
+            return self.predicate(("not_null", name), lambda: self.columns[name] != 0)
+        valid = self.valid.get(name)
+        return valid if valid is not None else np.ones(self.rows, dtype=bool)
+
+    # not_null(name)[idx], without building a full mask for a column with
+    # no NULLs
+    def not_null_at(self, name, idx):
+        if self._nullable_text(name):
+            return self.columns[name][idx] != 0
+        valid = self.valid.get(name)
+        return valid[idx] if valid is not None else np.ones(len(idx), dtype=bool)
+
+    # Row masks are computed once per table and reused by every query
+    def predicate(self, key, compute):
+        if key not in self._predicates:
+            self._predicates[key] = compute()
+        return self._predicates[key]
+
+    # (sorted distinct values, code of each row) of a text column
+    def dictionary(self, name):
+        if name not in self.categories:
+            raise Unsupported("{} is not a text column".format(name))
+        return self.categories[name], self.columns[name]
+
+    # Mask of the rows where a text column equals value
+    def equals(self, name, value):
+        categories, codes = self.dictionary(name)
+        code = np.searchsorted(categories, value)
+        if code == len(categories) or categories[code] != value:
+            return np.zeros(self.rows, dtype=bool)
+        return codes == code
+
+    # (order, offsets) of a text column: the rows holding dictionary code c
+    # are order[offsets[c]:offsets[c + 1]], or simply that range of rows when
+    # the table is sorted by the column (order is None)
+    def index(self, name):
+        if name not in self._indexes:
+            _, codes = self.dictionary(name)
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(codes))))
+            order = None
+            if not np.all(codes[:-1] <= codes[1:]):
+                order = np.argsort(codes, kind="stable").astype(np.int32 if self.rows < 2 ** 31 else np.int64)
+            self._indexes[name] = (order, offsets)
+        return self._indexes[name]
+
+    # Row numbers holding any of the given codes; O(rows found)
+    def lookup(self, name, codes):
+        order, offsets = self.index(name)
+        if order is None:
+            slices = [np.arange(offsets[c], offsets[c + 1]) for c in codes]
+        else:
+            slices = [order[offsets[c]:offsets[c + 1]] for c in codes]
+        return np.concatenate(slices) if slices else np.zeros(0, dtype=np.int64)
+
+    # Bytes held by the columns, masks, dictionaries and indexes
+    def nbytes(self):
+        arrays = list(self.columns.values()) + list(self.valid.values()) + list(self.categories.values())
+        for order, offsets in self._indexes.values():
+            arrays += [offsets] if order is None else [order, offsets]
+        strings = sum(sys.getsizeof(value) for values in self.categories.values() for value in values)
+        return sum(a.nbytes for a in arrays) + strings
+
+
+def _build_column(values, data_type):
+    if data_type in INTEGER_TYPES:
+        valid = np.array([v is not None for v in values], dtype=bool)
+        array = np.array([v if v is not None else 0 for v in values], dtype=np.int64)
+        return array, (None if valid.all() else valid), None
+    if data_type in DECIMAL_TYPES:
+        decimals = [None if v is None else Decimal(str(v)) for v in values]
+        scale = max((-d.as_tuple().exponent for d in decimals if d is not None), default=0)
+        scale = max(scale, 0)
+        valid = np.array([d is not None for d in decimals], dtype=bool)
+        array = np.array([int(d.scaleb(scale)) if d is not None else 0 for d in decimals], dtype=np.int64)
+        return array, (None if valid.all() else valid), scale
+    return np.array([bool(v) for v in values], dtype=bool), None, None
+
+
+def _is_text(data_type):
+    return data_type not in INTEGER_TYPES and data_type not in DECIMAL_TYPES and data_type != "boolean"
+
+
+# The smallest unsigned integer type holding codes below n
+def _code_type(n):
+    return np.min_scalar_type(max(n - 1, 0))
+
+
+# (sorted distinct values, codes) of a text array, NULL and '' as ''
+def encode(array):
+    categories, codes = np.unique(np.where(array == None, "", array), return_inverse=True)  # noqa: E711
+    return categories, codes.astype(_code_type(len(categories)))
+
+
+class _Encoder:
+    # Dictionary encodes a text column while it is being fetched, so only one
+    # chunk of its values is ever held as Python strings
+
+    def __init__(self):
+        self.codes = {}
+        self.rows = []
+
+    def extend(self, values):
+        codes = self.codes
+        self.rows.extend(codes.setdefault("" if v is None else str(v), len(codes)) for v in values)
+
+    # (sorted distinct values, codes), as encode() returns
+    def finish(self):
+        values = np.array(list(self.codes), dtype=object)
+        order = np.argsort(values)
+        recode = np.empty(len(values), dtype=_code_type(len(values)))
+        recode[order] = np.arange(len(values))
+        codes = recode[np.array(self.rows, dtype=np.int64)] if self.rows else np.zeros(0, dtype=recode.dtype)
+        return values[order], codes
+
+
+def load(params=None, table="odi_db"):
+    if np is None:
+        raise RuntimeError("ODI_ENGINE=memory needs numpy")
+    conn = psycopg2.connect(**(params or db.db_params))
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s",
+                        (table,))
+            types = dict(cur.fetchall())
+            version = benchmarks.dataset_version(cur)
+        names = [name for name in COLUMNS if name in types]
+        data = {name: _Encoder() if _is_text(types[name]) else [] for name in names}
+        # Server-side cursor, so the client holds one chunk of rows at a time
+        with conn.cursor(name="columnar_load") as cur:
+            cur.itersize = LOAD_CHUNK
+            cur.execute("SELECT {} FROM {}".format(", ".join('"{}"'.format(n) for n in names), table))
+            while True:
+                rows = cur.fetchmany(LOAD_CHUNK)
+                if not rows:
+                    break
+                for i, name in enumerate(names):
+                    data[name].extend(row[i] for row in rows)
+        conn.rollback()
+    finally:
+        conn.close()
+    return from_values(data, types, version)
+
+
+# A Table from column name -> values (an _Encoder for text columns) and the
+# columns' Postgres types. Consumes `data`.
+def from_values(data, types, version):
+    columns, valid, scales, categories = {}, {}, {}, {}
+    for name in list(data):
+        if _is_text(types[name]):
+            categories[name], columns[name] = data.pop(name).finish()
+            continue
+        array, not_null, scale = _build_column(data.pop(name), types[name])
+        columns[name] = array
+        if not_null is not None:
+            valid[name] = not_null
+        if scale is not None:
+            scales[name] = scale
+    # SUM(CASE WHEN is_boundary THEN batruns ELSE 0 END) as a column
+    if "batruns" in columns and "is_boundary" in columns:
+        batruns_valid = valid.get("batruns")
+        columns["boundary_batruns"] = np.where(columns["is_boundary"], columns["batruns"], 0)
+        if batruns_valid is not None:
+            valid["boundary_batruns"] = ~columns["is_boundary"] | batruns_valid
+    return build_table(columns, valid, scales, version, categories)
+
+
+# A Table over the columns, reordered by INDEXES[0], with its indexes built.
+# Text columns either come encoded, with their categories, or as object
+# arrays to encode here.
+def build_table(columns, valid, scales, version, categories=None):
+    columns, valid, categories = dict(columns), dict(valid), dict(categories or {})
+    for name, array in columns.items():
+        if array.dtype == object:
+            categories[name], columns[name] = encode(array)
+            valid.pop(name, None)
+    if INDEXES[0] in columns:
+        order = np.argsort(columns[INDEXES[0]], kind="stable")
+        columns = {name: array[order] for name, array in columns.items()}
+        valid = {name: array[order] for name, array in valid.items()}
+    table = Table(columns, valid, scales, version, categories)
+    for name in INDEXES:
+        if name in columns:
+            table.index(name)
+    return table
+
+
+# A snapshot is a directory SNAPSHOT_DIR/v<version> holding one .npy file
+# per array (columns, NULL masks, index offsets and orders) and
+# manifest.json with the dictionaries and scales. It is written under a
+# temporary name and renamed into place, so a directory that exists is
+# complete.
+def save_snapshot(table, directory=SNAPSHOT_DIR):
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, "v{}".format(table.version))
+    if os.path.isdir(target):
+        return target
+    arrays = {"column." + name: array for name, array in table.columns.items()}
+    arrays.update(("valid." + name, array) for name, array in table.valid.items())
+    indexes = {}
+    for name in INDEXES:
+        if name in table.columns:
+            order, offsets = table.index(name)
+            arrays["offsets." + name] = offsets
+            if order is not None:
+                arrays["order." + name] = order
+            indexes[name] = order is not None
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": table.version,
+        "rows": table.rows,
+        "columns": list(table.columns),
+        "valid": list(table.valid),
+        "scales": table.scales,
+        "categories": {name: [str(value) for value in values] for name, values in table.categories.items()},
+        "indexes": indexes,
+    }
+
+    staging = tempfile.mkdtemp(prefix=".v{}-".format(table.version), dir=directory)
+    try:
+        for key, array in arrays.items():
+            np.save(os.path.join(staging, key + ".npy"), np.ascontiguousarray(array), allow_pickle=False)
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        os.rename(staging, target)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        # Another loader published the same version first
+        if not os.path.isdir(target):
+            raise
+    _prune_snapshots(directory)
+    return target
+
+
+# Workers that mapped a removed snapshot keep their mapping until they
+# move to a newer version
+def _prune_snapshots(directory, keep=SNAPSHOT_KEEP):
+    versions = sorted(int(name[1:]) for name in os.listdir(directory) if re.match(r"^v\d+$", name))
+    for version in versions[:-(keep + 1)]:
+        shutil.rmtree(os.path.join(directory, "v{}".format(version)), ignore_errors=True)
+
+
+# The snapshot of a dataset version mapped read-only, or None if there is none
+def open_snapshot(version, directory=SNAPSHOT_DIR):
+    if np is None or version is None:
+        return None
+    path = os.path.join(directory, "v{}".format(version))
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest["format"] != SNAPSHOT_FORMAT:
+        return None
+
+    def mapped(key):
+        return np.load(os.path.join(path, key + ".npy"), mmap_mode="r")
+
+    columns = {name: mapped("column." + name) for name in manifest["columns"]}
+    valid = {name: mapped("valid." + name) for name in manifest["valid"]}
+    categories = {name: np.array(values, dtype=object) for name, values in manifest["categories"].items()}
+    indexes = {name: (mapped("order." + name) if ordered else None, mapped("offsets." + name))
+               for name, ordered in manifest["indexes"].items()}
+    return Table(columns, valid, manifest["scales"], version, categories, indexes)
+
+
+# Counter name -> (column summed or None to count rows, row predicate),
+# matching metrics.COUNTERS
+KERNELS = {
+    "runs": ("batruns", None),
+    "balls_faced": ("ballfaced", None),
+    "deliveries": (None, None),
+    "ball_ids": (None, lambda t: t.not_null("ball_id")),
+    "bowl_runs": ("bowlruns", None),
+    "score": ("score", None),
+    "outs": (None, lambda t: t.equals("outcome", "out")),
+    "out_flags": (None, lambda t: t.column("out")),
+    "bowler_wickets": (None, lambda t: t.column("is_bowler_wicket")),
+    "dots": (None, lambda t: t.column("is_dot")),
+    "boundaries": (None, lambda t: t.column("is_boundary")),
+    "boundary_runs": ("boundary_batruns", None),
+    "singles": (None, lambda t: (t.column("batruns") == 1) & t.not_null("batruns")),
+    "control_sum": ("control", None),
+    "control_count": (None, lambda t: t.not_null("control")),
+    "matches": ("p_match", "distinct"),
+}
+
+
+# Summary tables as views over the balls: column -> odi_db column. A summary
+# counter is SUM(column), which is NULL over no rows even for counts.
+_CUBE = {"player": "bat", "bowl_kind": "bowl_kind", "bowl_style": "bowl_style", "phase": "phase"}
+SUMMARY_SOURCES = {
+    "bat_rollup": {"player": "bat", "opponent": "team_bowl", "year": "year"},
+    "bowl_rollup": {"player": "bowl", "opponent": "team_bat", "year": "year"},
+    "bat_line_length": dict(_CUBE, line="line", length="length"),
+    "bat_line_length_bowler": dict(_CUBE, line="line", length="length", bowler="bowl"),
+    "bat_wagon": dict(_CUBE, wagonzone="wagonzone"),
+    "bat_wagon_bowler": dict(_CUBE, wagonzone="wagonzone", bowler="bowl"),
+}
+PLAYER_PHASE_ROLES = {
+    "bat": {"player": "bat", "phase": "phase", "bowl_style": "bowl_style", "bowl_kind": "bowl_kind"},
+    "bowl": {"player": "bowl", "phase": "phase", "bowl_style": "bowl_style", "bowl_kind": "bowl_kind"},
+}
+
+_PREDICATE = re.compile(r"^\s*(\w+)\s+(=|ILIKE)\s+(%s|'[^']*')\s*$", re.IGNORECASE)
+_DIMENSION = re.compile(r"^\s*(\w+)(?:\s+AS\s+(\w+))?\s*$", re.IGNORECASE)
+_HAVING = re.compile(r"^\s*\{(\w+)\}\s*(>=|<=|>|<|=)\s*(\d+)\s*$")
+_ORDER = re.compile(r"^\s*(\w+)(?:\s+(ASC|DESC))?\s*$", re.IGNORECASE)
+
+
+def _like(pattern):
+    parts = (".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+    return re.compile("".join(parts), re.IGNORECASE | re.DOTALL)
+
+
+def _coerce(column, value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        # Postgres would reject the value; let it report the error
+        raise Unsupported("{!r} is not a valid {}".format(value, column))
+
+
+class Plan:
+    # A metrics.select() spec bound to one table: resolves summary-table
+    # columns to odi_db columns and predicates to row masks
+
+    def __init__(self, table, spec):
+        self.table = table
+        self.spec = spec
+        self.summary = spec["source"] != "odi_db"
+        where = list(spec["where"])
+        if spec["source"] == "odi_db":
+            self.mapping = None
+        elif spec["source"] in SUMMARY_SOURCES:
+            self.mapping = SUMMARY_SOURCES[spec["source"]]
+        elif spec["source"] == "player_phase":
+            roles = [p for p in where if re.match(r"^\s*role\s*=\s*'(\w+)'\s*$", p)]
+            if len(roles) != 1:
+                raise Unsupported("player_phase needs a role")
+            where.remove(roles[0])
+            role = re.match(r"^\s*role\s*=\s*'(\w+)'\s*$", roles[0]).group(1)
+            self.mapping = PLAYER_PHASE_ROLES[role]
+        else:
+            raise Unsupported("unknown source {}".format(spec["source"]))
+        self.where = where
+
+    def resolve(self, column):
+        if self.mapping is None:
+            return column.lower()
+        if column.lower() not in self.mapping:
+            raise Unsupported("{} has no column {}".format(self.spec["source"], column))
+        return self.mapping[column.lower()]
+
+    def condition(self, predicate, params):
+        match = _PREDICATE.match(predicate)
+        if not match:
+            raise Unsupported("predicate {!r}".format(predicate))
+        column, op, operand = match.groups()
+        value = next(params) if operand == "%s" else operand[1:-1]
+        return self.resolve(column), op.upper(), value
+
+    # Dictionary codes of a text column that satisfy `column op value`
+    def codes(self, column, op, value):
+        uniques, _ = self.table.dictionary(column)
+        if op == "ILIKE":
+            regex = _like(str(value))
+            return [code for code, text in enumerate(uniques) if text and regex.fullmatch(text)]
+        code = np.searchsorted(uniques, str(value))
+        if value == "" or code == len(uniques) or uniques[code] != str(value):
+            return []
+        return [int(code)]
+
+    # Mask over the rows idx of one condition
+    def test(self, condition, idx):
+        column, op, value = condition
+        if value is None:
+            return np.zeros(len(idx), dtype=bool)
+        array = self.table.column(column)
+        if not self.table.is_text(column):
+            if op == "ILIKE":
+                raise Unsupported("ILIKE on {}".format(column))
+            return (array[idx] == _coerce(column, value)) & self.table.not_null_at(column, idx)
+        _, codes = self.table.dictionary(column)
+        matched = self.codes(column, op, value)
+        if len(matched) == 1:
+            return codes[idx] == matched[0]
+        return np.isin(codes[idx], matched)
+
+    # Row numbers matching the WHERE clause. A predicate on an indexed
+    # column picks the candidate rows; the others are tested on those only.
+    def rows(self, params):
+        params = iter(params or ())
+        conditions = [self.condition(predicate, params) for predicate in self.where]
+        idx = None
+        for condition in conditions:
+            column, op, value = condition
+            if column in INDEXES and column in self.table.columns and value is not None:
+                matched = self.codes(column, op, value)
+                if len(matched) <= MAX_LOOKUP_CODES:
+                    idx = self.table.lookup(column, matched)
+                    conditions.remove(condition)
+                    break
+        if idx is None:
+            idx = np.arange(self.table.rows)
+        # A summary table only covers balls with a player
+        if self.mapping is None:
+            keep = np.ones(len(idx), dtype=bool)
+        else:
+            keep = self.table.not_null_at(self.mapping["player"], idx)
+        for condition in conditions:
+            keep &= self.test(condition, idx)
+        return idx[keep]
+
+
+def _group(table, plan, idx):
+    # Group ids for the selected rows, the number of groups and each group's
+    # dimension values. NULL forms its own group, as in SQL.
+    dims = []
+    for dimension in plan.spec["dimensions"]:
+        match = _DIMENSION.match(dimension)
+        if not match:
+            raise Unsupported("dimension {!r}".format(dimension))
+        dims.append((plan.resolve(match.group(1)), (match.group(2) or match.group(1)).lower()))
+    if not dims:
+        return np.zeros(len(idx), dtype=np.int64), 1, [], [()]
+
+    codes, labels, sizes = [], [], []
+    for column, _ in dims:
+        if table.is_text(column):
+            dictionary, all_codes = table.dictionary(column)
+            present, inverse = np.unique(all_codes[idx], return_inverse=True)
+            uniques = dictionary[present]
+        else:
+            uniques, inverse = np.unique(table.column(column)[idx], return_inverse=True)
+        not_null = table.not_null_at(column, idx)
+        codes.append(np.where(not_null, inverse + 1, 0))
+        labels.append([None] + [u.item() if hasattr(u, "item") else u for u in uniques])
+        sizes.append(len(uniques) + 1)
+    combined = np.ravel_multi_index(codes, sizes) if codes[0].size else np.zeros(0, dtype=np.int64)
+    groups, inverse = np.unique(combined, return_inverse=True)
+    keys = np.unravel_index(groups, sizes)
+    values = [tuple(labels[d][keys[d][i]] for d in range(len(dims))) for i in range(len(groups))]
+    return inverse, len(groups), [name for _, name in dims], values
+
+
+# Codes over the rows idx, equal where the rows agree on every column (NULL
+# being a value of its own)
+def _combined(table, columns, idx):
+    parts = []
+    for column in columns:
+        values = table.dictionary(column)[1] if table.is_text(column) else table.column(column)
+        _, inverse = np.unique(values[idx], return_inverse=True)
+        parts.append(np.where(table.not_null_at(column, idx), inverse + 1, 0))
+    return np.unique(np.stack(parts, axis=1), axis=0, return_inverse=True)[1].reshape(-1)
+
+
+# `keep` is the FILTER predicate's mask over idx, or None
+def _counter(table, plan, name, idx, groups, n, keep):
+    if name not in KERNELS:
+        raise Unsupported("counter {}".format(name))
+    column, row_predicate = KERNELS[name]
+    if keep is not None:
+        idx, groups = idx[keep], groups[keep]
+    # Balls per group before the counter's own predicate: a summary table
+    # has a row for the group, holding 0, whenever there are any
+    present = np.bincount(groups, minlength=n)
+    if callable(row_predicate):
+        matched = table.predicate(name, lambda: np.asarray(row_predicate(table), dtype=bool))[idx]
+        idx, groups = idx[matched], groups[matched]
+    rows = np.bincount(groups, minlength=n)
+
+    if row_predicate == "distinct":
+        if plan.summary:
+            # A summary table stores the distinct count per row of its grain
+            # (the view's columns) and the query sums those
+            codes = _combined(table, [column] + sorted(set(plan.mapping.values())), idx)
+        else:
+            _, codes = np.unique(table.column(column)[idx], return_inverse=True)
+        width = int(codes.max()) + 1 if codes.size else 1
+        pairs = np.unique(groups.astype(np.int64) * width + codes)
+        values = [int(v) for v in np.bincount(pairs // width, minlength=n)]
+        nonnull = rows
+    elif column is None:
+        values = [int(v) for v in rows]
+        nonnull = None
+    else:
+        array = table.column(column)[idx]
+        valid = table.valid.get(column)
+        weights = array if valid is None else np.where(valid[idx], array, 0)
+        sums = np.bincount(groups, weights=weights, minlength=n)
+        nonnull = rows if valid is None else np.bincount(groups, weights=valid[idx], minlength=n)
+        scale = table.scales.get(column)
+        if scale is None:
+            values = [int(round(v)) for v in sums]
+        else:
+            values = [Decimal(int(round(v))).scaleb(-scale) for v in sums]
+
+    # NULL where SQL gives NULL: SUM over no values, or any summary counter
+    # (a SUM of the stored column) over no rows
+    if plan.summary:
+        return [v if r else None for v, r in zip(values, present)]
+    if nonnull is not None:
+        return [v if c else None for v, c in zip(values, nonnull)]
+    return values
+
+
+# Metric evaluators, the same formulas as metrics.METRICS over Decimal with
+# SQL NULL propagation. `v` resolves a counter or (unrounded) metric by name.
+def _ratio(a, b, scale=1):
+    if a is None or b is None or b == 0:
+        return None
+    return Decimal(a) / Decimal(b) * scale
+
+
+def _weighted(*terms):
+    if any(value is None for _, value in terms):
+        return None
+    return sum(Decimal(weight) * Decimal(value) for weight, value in terms)
+
+
+def _complement(value):
+    return None if value is None else 100 - value
+
+
+EVALUATORS = {
+    "strike_rate": lambda v: (None if v("balls_faced") is None else Decimal(0) if v("balls_faced") == 0
+                              else _ratio(v("runs"), v("balls_faced"), 100)),
+    "average": lambda v: (None if v("outs") is None
+                          else (None if v("runs") is None else Decimal(v("runs"))) if v("outs") == 0
+                          else _ratio(v("runs"), v("outs"))),
+    "economy": lambda v: _ratio(v("bowl_runs"), v("deliveries"), 6),
+    "economy_total": lambda v: _ratio(v("score"), v("ball_ids"), 6),
+    "bowling_average": lambda v: _ratio(v("bowl_runs"), v("bowler_wickets")),
+    "bowling_strike_rate": lambda v: _ratio(v("deliveries"), v("bowler_wickets")),
+    "dot_pct": lambda v: _ratio(v("dots"), v("deliveries"), 100),
+    "boundary_pct": lambda v: _ratio(v("boundaries"), v("deliveries"), 100),
+    "singles_pct": lambda v: _ratio(v("singles"), v("deliveries"), 100),
+    "wicket_pct": lambda v: _ratio(v("out_flags"), v("deliveries"), 100),
+    "control_pct": lambda v: (_ratio(v("control_sum"), v("control_count"), 100)
+                              if v("control_count") is not None and v("control_count") > 0 else Decimal(0)),
+    "nbsr": lambda v: (None if None in (v("runs"), v("boundary_runs"), v("deliveries"), v("boundaries"))
+                       else _ratio(v("runs") - v("boundary_runs"), v("deliveries") - v("boundaries"), 100)),
+    "sri": lambda v: _weighted(("0.4", v("nbsr")), ("0.4", v("singles_pct")), ("0.2", _complement(v("dot_pct")))),
+    "bei": lambda v: _weighted(("0.3", _complement(v("economy_total"))), ("0.3", v("dot_pct")),
+                               ("0.2", v("wicket_pct")), ("0.2", _complement(v("boundary_pct")))),
+}
+
+_QUANTUM = Decimal(1).scaleb(-metrics.DECIMALS)
+
+
+def _round(value):
+    # ROUND(numeric, 2) rounds half away from zero
+    return None if value is None else Decimal(value).quantize(_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def _dependencies(name):
+    if name in metrics.COUNTERS:
+        return {name}
+    return set().union(*(_dependencies(term) for term in metrics.placeholders(metrics.METRICS[name])))
+
+
+def execute(table, spec, params):
+    plan = Plan(table, spec)
+    idx = plan.rows(params)
+    groups, n, names, keys = _group(table, plan, idx)
+
+    # Every counter each column needs, per FILTER predicate
+    having = _HAVING.match(spec["having"]) if spec["having"] else None
+    if spec["having"] and not having:
+        raise Unsupported("having {!r}".format(spec["having"]))
+    wanted = [(name, predicate) for _, name, predicate in spec["metrics"]]
+    if having:
+        wanted.append((having.group(1), None))
+    counters = {}
+    for name, predicate in wanted:
+        if name not in metrics.COUNTERS and name not in EVALUATORS:
+            raise Unsupported("metric {}".format(name))
+        mask = plan.test(plan.condition(predicate, iter(())), idx) if predicate else None
+        for counter in _dependencies(name):
+            if (counter, predicate) not in counters:
+                counters[(counter, predicate)] = _counter(table, plan, counter, idx, groups, n, mask)
+
+    def value(i, predicate):
+        def v(name):
+            if name in metrics.COUNTERS:
+                return counters[(name, predicate)][i]
+            return EVALUATORS[name](v)
+        return v
+
+    rows = []
+    for i in range(n):
+        row = dict(zip(names, keys[i]))
+        for alias, name, predicate in spec["metrics"]:
+            result = value(i, predicate)(name)
+            row[alias.lower()] = result if name in metrics.COUNTERS else _round(result)
+        if having:
+            measure = value(i, None)(having.group(1))
+            if having.group(1) not in metrics.COUNTERS:
+                measure = _round(measure)
+            if measure is None or not _compare(measure, having.group(2), int(having.group(3))):
+                continue
+        rows.append(row)
+
+    if spec["order_by"]:
+        # Stable sorts from the last key to the first; NULLs sort last
+        # ascending and first descending, as in Postgres
+        for term in reversed(spec["order_by"].split(",")):
+            match = _ORDER.match(term)
+            if not match:
+                raise Unsupported("order by {!r}".format(term))
+            key, descending = match.group(1).lower(), (match.group(2) or "").upper() == "DESC"
+            rows.sort(key=lambda row: (row[key] is None, row[key]), reverse=descending)
+    if spec["limit"]:
+        rows = rows[:int(spec["limit"])]
+    return rows
+
+
+def _compare(a, op, b):
+    return {">": a > b, ">=": a >= b, "<": a < b, "<=": a <= b, "=": a == b}[op]
+
+
+class Engine:
+    # The loaded table for the current dataset version, reloaded in the
+    # background whenever the version changes
+
+    def __init__(self):
+        self.table = None
+        self._loading = False
+        self._lock = threading.Lock()
+        self.stats = {"answered": 0, "fallbacks": 0, "loads": 0, "load_seconds": None, "snapshots": 0}
+
+    def _load(self):
+        try:
+            start = time.perf_counter()
+            table = load()
+            self.table = table
+            self.stats["loads"] += 1
+            self.stats["load_seconds"] = round(time.perf_counter() - start, 2)
+            print("Columnar engine loaded {:,} rows of dataset version {} ({:.0f} MB) in {:.1f}s".format(
+                table.rows, table.version, table.nbytes() / 2 ** 20, self.stats["load_seconds"]))
+        except Exception as e:
+            print("Columnar engine load failed:", e)
+        finally:
+            self._loading = False
+
+    def _map(self, version):
+        try:
+            start = time.perf_counter()
+            table = open_snapshot(version)
+        except Exception as e:
+            print("Columnar snapshot v{} could not be mapped: {}".format(version, e))
+            return None
+        if table is not None:
+            self.table = table
+            self.stats["snapshots"] += 1
+            print("Columnar engine mapped snapshot v{} ({:,} rows) in {:.1f} ms".format(
+                version, table.rows, (time.perf_counter() - start) * 1000))
+        return table
+
+    # The table, if it holds the dataset version being served: the snapshot
+    # when there is one, else loaded from Postgres in the background
+    def current(self):
+        # Imported here: cache needs Flask, which server.py's snapshot
+        # writer does not
+        import cache
+        version = cache.dataset_version()
+        table = self.table
+        if table is not None and table.version == version:
+            return table
+        with self._lock:
+            table = self.table
+            if table is not None and table.version == version:
+                return table
+            table = self._map(version)
+            if table is not None:
+                return table
+            if not self._loading:
+                self._loading = True
+                threading.Thread(target=self._load, name="columnar-load", daemon=True).start()
+        return None
+
+    # Rows for a metrics.select() query, or None to run it on Postgres
+    def run(self, query, params):
+        spec = getattr(query, "spec", None)
+        table = self.current() if spec is not None else None
+        if table is not None:
+            try:
+                rows = execute(table, spec, params)
+                self.stats["answered"] += 1
+                return rows
+            except Unsupported:
+                pass
+        self.stats["fallbacks"] += 1
+        return None
+
+
+engine = Engine()
+
+
+class Cursor:
+    # A psycopg2 cursor that answers what it can from the engine
+
+    def __init__(self, cursor, dict_rows):
+        self._cursor = cursor
+        self._dict_rows = dict_rows
+        self._rows = None
+
+    def execute(self, query, vars=None):
+        rows = engine.run(query, vars)
+        if rows is None:
+            self._rows = None
+            return self._cursor.execute(query, vars)
+        self._rows = rows if self._dict_rows else [tuple(row.values()) for row in rows]
+
+    def fetchall(self):
+        if self._rows is None:
+            return self._cursor.fetchall()
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        if self._rows is None:
+            return self._cursor.fetchone()
+        return self._rows.pop(0) if self._rows else None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount if self._rows is None else len(self._rows)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+
+class Connection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory")
+        return Cursor(self._conn.cursor(*args, **kwargs), factory is RealDictCursor)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# The handlers' connection, answered by the engine when ODI_ENGINE=memory
+def connection(conn):
+    return Connection(conn) if ENGINE == "memory" else conn
@@ -0,0 +1,247 @@
+import os
+import threading
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+# Database connection parameters
+db_params = {
+    "host": os.getenv("DB_HOST"),
+    "database": os.getenv("DB_DATABASE"),
+    "user": os.getenv("DB_USERNAME"),
+    "password": os.getenv("DB_PASSWORD"),
+    "port": os.getenv("DB_PORT"),
+    "sslmode": "require"
+}
+
+# Pool settings
+POOL_MIN = int(os.getenv("DB_POOL_MIN", 2))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# Seconds a request waits for a free connection before giving up
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Connections older than this are closed on return and replaced lazily
+POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", 1800))
+# Connections idle longer than this are pinged before being handed out
+POOL_HEALTHCHECK = float(os.getenv("DB_POOL_HEALTHCHECK", 30))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Callables run as hook(cursor, query, vars) before every statement executed
+# on a pooled connection. Empty in normal operation; tools such as the index
+# advisor use it to capture the SQL the endpoints actually run.
+query_hooks = []
+
+
+class ObservedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, vars=None):
+        for hook in query_hooks:
+            hook(self._cursor, query, vars)
+        return self._cursor.execute(query, vars)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+
+class PooledConnection:
+    # Wraps a psycopg2 connection so that close() hands it back to the pool
+    # instead of closing the socket. Everything else is passed through.
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def cursor(self, *args, **kwargs):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        cursor = self._conn.cursor(*args, **kwargs)
+        return ObservedCursor(cursor) if query_hooks else cursor
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+
+class ConnectionPool:
+    # Thread-safe, blocking pool. Connections are opened lazily up to maxconn,
+    # checked before reuse when they have been idle for a while, reset when
+    # returned and recycled once they reach a maximum age.
+
+    def __init__(self, params, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 recycle=POOL_RECYCLE, healthcheck=POOL_HEALTHCHECK):
+        self.params = params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.recycle = recycle
+        self.healthcheck = healthcheck
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = []          # [(conn, returned_at)]
+        self._created = {}       # id(conn) -> created_at
+        self._in_use = 0
+        self._waiting = 0
+        self.stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "timeouts": 0,
+            "opened": 0,
+            "recycled": 0,
+            "failed_healthchecks": 0,
+        }
+
+    def _open(self):
+        conn = psycopg2.connect(**self.params)
+        conn.autocommit = True
+        with self._lock:
+            self._created[id(conn)] = time.monotonic()
+            self.stats["opened"] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        start = time.monotonic()
+        with self._lock:
+            self.stats["checkouts"] += 1
+            waited = False
+            while not self._idle and self._in_use + len(self._idle) >= self.maxconn:
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeout("no database connection available after {:.1f}s".format(self.timeout))
+                waited = True
+                self._waiting += 1
+                self._available.wait(remaining)
+                self._waiting -= 1
+            if waited:
+                wait_ms = (time.monotonic() - start) * 1000
+                self.stats["waits"] += 1
+                self.stats["wait_ms_total"] += wait_ms
+                self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+            idle = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        # Network work happens outside the lock
+        try:
+            if idle is not None:
+                conn, idle_since = idle
+                if self._healthy(conn, idle_since):
+                    return conn
+                with self._lock:
+                    self.stats["failed_healthchecks"] += 1
+                self._discard(conn)
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._available.notify()
+            raise
+
+    def putconn(self, conn):
+        with self._lock:
+            created = self._created.get(id(conn), 0)
+        recycle = conn.closed or time.monotonic() - created > self.recycle
+        if not recycle:
+            # Leave no open transaction or session state behind: DISCARD ALL
+            # also resets SET values, releases advisory locks and drops
+            # prepared statements and temporary tables
+            try:
+                conn.rollback()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("DISCARD ALL")
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    recycle = True
+            except psycopg2.Error:
+                recycle = True
+        if recycle:
+            with self._lock:
+                self.stats["recycled"] += 1
+            self._discard(conn)
+        with self._lock:
+            self._in_use -= 1
+            if not recycle:
+                self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def connection(self):
+        return PooledConnection(self, self.getconn())
+
+    def fill(self):
+        # Open the minimum number of connections up front
+        conns = [self.getconn() for _ in range(self.minconn)]
+        for conn in conns:
+            self.putconn(conn)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "saturation": round(self._in_use / self.maxconn, 2),
+            })
+        stats["wait_ms_avg"] = round(stats["wait_ms_total"] / stats["waits"], 2) if stats["waits"] else 0
+        stats["wait_ms_total"] = round(stats["wait_ms_total"], 2)
+        stats["wait_ms_max"] = round(stats["wait_ms_max"], 2)
+        return stats
+
+
+pool = ConnectionPool(db_params)
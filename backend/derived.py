@@ -0,0 +1,73 @@
+import schema
+
+# Tables derived from the ball-by-ball table (rollups, dimensions, cubes).
+# Modules register a builder here; the loader rebuilds every registered table
+# from the freshly loaded balls into "<name>_staging" and swaps them in
+# together with the ball table, so the API never mixes dataset versions.
+#
+# A builder is called as build(cursor, source, target) and must create and
+# fill `target` (including its indexes) from the ball table `source`.
+DERIVED_TABLES = {}
+# Name -> (column, ball columns) for a table whose rows for one value of
+# `column` are built from just the balls having that value in one of the
+# ball columns (a rollup's player is the batter), so that an incremental
+# load rebuilds only the rows of the values its balls touch
+SCOPES = {}
+DELTA_SUFFIX = "_delta"
+
+
+def register(name, build, scope=None):
+    DERIVED_TABLES[name] = build
+    if scope is not None:
+        SCOPES[name] = scope
+
+
+def build_all(cursor, source):
+    pairs = []
+    for name, build in DERIVED_TABLES.items():
+        target = name + schema.STAGING_SUFFIX
+        cursor.execute("DROP TABLE IF EXISTS {}".format(target))
+        build(cursor, source, target)
+        cursor.execute("ANALYZE {}".format(target))
+        pairs.append((name, target))
+    return pairs
+
+
+# Rebuild all derived tables from the live ball table and swap them in
+def refresh(cursor, source):
+    schema.swap_tables(cursor, build_all(cursor, source))
+
+
+# Bring the derived tables up to date after the balls in `changed` were added
+# to `source`. A table with a scope has the rows of the keys those balls
+# touch deleted and rebuilt, by its own builder over only those keys' balls;
+# the others are rebuilt in full.
+def update(cursor, source, changed):
+    full = [name for name in DERIVED_TABLES if name not in SCOPES]
+    if full:
+        pairs = []
+        for name in full:
+            target = name + schema.STAGING_SUFFIX
+            cursor.execute("DROP TABLE IF EXISTS {}".format(target))
+            DERIVED_TABLES[name](cursor, source, target)
+            pairs.append((name, target))
+        schema.swap_tables(cursor, pairs)
+    for name, (column, ball_columns) in SCOPES.items():
+        keys, balls, delta = name + "_keys", name + "_balls", name + DELTA_SUFFIX
+        cursor.execute("DROP VIEW IF EXISTS {}".format(balls))
+        cursor.execute("DROP TABLE IF EXISTS {}".format(keys))
+        touched = " UNION ".join("SELECT {} AS key FROM {}".format(c, changed) for c in ball_columns)
+        cursor.execute("CREATE TEMP TABLE {} AS SELECT DISTINCT key FROM ({}) AS touched WHERE key IS NOT NULL"
+                       .format(keys, touched))
+        # A view rather than a subquery, so builders can alias their source
+        cursor.execute("CREATE TEMP VIEW {} AS SELECT * FROM {} WHERE {}".format(
+            balls, source, " OR ".join("{} IN (SELECT key FROM {})".format(c, keys) for c in ball_columns)))
+        cursor.execute("DROP TABLE IF EXISTS {}".format(delta))
+        DERIVED_TABLES[name](cursor, balls, delta)
+        cursor.execute("DELETE FROM {} WHERE {} IN (SELECT key FROM {})".format(name, column, keys))
+        cursor.execute("INSERT INTO {0} SELECT * FROM {1} WHERE {2} IN (SELECT key FROM {3})".format(
+            name, delta, column, keys))
+        cursor.execute("DROP TABLE {}".format(delta))
+        cursor.execute("DROP VIEW {}".format(balls))
+        cursor.execute("DROP TABLE {}".format(keys))
+        cursor.execute("ANALYZE {}".format(name))
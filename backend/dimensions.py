@@ -0,0 +1,117 @@
+import derived
+
+# Dimension tables: one row per match / per player, holding the facts the API
+# used to recover with DISTINCT over every ball.
+
+
+# team1 batted first: the teams come from the earliest innings with balls, so
+# a match missing its first innings still has both. Each team's runs and
+# wickets are those of the balls it batted, whichever innings they are in;
+# the result is 'runs' when team1 won, 'wickets' when the chasing side won.
+def build_matches(cursor, source, target):
+    cursor.execute("""
+        CREATE TABLE {target} AS
+        WITH per_match AS (
+            SELECT
+                p_match,
+                MIN(date) AS date,
+                MIN(year) AS year,
+                MIN(ground) AS ground,
+                (ARRAY_AGG(team_bat ORDER BY inns) FILTER (WHERE team_bat IS NOT NULL))[1] AS team1,
+                (ARRAY_AGG(team_bowl ORDER BY inns) FILTER (WHERE team_bowl IS NOT NULL))[1] AS team2,
+                MIN(winner) AS winner
+            FROM {source}
+            GROUP BY p_match
+        ),
+        totals AS (
+            SELECT
+                m.p_match,
+                COALESCE(SUM(b.score) FILTER (WHERE b.team_bat = m.team1), 0)::INT AS team1_runs,
+                (COUNT(*) FILTER (WHERE b.team_bat = m.team1 AND b.outcome = 'out'))::INT AS team1_wickets,
+                COALESCE(SUM(b.score) FILTER (WHERE b.team_bat = m.team2), 0)::INT AS team2_runs,
+                (COUNT(*) FILTER (WHERE b.team_bat = m.team2 AND b.outcome = 'out'))::INT AS team2_wickets
+            FROM per_match m
+            JOIN {source} b ON b.p_match = m.p_match
+            GROUP BY m.p_match
+        )
+        SELECT
+            m.*,
+            t.team1_runs,
+            t.team1_wickets,
+            t.team2_runs,
+            t.team2_wickets,
+            CASE
+                WHEN m.winner IS NULL OR m.winner = 'No Result' THEN 'no result'
+                WHEN m.winner = m.team1 THEN 'runs'
+                ELSE 'wickets'
+            END::VARCHAR AS result
+        FROM per_match m
+        JOIN totals t ON t.p_match = m.p_match
+    """.format(source=source, target=target))
+    cursor.execute("ALTER TABLE {0} ADD CONSTRAINT {0}_pkey PRIMARY KEY (p_match)".format(target))
+    cursor.execute("CREATE INDEX {0}_year ON {0} (year)".format(target))
+
+
+# Ids are stable across loads: players already in the live table keep theirs
+# and newcomers are numbered after the current maximum, in name order.
+# Handedness and bowling type are the player's most common value.
+def build_players(cursor, source, target):
+    cursor.execute("SELECT to_regclass('players') IS NOT NULL")
+    if cursor.fetchone()[0] and target != 'players':
+        previous = "LEFT JOIN players prev ON prev.name = n.name"
+        id_expr = ("COALESCE(prev.id, (SELECT COALESCE(MAX(id), 0) FROM players) "
+                   "+ ROW_NUMBER() OVER (PARTITION BY prev.id IS NULL ORDER BY n.name))")
+    else:
+        previous = ""
+        id_expr = "ROW_NUMBER() OVER (ORDER BY n.name)"
+    cursor.execute("""
+        CREATE TABLE {target} AS
+        WITH appearances AS (
+            SELECT bat AS name, team_bat AS team, year FROM {source} WHERE bat IS NOT NULL
+            UNION ALL
+            SELECT bowl AS name, team_bowl AS team, year FROM {source} WHERE bowl IS NOT NULL
+        ),
+        names AS (
+            SELECT
+                name,
+                ARRAY_AGG(DISTINCT team ORDER BY team) FILTER (WHERE team IS NOT NULL) AS teams,
+                MIN(year) AS first_year,
+                MAX(year) AS last_year
+            FROM appearances
+            GROUP BY name
+        ),
+        batting AS (
+            SELECT bat AS name, MODE() WITHIN GROUP (ORDER BY bat_hand) AS bat_hand
+            FROM {source}
+            WHERE bat IS NOT NULL
+            GROUP BY bat
+        ),
+        bowling AS (
+            SELECT
+                bowl AS name,
+                MODE() WITHIN GROUP (ORDER BY bowl_kind) AS bowl_kind,
+                MODE() WITHIN GROUP (ORDER BY bowl_style) AS bowl_style
+            FROM {source}
+            WHERE bowl IS NOT NULL
+            GROUP BY bowl
+        )
+        SELECT
+            ({id_expr})::INT AS id,
+            n.name,
+            b.bat_hand,
+            w.bowl_kind,
+            w.bowl_style,
+            n.teams,
+            n.first_year,
+            n.last_year
+        FROM names n
+        LEFT JOIN batting b ON b.name = n.name
+        LEFT JOIN bowling w ON w.name = n.name
+        {previous}
+    """.format(source=source, target=target, id_expr=id_expr, previous=previous))
+    cursor.execute("ALTER TABLE {0} ADD CONSTRAINT {0}_pkey PRIMARY KEY (id)".format(target))
+    cursor.execute("CREATE UNIQUE INDEX {0}_name ON {0} (name)".format(target))
+
+
+derived.register('matches', build_matches, scope=('p_match', ['p_match']))
+derived.register('players', build_players, scope=('name', ['bat', 'bowl']))
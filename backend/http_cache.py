@@ -0,0 +1,82 @@
+import hashlib
+import os
+
+from flask import current_app, request
+
+import cache
+import serialization
+
+# HTTP conditional requests for the cached routes (see cache.cached). Their
+# response is fixed by the request and the dataset version, so the ETag is
+# derived from those two alone and a matching If-None-Match is answered with
+# 304 before the view runs: no query, no body. The dataset version itself is
+# re-read at most every CACHE_VERSION_INTERVAL seconds. A route with a
+# revision (see cache.cached) has it in the ETag too, and is validated by
+# ETag only: the dataset's load time says nothing about the revision.
+
+# Seconds browsers may reuse a response without asking, and seconds shared
+# caches (Netlify, CDN edges) may; both revalidate cheaply afterwards
+MAX_AGE = int(os.getenv("HTTP_MAX_AGE", 60))
+SHARED_MAX_AGE = int(os.getenv("HTTP_SHARED_MAX_AGE", 600))
+CACHE_CONTROL = "public, max-age={}, s-maxage={}".format(MAX_AGE, SHARED_MAX_AGE)
+
+
+def _cacheable():
+    view = current_app.view_functions.get(request.endpoint)
+    return request.method in ("GET", "HEAD") and getattr(view, "cacheable", False)
+
+
+def etag():
+    digest = hashlib.sha1(cache.request_key().encode()).hexdigest()[:20]
+    revision = cache.revision()
+    if revision is None:
+        return "v{}-{}".format(cache.dataset_version(), digest)
+    return "v{}-{}-{}".format(cache.dataset_version(), revision, digest)
+
+
+# The validator the client holds, if it is still current. Compressed
+# responses carry the ETag with the coding appended (see responses.py).
+def _current_validator():
+    tag = etag()
+    if request.if_none_match:
+        for candidate in [tag] + ["{}-{}".format(tag, coding) for coding in serialization.COMPRESSORS]:
+            if request.if_none_match.contains(candidate):
+                return candidate
+        return None
+    loaded_at = cache.dataset_loaded_at()
+    if (request.if_modified_since is not None and loaded_at is not None and cache.revision() is None
+            and loaded_at.replace(microsecond=0) <= request.if_modified_since):
+        return tag
+    return None
+
+
+def _tag(response, tag=None):
+    response.set_etag(tag or etag())
+    response.last_modified = cache.dataset_loaded_at()
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+# 304 for a request whose validator is current, else None
+def not_modified():
+    tag = _current_validator()
+    return None if tag is None else _tag(current_app.response_class(status=304), tag)
+
+
+def add_validators(response):
+    if response.status_code == 200:
+        _tag(response)
+    return response
+
+
+def init_app(app):
+    @app.before_request
+    def answer_conditional_request():
+        if _cacheable():
+            return not_modified()
+
+    @app.after_request
+    def add_cacheable_validators(response):
+        if _cacheable():
+            add_validators(response)
+        return response
@@ -0,0 +1,189 @@
+import argparse
+import json
+import threading
+from urllib.parse import urlencode
+
+import psycopg2
+
+import db
+
+TABLE = 'odi_db'
+
+# Indexes for the access paths the API uses, as (name suffix, definition).
+# Lookups by match are served by the natural key index, which leads with
+# p_match (see schema.NATURAL_KEY).
+INDEXES = [
+    # Batting aggregates for one player read only the index (index-only scan)
+    ("bat", "(bat) INCLUDE (batruns, ballfaced, outcome, is_dot, is_boundary, control, "
+            "phase, year, team_bowl, p_match, bowl_style, bowl_kind)"),
+    # Bowling aggregates for one player, optionally restricted to a phase
+    ("bowl_phase", "(bowl, phase) INCLUDE (bowlruns, score, ball_id, outcome, \"out\", "
+                   "is_dot, is_boundary, is_bowler_wicket, team_bat, bat_hand, p_match)"),
+    # Phase-filtered heatmap and wagon wheel queries
+    ("bat_phase", "(bat, phase)"),
+    # Batter vs bowler matchups
+    ("bat_bowl", "(bat, bowl)"),
+    # Season pages
+    ("year", "(year)"),
+    # Team pages; `team_bat = %s OR team_bowl = %s` becomes a BitmapOr of both
+    ("team_bat_year", "(team_bat, year)"),
+    ("team_bowl_year", "(team_bowl, year)"),
+]
+
+
+def index_statements(table, concurrently=False):
+    return [
+        "CREATE INDEX {}IF NOT EXISTS {}_{} ON {} {}".format(
+            'CONCURRENTLY ' if concurrently else '', table, suffix, table, definition)
+        for suffix, definition in INDEXES
+    ]
+
+
+# Used by the loader on freshly loaded (or staging) tables
+def create_indexes(cursor, table):
+    for statement in index_statements(table):
+        cursor.execute(statement)
+
+
+# Add missing indexes to the live table without blocking the API
+def create_live_indexes():
+    conn = psycopg2.connect(**db.db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    for statement in index_statements(TABLE, concurrently=True):
+        print(statement)
+        cur.execute(statement)
+    cur.execute("ANALYZE {}".format(TABLE))
+    cur.close()
+    conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Advisor: replay every GET endpoint, EXPLAIN the SQL it ran and report the
+# sequential scans that remain.
+# ---------------------------------------------------------------------------
+
+def sample_arguments(cur):
+    def top(column, where="", params=()):
+        cur.execute("SELECT {0} FROM {1} {2} GROUP BY {0} ORDER BY COUNT(*) DESC LIMIT 1".format(column, TABLE, where), params)
+        row = cur.fetchone()
+        return str(row[0]) if row else ''
+
+    batter = top('bat')
+    bowler = top('bowl')
+    cur.execute("SELECT MAX(p_match) FROM {}".format(TABLE))
+    match_id = str(cur.fetchone()[0])
+    base = {
+        "team": top('team_bat'),
+        "year": top('year'),
+        "match_id": match_id,
+        "batsman": batter,
+        "bowler": bowler,
+    }
+    filters = {
+        "phase": "Powerplay",
+        "bowl_kind": top('bowl_kind', "WHERE bat = %s", (batter,)),
+        "bowl_style": top('bowl_style', "WHERE bat = %s", (batter,)),
+    }
+    # Each route is replayed as a batter, as a bowler and with the filters
+    return [
+        dict(base, player=batter),
+        dict(base, player=bowler),
+        dict(base, player=batter, **filters),
+    ]
+
+
+# Every request bypasses the response cache (no-cache), so each one runs its
+# SQL. Only statements from this thread are captured.
+def capture_workload(app, argument_sets):
+    captured = []
+    replaying = threading.get_ident()
+
+    def capture(cursor, query, vars):
+        if threading.get_ident() == replaying:
+            captured[-1][1].append(cursor.mogrify(query, vars).decode())
+
+    db.query_hooks.append(capture)
+    try:
+        client = app.test_client()
+        for rule in app.url_map.iter_rules():
+            if not rule.rule.startswith('/api/') or 'GET' not in rule.methods or rule.arguments:
+                continue
+            for args in argument_sets:
+                url = "{}?{}".format(rule.rule, urlencode(args))
+                captured.append((url, []))
+                client.get(url, headers={"Cache-Control": "no-cache"})
+    finally:
+        db.query_hooks.remove(capture)
+
+    # Keep the first URL that ran each distinct statement
+    workload = {}
+    for url, statements in captured:
+        for statement in statements:
+            workload.setdefault(statement, (rule_of(url), statement))
+    return list(workload.values())
+
+
+def rule_of(url):
+    return url.split('?', 1)[0]
+
+
+def seq_scans(plan):
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append((plan.get("Relation Name"), plan.get("Plan Rows")))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+# The API's SQL as Postgres runs it: the in-memory engine would answer the
+# metric queries without any, and the warm-up and benchmark threads would
+# run theirs alongside the replay
+def advise():
+    import benchmarks
+    import columnar
+    import warmup
+    from script import app
+
+    columnar.ENGINE = 'postgres'
+    warmup.WARMUP_ENABLED = False
+    benchmarks.REFRESH_ENABLED = False
+
+    conn = psycopg2.connect(**db.db_params)
+    conn.autocommit = True
+    cur = conn.cursor()
+    workload = capture_workload(app, sample_arguments(cur))
+
+    report = {}
+    for endpoint, statement in workload:
+        cur.execute("EXPLAIN (FORMAT JSON) " + statement)
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        for relation, rows in seq_scans(plan[0]["Plan"]):
+            report.setdefault(endpoint, set()).add((relation, rows))
+    cur.close()
+    conn.close()
+
+    print("Replayed {} distinct statements".format(len(workload)))
+    if not report:
+        print("No sequential scans.")
+        return 0
+    for endpoint in sorted(report):
+        scans = ', '.join("{} (~{:,} rows)".format(rel, int(rows or 0)) for rel, rows in sorted(report[endpoint]))
+        flag = '!!' if any(rel == TABLE for rel, _ in report[endpoint]) else '  '
+        print("{} {:<40} {}".format(flag, endpoint, scans))
+    print("'!!' marks endpoints that still scan the whole {} table".format(TABLE))
+    return 1 if any(rel == TABLE for scans in report.values() for rel, _ in scans) else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage odi_db indexes")
+    parser.add_argument('--create', action='store_true', help="create missing indexes on the live table (CONCURRENTLY)")
+    parser.add_argument('--advise', action='store_true', help="EXPLAIN every endpoint's SQL and report seq scans")
+    args = parser.parse_args()
+    if args.create:
+        create_live_indexes()
+    if args.advise or not args.create:
+        raise SystemExit(advise())
@@ -0,0 +1,158 @@
+import string
+
+# Metric registry and query builder.
+#
+# Every rate the API reports is a ratio of a few additive counters. Counters
+# are defined once here as aggregates over odi_db balls, and the summary
+# tables (see rollups.py) store them as columns of the same name, so a single
+# metric definition serves raw and pre-aggregated queries alike. Identical
+# aggregate calls in one SELECT are computed once by Postgres, so metrics
+# that share counters cost a single pass.
+
+# Counter name -> (aggregate, row predicate or None), over odi_db balls
+COUNTERS = {
+    "runs": ("SUM(batruns)", None),
+    "balls_faced": ("SUM(ballfaced)", None),
+    "deliveries": ("COUNT(*)", None),
+    "ball_ids": ("COUNT(ball_id)", None),
+    "bowl_runs": ("SUM(bowlruns)", None),
+    "score": ("SUM(score)", None),
+    "outs": ("COUNT(*)", "outcome = 'out'"),
+    "out_flags": ("COUNT(*)", '"out"'),
+    "bowler_wickets": ("COUNT(*)", "is_bowler_wicket"),
+    "dots": ("COUNT(*)", "is_dot"),
+    "boundaries": ("COUNT(*)", "is_boundary"),
+    "boundary_runs": ("SUM(CASE WHEN is_boundary THEN batruns ELSE 0 END)", None),
+    "singles": ("COUNT(*)", "batruns = 1"),
+    "control_sum": ("SUM(control)", None),
+    "control_count": ("COUNT(control)", None),
+    # Additive in the rollups only because their grain never splits a match
+    "matches": ("COUNT(DISTINCT p_match)", None),
+}
+
+# Tables whose columns are counters; there a counter is the SUM of its column
+SUMMARY_TABLES = {"bat_rollup", "bowl_rollup", "player_phase", "bat_line_length", "bat_line_length_bowler",
+                  "bat_wagon", "bat_wagon_bowler"}
+
+# Metric name -> formula over counters and other metrics. Strike rate and
+# control% are 0 rather than NULL when nothing was faced; a batter who was
+# never dismissed averages their runs. control% is over the deliveries that
+# have control data: a 'nan' control in the CSV loads as NULL and is not
+# counted.
+METRICS = {
+    "strike_rate": "CASE WHEN {balls_faced} = 0 THEN 0 ELSE {runs}::NUMERIC / {balls_faced} * 100 END",
+    "average": "CASE WHEN {outs} = 0 THEN {runs}::NUMERIC ELSE {runs}::NUMERIC / {outs} END",
+    "economy": "{bowl_runs}::NUMERIC / NULLIF({deliveries}, 0) * 6",
+    # Every run off the bat or in extras, per ball; used by the skill profiles
+    "economy_total": "{score}::NUMERIC / NULLIF({ball_ids}, 0) * 6",
+    "bowling_average": "{bowl_runs}::NUMERIC / NULLIF({bowler_wickets}, 0)",
+    "bowling_strike_rate": "{deliveries}::NUMERIC / NULLIF({bowler_wickets}, 0)",
+    "dot_pct": "{dots}::NUMERIC / NULLIF({deliveries}, 0) * 100",
+    "boundary_pct": "{boundaries}::NUMERIC / NULLIF({deliveries}, 0) * 100",
+    "singles_pct": "{singles}::NUMERIC / NULLIF({deliveries}, 0) * 100",
+    "wicket_pct": "{out_flags}::NUMERIC / NULLIF({deliveries}, 0) * 100",
+    "control_pct": "CASE WHEN {control_count} > 0 THEN {control_sum}::NUMERIC / {control_count} * 100 ELSE 0 END",
+    # Strike rate on balls that did not reach the boundary
+    "nbsr": "({runs} - {boundary_runs})::NUMERIC / NULLIF({deliveries} - {boundaries}, 0) * 100",
+    # Strike Rotation Index
+    "sri": "0.4 * {nbsr} + 0.4 * {singles_pct} + 0.2 * (100 - {dot_pct})",
+    # Bowler Efficiency Index
+    "bei": "0.3 * (100 - {economy_total}) + 0.3 * {dot_pct} + 0.2 * {wicket_pct} + 0.2 * (100 - {boundary_pct})",
+}
+
+DECIMALS = 2
+
+
+def placeholders(formula):
+    return [name for _, name, _, _ in string.Formatter().parse(formula) if name]
+
+
+def counter_sql(name, source="odi_db", where=None):
+    if source in SUMMARY_TABLES:
+        aggregate, predicate = "SUM({})".format(name), None
+    else:
+        aggregate, predicate = COUNTERS[name]
+    predicates = [p for p in (predicate, where) if p]
+    if not predicates:
+        return aggregate
+    return "{} FILTER (WHERE {})".format(aggregate, " AND ".join(predicates))
+
+
+def _expression(name, source, where):
+    if name in COUNTERS:
+        return "({})".format(counter_sql(name, source, where))
+    formula = METRICS[name]
+    return "({})".format(formula.format(**{
+        term: _expression(term, source, where) for term in placeholders(formula)}))
+
+
+# SQL for a metric (rounded) or a counter. `where` restricts every aggregate
+# with a FILTER clause, e.g. to one phase.
+def sql(name, source="odi_db", where=None):
+    if name in COUNTERS:
+        return counter_sql(name, source, where)
+    return "ROUND({}::NUMERIC, {})".format(_expression(name, source, where), DECIMALS)
+
+
+# Format a clause that refers to counters and metrics by {name}
+def clause(template, source="odi_db"):
+    return template.format(**{name: sql(name, source) for name in placeholders(template)})
+
+
+# SQL text that also carries the arguments select() built it from, so another
+# engine (see columnar.py) can answer the same query without parsing SQL.
+# It is a str, so cursors take it as is.
+class Query(str):
+    spec = None
+
+
+def normalize(item):
+    if isinstance(item, tuple):
+        return item if len(item) == 3 else item + (None,)
+    return item, item, None
+
+
+# One single-pass aggregate.
+#   dimensions  SQL expressions to select and group by ("team_bowl AS opponent")
+#   metrics     metric or counter names, (alias, name) pairs or
+#               (alias, name, predicate) to restrict that column with FILTER
+#   where       predicates, ANDed; use %s placeholders for values
+#   having      clause over {counter}/{metric} names ("{matches} > 25")
+def select(source, dimensions=(), metrics=(), where=(), having=None, order_by=None, limit=None):
+    columns = list(dimensions)
+    for item in metrics:
+        alias, name, predicate = normalize(item)
+        columns.append("{} AS {}".format(sql(name, source, predicate), alias))
+    query = "SELECT\n    {}\nFROM {}".format(",\n    ".join(columns), source)
+    if where:
+        query += "\nWHERE " + " AND ".join(where)
+    if dimensions:
+        query += "\nGROUP BY " + ", ".join(str(i + 1) for i in range(len(dimensions)))
+    if having:
+        query += "\nHAVING " + clause(having, source)
+    if order_by:
+        query += "\nORDER BY " + order_by
+    if limit:
+        query += "\nLIMIT {}".format(int(limit))
+    query = Query(query)
+    query.spec = {
+        "source": source,
+        "dimensions": list(dimensions),
+        "metrics": [normalize(item) for item in metrics],
+        "where": list(where),
+        "having": having,
+        "order_by": order_by,
+        "limit": limit,
+    }
+    return query
+
+
+# Column list for a summary table storing the given counters
+def counter_columns(names):
+    columns = []
+    for name in names:
+        expr = "COALESCE({}, 0)".format(counter_sql(name))
+        # control is NUMERIC; the other counters are stored as INTEGER so that
+        # SUM() over them returns BIGINT
+        columns.append("{} AS {}".format(expr if name == "control_sum" else expr + "::INT", name))
+    return ",\n    ".join(columns)
@@ -0,0 +1,125 @@
+import argparse
+import json
+import sys
+from urllib.parse import quote
+
+import columnar
+import script
+
+# Parity check between the Postgres and in-memory engines: requests every
+# analytics endpoint for a sample of players, seasons and teams through the
+# app with each engine and compares the JSON.
+#
+#     python parity.py --players 10
+#
+# A response whose rows match but come back in another order is reported
+# separately: ties under ORDER BY are unordered in SQL, and Postgres sorts
+# text by the database collation rather than by code point.
+
+REQUESTS = [
+    "/api/player-stats?player={batter}",
+    "/api/player-stats?player={bowler}",
+    "/api/season-overview?year={year}",
+    "/api/player-matchup?batsman={batter}&bowler={bowler}",
+    "/api/batscatter",
+    "/api/bowlscatter",
+    "/api/player-performance?player={batter}",
+    "/api/team-contributions?team={team}&year={year}",
+    "/api/player-role-analysis?player={batter}",
+    "/api/player-role-analysis?player={bowler}",
+    "/api/player-typeagainst-analysis?player={batter}",
+    "/api/player-typeagainst-analysis?player={bowler}",
+    "/api/batter-line-length?player={batter}",
+    "/api/batter-line-length-sr?player={batter}",
+    "/api/batter-line-length-sr2?player={batter}",
+    "/api/batter-line-length-sr2?player={batter}&phase=Powerplay&bowl_kind=%25pace%25",
+    "/api/batter-line-length-sr2?player={batter}&bowler={bowler}",
+    "/api/batter-shot-types?player={batter}",
+    "/api/bowler-line-length?player={bowler}",
+    "/api/batting-stats-extended?player={batter}",
+    "/api/bowling-stats-extended?player={bowler}",
+    "/api/batter-bowl-types?player={batter}",
+    "/api/batter-bowl-phase-types?player={batter}",
+    "/api/batter-wagon?player={batter}",
+    "/api/batter-wagon?player={batter}&phase=Death%20Overs&bowl_style=%25",
+    "/api/batter-skill-profile?player={batter}",
+    "/api/bowler-skill-profile?player={bowler}",
+    "/api/batter-zone-summary?player={batter}",
+    "/api/batter-zone-summary?player={batter}&bowl_style=spin",
+]
+
+
+def samples(players):
+    conn = script.pool.connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT player FROM bat_rollup GROUP BY player ORDER BY SUM(runs) DESC LIMIT %s", (players,))
+            batters = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT player FROM bowl_rollup GROUP BY player ORDER BY SUM(bowler_wickets) DESC LIMIT %s",
+                        (players,))
+            bowlers = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT year, team1 FROM matches ORDER BY date DESC LIMIT 1")
+            year, team = cur.fetchone()
+    finally:
+        conn.close()
+    return [{"batter": batter, "bowler": bowler, "year": year, "team": team}
+            for batter, bowler in zip(batters, bowlers)]
+
+
+def fetch(client, engine, url):
+    columnar.ENGINE = engine
+    response = client.get(url, headers={"Cache-Control": "no-cache"})
+    return response.status_code, response.get_json()
+
+
+def _canonical(value):
+    if isinstance(value, list):
+        return sorted((_canonical(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Postgres and in-memory engines endpoint by endpoint")
+    parser.add_argument('--players', type=int, default=5, help="top batters and bowlers to check")
+    parser.add_argument('--strict', action='store_true', help="treat row order differences as failures")
+    args = parser.parse_args()
+
+    print("Loading the columnar engine...")
+    columnar.engine.table = columnar.load()
+    client = script.app.test_client()
+
+    urls = []
+    for values in samples(args.players):
+        quoted = {name: quote(str(value)) for name, value in values.items()}
+        urls.extend(url.format(**quoted) for url in REQUESTS if url.format(**quoted) not in urls)
+
+    checked, reordered, failed = 0, [], []
+    for url in urls:
+        postgres = fetch(client, "postgres", url)
+        answered = columnar.engine.stats["answered"]
+        memory = fetch(client, "memory", url)
+        checked += 1
+        if postgres == memory:
+            continue
+        if postgres[0] == memory[0] and _canonical(postgres[1]) == _canonical(memory[1]):
+            reordered.append(url)
+        else:
+            failed.append(url)
+            print("MISMATCH {}\n  postgres: {}\n  memory:   {}".format(
+                url, json.dumps(postgres)[:500], json.dumps(memory)[:500]))
+            if columnar.engine.stats["answered"] == answered:
+                print("  (not answered by the engine)")
+
+    for url in reordered:
+        print("ORDER    {}".format(url))
+    print("{} requests: {} identical, {} differ only in row order, {} mismatched; engine answered {} queries, "
+          "{} fell back to Postgres".format(checked, checked - len(reordered) - len(failed), len(reordered),
+                                            len(failed), columnar.engine.stats["answered"],
+                                            columnar.engine.stats["fallbacks"]))
+    return 1 if failed or (args.strict and reordered) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
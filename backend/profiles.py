@@ -0,0 +1,65 @@
+import metrics
+
+# Skill profiles for the batter and bowler compare pages. Each profile is one
+# aggregate over the player's player_phase rows: the phase splits are FILTER
+# clauses on the same pass, so a profile request runs exactly one query.
+# The Flask and ASGI handlers share the SQL and the response shaping.
+
+PROFILE_PHASES = (('pp', 'Powerplay'), ('middle', 'Middle Overs'), ('death', 'Death Overs'))
+
+
+def in_phase(label):
+    return "phase = '{}'".format(label)
+
+
+# Strike rate per phase, then the whole-innings rates (see metrics.METRICS)
+BATTER_PROFILE_SQL = metrics.select(
+    'player_phase',
+    metrics=[(key + '_sr', 'strike_rate', in_phase(label)) for key, label in PROFILE_PHASES]
+    + ['dot_pct', 'boundary_pct', 'nbsr', 'singles_pct', 'sri'],
+    where=['player = %s', "role = 'bat'"])
+
+
+# Economy per phase (and whether the bowler bowled in it), the overall rates
+# and the Bowler Efficiency Index
+BOWLER_PROFILE_SQL = metrics.select(
+    'player_phase',
+    metrics=[column for key, label in PROFILE_PHASES for column in (
+        (key + '_deliveries', 'deliveries', in_phase(label)),
+        (key + '_economy', 'economy_total', in_phase(label)))]
+    + ['dot_pct', 'wicket_pct', ('average', 'bowling_average'), ('strike_rate', 'bowling_strike_rate'),
+       ('overall_econ', 'economy_total'), 'bei'],
+    where=['player = %s', "role = 'bowl'"])
+
+
+def batter_payload(row):
+    return {
+        "pp_sr": row["pp_sr"] if row["pp_sr"] is not None else 0,
+        "middle_sr": row["middle_sr"] if row["middle_sr"] is not None else 0,
+        "death_sr": row["death_sr"] if row["death_sr"] is not None else 0,
+        "boundary_pct": float(row["boundary_pct"] or 0),
+        "dot_pct": float(row["dot_pct"] or 0),
+        "nbsr": float(row["nbsr"] or 0),
+        "singles_pct": float(row["singles_pct"] or 0),
+        "sri": float(row["sri"] or 0),
+    }
+
+
+def bowler_payload(row):
+    # Phases the bowler bowled in, in the order the phase query returned them
+    phase_data = sorted(
+        ({"phase": label, "economy": row[key + "_economy"]}
+         for key, label in PROFILE_PHASES if row[key + "_deliveries"]),
+        key=lambda phase: phase["phase"])
+    skills = {name: row[name] for name in ("dot_pct", "wicket_pct", "average", "strike_rate", "overall_econ")}
+    return {"phase_data": phase_data, "skills": skills, "bei": {"bei": row["bei"]}}
+
+
+def batter_profile(cur, player):
+    cur.execute(BATTER_PROFILE_SQL, (player,))
+    return batter_payload(cur.fetchone())
+
+
+def bowler_profile(cur, player):
+    cur.execute(BOWLER_PROFILE_SQL, (player,))
+    return bowler_payload(cur.fetchone())
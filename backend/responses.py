@@ -0,0 +1,81 @@
+import collections
+import os
+import threading
+
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+import serialization
+
+# JSON rendering and compression for the Flask app (encoding in
+# serialization.py).
+#
+#   ?format=columns   list responses as {"columns": [...], "rows": [[...]]}
+#                     instead of one object per row
+#   Accept-Encoding   responses of at least COMPRESS_MIN_SIZE bytes are sent
+#                     br (when brotli is installed) or gzip compressed
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+# Compressed bodies kept per process, by ETag and coding, so repeat requests
+# for a cached response are not compressed again
+COMPRESSED_ENTRIES = int(os.getenv("COMPRESS_CACHE_ENTRIES", 256))
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return serialization.dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if has_request_context() and request.args.get("format") == "columns":
+            obj = serialization.to_columns(obj)
+        return self._app.response_class(serialization.dumps(obj) + b"\n", mimetype=self.mimetype)
+
+
+_compressed = collections.OrderedDict()
+_compressed_lock = threading.Lock()
+
+
+def _compress(response, coding):
+    etag, _ = response.get_etag()
+    key = (etag, coding)
+    if etag:
+        with _compressed_lock:
+            if key in _compressed:
+                _compressed.move_to_end(key)
+                return _compressed[key]
+    body = serialization.compress(response.get_data(), coding)
+    if etag:
+        with _compressed_lock:
+            _compressed[key] = body
+            while len(_compressed) > COMPRESSED_ENTRIES:
+                _compressed.popitem(last=False)
+    return body
+
+
+def compress_response(response):
+    response.vary.add("Accept-Encoding")
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or response.mimetype != "application/json"):
+        return response
+    coding = serialization.negotiate(request.headers.get("Accept-Encoding"))
+    if coding is None or response.content_length < COMPRESS_MIN_SIZE:
+        return response
+    body = _compress(response, coding)
+    # A strong ETag names exact bytes, so each coding gets its own
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag("{}-{}".format(etag, coding))
+    response.set_data(body)
+    response.headers["Content-Encoding"] = coding
+    return response
+
+
+# Register before http_cache.init_app: after_request hooks run in reverse
+# order, so compression then sees the ETag it has to adjust
+def init_app(app):
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
@@ -0,0 +1,107 @@
+import derived
+import metrics
+
+# Per-player summary tables holding only additive counters, so any grouping
+# coarser than the stored grain is a SUM over a handful of rows and rates
+# (SR, average, economy) are derived from the sums at query time. Counter
+# columns are named and defined as in metrics.COUNTERS.
+#
+# The grain is (player, opponent, year). A player meets one opponent in one
+# year per match, so match counts stay additive across that grain too.
+
+BAT_COUNTERS = ["runs", "balls_faced", "deliveries", "outs", "dots", "boundaries",
+                "control_sum", "control_count", "matches"]
+BOWL_COUNTERS = ["bowl_runs", "deliveries", "bowler_wickets", "dots", "boundaries",
+                 "control_sum", "control_count", "matches"]
+
+
+def build_bat_rollup(cursor, source, target):
+    cursor.execute("""
+        CREATE TABLE {target} AS
+        SELECT
+            bat AS player,
+            team_bowl AS opponent,
+            year,
+            {counters}
+        FROM {source}
+        WHERE bat IS NOT NULL
+        GROUP BY bat, team_bowl, year
+    """.format(source=source, target=target, counters=metrics.counter_columns(BAT_COUNTERS)))
+    cursor.execute("CREATE INDEX {0}_player ON {0} (player)".format(target))
+
+
+def build_bowl_rollup(cursor, source, target):
+    cursor.execute("""
+        CREATE TABLE {target} AS
+        SELECT
+            bowl AS player,
+            team_bat AS opponent,
+            year,
+            {counters}
+        FROM {source}
+        WHERE bowl IS NOT NULL
+        GROUP BY bowl, team_bat, year
+    """.format(source=source, target=target, counters=metrics.counter_columns(BOWL_COUNTERS)))
+    cursor.execute("CREATE INDEX {0}_player ON {0} (player)".format(target))
+
+
+# Player x phase x bowling type cube. Each ball is counted twice, once for the
+# batter (role 'bat') and once for the bowler (role 'bowl'), with the same
+# counters, so batting and bowling breakdowns read from one table.
+PHASE_COUNTERS = [name for name in metrics.COUNTERS if name != "matches"]
+
+
+def build_player_phase(cursor, source, target):
+    counters = metrics.counter_columns(PHASE_COUNTERS)
+    cursor.execute("""
+        CREATE TABLE {target} AS
+        SELECT bat AS player, 'bat'::VARCHAR AS role, phase, bowl_style, bowl_kind, {counters}
+        FROM {source}
+        WHERE bat IS NOT NULL
+        GROUP BY bat, phase, bowl_style, bowl_kind
+        UNION ALL
+        SELECT bowl AS player, 'bowl'::VARCHAR AS role, phase, bowl_style, bowl_kind, {counters}
+        FROM {source}
+        WHERE bowl IS NOT NULL
+        GROUP BY bowl, phase, bowl_style, bowl_kind
+    """.format(source=source, target=target, counters=counters))
+    cursor.execute("CREATE INDEX {0}_player_role ON {0} (player, role)".format(target))
+
+
+# Filter cubes behind the batter heatmaps (/api/batter-line-length-sr2 and
+# /api/batter-wagon): counters per batter and cell (line x length, or wagon
+# zone) for every bowl_kind, bowl_style and phase. Filtering on any of those
+# and rolling up the rest is a SUM over the batter's cube rows rather than a
+# scan of their balls. The "_bowler" cubes add the bowler and serve only the
+# requests that filter on one; the others read the smaller cube without it.
+CUBE_COUNTERS = ["runs", "balls_faced", "deliveries", "dots", "boundaries", "control_sum", "control_count"]
+CUBE_FILTERS = ["bowl_kind", "bowl_style", "phase"]
+
+
+def cube_builder(cells, bowler=False):
+    columns = ["bat AS player"] + cells + CUBE_FILTERS + (["bowl AS bowler"] if bowler else [])
+
+    def build(cursor, source, target):
+        cursor.execute("""
+            CREATE TABLE {target} AS
+            SELECT
+                {columns},
+                {counters}
+            FROM {source}
+            WHERE bat IS NOT NULL
+            GROUP BY {groups}
+        """.format(source=source, target=target, columns=",\n                ".join(columns),
+                   counters=metrics.counter_columns(CUBE_COUNTERS),
+                   groups=", ".join(str(i + 1) for i in range(len(columns)))))
+        cursor.execute("CREATE INDEX {0}_player ON {0} (player)".format(target))
+    return build
+
+
+derived.register('bat_rollup', build_bat_rollup, scope=('player', ['bat']))
+derived.register('bowl_rollup', build_bowl_rollup, scope=('player', ['bowl']))
+derived.register('player_phase', build_player_phase, scope=('player', ['bat', 'bowl']))
+derived.register('bat_line_length', cube_builder(["line", "length"]), scope=('player', ['bat']))
+derived.register('bat_line_length_bowler', cube_builder(["line", "length"], bowler=True),
+                 scope=('player', ['bat']))
+derived.register('bat_wagon', cube_builder(["wagonzone"]), scope=('player', ['bat']))
+derived.register('bat_wagon_bowler', cube_builder(["wagonzone"], bowler=True), scope=('player', ['bat']))
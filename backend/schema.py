@@ -0,0 +1,278 @@
+import pandas as pd
+
+# Column typing for odi_db. Types are inferred from the data itself so the
+# loader keeps working when the CSV grows new columns; 'nan' and '' are
+# treated as missing and stored as NULL.
+
+NULL_TOKENS = ['nan', 'NaN', 'NAN', '']
+BOOL_VALUES = {'true', 'false'}
+
+SMALLINT_RANGE = (-32768, 32767)
+INTEGER_RANGE = (-2147483648, 2147483647)
+
+
+# A column "kind" is (family, lo, hi) where family is one of
+# empty / bool / int / float / date / text and lo/hi track integer ranges.
+def chunk_kind(series):
+    values = series.dropna()
+    if values.empty:
+        return ('empty', None, None)
+    if values.dtype == bool:
+        return ('bool', None, None)
+    if pd.api.types.is_numeric_dtype(values):
+        if pd.api.types.is_integer_dtype(values) or (values % 1 == 0).all():
+            return ('int', int(values.min()), int(values.max()))
+        return ('float', None, None)
+    text = values.astype(str)
+    if text.str.lower().isin(BOOL_VALUES).all():
+        return ('bool', None, None)
+    if text.str.match(r'^\d{4}-\d{2}-\d{2}$').all() and pd.to_datetime(text, errors='coerce').notna().all():
+        return ('date', None, None)
+    return ('text', None, None)
+
+
+def merge_kind(a, b):
+    if a is None or a[0] == 'empty':
+        return b
+    if b[0] == 'empty':
+        return a
+    if a[0] == b[0]:
+        if a[0] == 'int':
+            return ('int', min(a[1], b[1]), max(a[2], b[2]))
+        return a
+    if {a[0], b[0]} == {'int', 'float'}:
+        return ('float', None, None)
+    return ('text', None, None)
+
+
+def sql_type(kind):
+    family, lo, hi = kind
+    if family == 'bool':
+        return 'BOOLEAN'
+    if family == 'int':
+        if SMALLINT_RANGE[0] <= lo and hi <= SMALLINT_RANGE[1]:
+            return 'SMALLINT'
+        if INTEGER_RANGE[0] <= lo and hi <= INTEGER_RANGE[1]:
+            return 'INTEGER'
+        return 'BIGINT'
+    if family == 'float':
+        return 'NUMERIC'
+    if family == 'date':
+        return 'DATE'
+    return 'VARCHAR'
+
+
+# One streaming pass over the chunks; memory stays bounded by the chunk size
+def infer_column_types(chunks):
+    kinds = {}
+    for chunk in chunks:
+        for col in chunk.columns:
+            kinds[col] = merge_kind(kinds.get(col), chunk_kind(chunk[col]))
+    return {col: sql_type(kind) for col, kind in kinds.items()}
+
+
+# Row-level expressions the API used to recompute on every scan. They are
+# stored generated columns, so Postgres fills them in at load time and they
+# can be indexed like any other column.
+DERIVED_COLUMNS = {
+    "phase": ("VARCHAR", "CASE WHEN over <= 10 THEN 'Powerplay' "
+                         "WHEN over BETWEEN 11 AND 40 THEN 'Middle Overs' "
+                         "ELSE 'Death Overs' END"),
+    "is_dot": ("BOOLEAN", "COALESCE(LOWER(outcome) = 'no run', FALSE)"),
+    "is_boundary": ("BOOLEAN", "COALESCE(outcome IN ('four', 'six'), FALSE)"),
+    "is_bowler_wicket": ("BOOLEAN", "COALESCE(outcome = 'out' AND dismissal != 'run out', FALSE)"),
+}
+
+
+def derived_column_sql(name):
+    typ, expr = DERIVED_COLUMNS[name]
+    return '"{}" {} GENERATED ALWAYS AS ({}) STORED'.format(name, typ, expr)
+
+
+def create_table_sql(table, column_types):
+    column_definitions = ['"{}" {}'.format(col, typ) for col, typ in column_types.items()]
+    column_definitions += [derived_column_sql(name) for name in DERIVED_COLUMNS]
+    return "CREATE TABLE IF NOT EXISTS {} (id SERIAL PRIMARY KEY, {})".format(table, ', '.join(column_definitions))
+
+
+# Natural key of a delivery. Incremental loads upsert on it, so re-running the
+# loader over the same CSV never duplicates balls. Columns missing from the
+# data are left out of the key.
+NATURAL_KEY = ("p_match", "inns", "ball_id")
+
+
+def natural_key(column_types):
+    return [col for col in NATURAL_KEY if col in column_types]
+
+
+def ensure_natural_key(cursor, table, column_types):
+    key = natural_key(column_types)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS {0}_natural_key ON {0} ({1})".format(
+        table, ', '.join('"{}"'.format(col) for col in key)))
+    return key
+
+
+# One row per load. The latest version identifies the dataset currently
+# being served.
+INGEST_LOG_SQL = """
+    CREATE TABLE IF NOT EXISTS odi_ingest_log (
+        version SERIAL PRIMARY KEY,
+        mode VARCHAR NOT NULL,
+        rows_loaded INTEGER NOT NULL,
+        matches_loaded INTEGER NOT NULL,
+        loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+def record_ingest(cursor, mode, rows_loaded, matches_loaded):
+    cursor.execute(INGEST_LOG_SQL)
+    cursor.execute(
+        "INSERT INTO odi_ingest_log (mode, rows_loaded, matches_loaded) VALUES (%s, %s, %s) RETURNING version",
+        (mode, rows_loaded, matches_loaded))
+    return cursor.fetchone()[0]
+
+
+# Types of the loadable columns of an existing table, in column order
+# (id and generated columns excluded)
+def table_column_types(cursor, table):
+    cursor.execute("""
+        SELECT column_name, UPPER(data_type)
+        FROM information_schema.columns
+        WHERE table_name = %s AND column_name != 'id' AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """, (table,))
+    aliases = {'CHARACTER VARYING': 'VARCHAR', 'TEXT': 'VARCHAR'}
+    return {name: aliases.get(typ, typ) for name, typ in cursor.fetchall()}
+
+
+# Convert a raw chunk so that to_csv emits values COPY can parse into the
+# typed columns: integral floats lose their '.0', booleans are normalised and
+# missing values become empty fields (NULL in COPY csv format).
+def coerce_chunk(chunk, column_types):
+    chunk = chunk.copy()
+    for col, typ in column_types.items():
+        if col not in chunk.columns:
+            continue
+        if typ in ('SMALLINT', 'INTEGER', 'BIGINT'):
+            chunk[col] = pd.to_numeric(chunk[col]).astype('Int64')
+        elif typ == 'BOOLEAN':
+            chunk[col] = chunk[col].map(
+                lambda v: v if isinstance(v, bool) or pd.isna(v) else str(v).lower() == 'true'
+            ).astype('boolean')
+    return chunk
+
+
+# ---------------------------------------------------------------------------
+# Migration of an existing all-VARCHAR odi_db
+# ---------------------------------------------------------------------------
+
+def _clean_expr(col):
+    return "NULLIF(NULLIF(LOWER(TRIM(\"{0}\")), 'nan'), '')".format(col)
+
+
+# Infer types for VARCHAR columns of an existing table in a single scan
+def infer_table_types(cursor, table):
+    columns = [col for col, typ in table_column_types(cursor, table).items() if typ == 'VARCHAR']
+    if not columns:
+        return {}
+    probes = []
+    for col in columns:
+        v = _clean_expr(col)
+        probes.append("""
+            COUNT({v}),
+            BOOL_AND({v} IN ('true', 'false')),
+            BOOL_AND({v} ~ '^-?[0-9]+(\\.0+)?$'),
+            BOOL_AND({v} ~ '^-?([0-9]+\\.?[0-9]*|\\.[0-9]+)(e[-+]?[0-9]+)?$'),
+            BOOL_AND({v} ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}$'),
+            MIN(CASE WHEN {v} ~ '^-?[0-9]+(\\.0+)?$' THEN {v}::NUMERIC END),
+            MAX(CASE WHEN {v} ~ '^-?[0-9]+(\\.0+)?$' THEN {v}::NUMERIC END)
+        """.format(v=v))
+    cursor.execute("SELECT {} FROM {}".format(', '.join(probes), table))
+    row = cursor.fetchone()
+
+    types = {}
+    for i, col in enumerate(columns):
+        count, is_bool, is_int, is_num, is_date, lo, hi = row[i * 7:(i + 1) * 7]
+        if not count:
+            kind = ('empty', None, None)
+        elif is_bool:
+            kind = ('bool', None, None)
+        elif is_int:
+            kind = ('int', int(lo), int(hi))
+        elif is_num:
+            kind = ('float', None, None)
+        elif is_date:
+            kind = ('date', None, None)
+        else:
+            kind = ('text', None, None)
+        types[col] = sql_type(kind)
+    return types
+
+
+# ALTER every VARCHAR column to its inferred type, normalising 'nan'/'' to
+# NULL on the way. Runs inside the caller's transaction so a failed cast
+# leaves the table untouched.
+def migrate_table(cursor, table):
+    types = infer_table_types(cursor, table)
+    changes = []
+    for col, typ in types.items():
+        if typ == 'VARCHAR':
+            # Keep the original case of text values, only null out the tokens
+            using = "CASE WHEN LOWER(TRIM(\"{0}\")) IN ('nan', '') THEN NULL ELSE \"{0}\" END".format(col)
+        else:
+            using = _clean_expr(col)
+        if typ in ('SMALLINT', 'INTEGER', 'BIGINT'):
+            using = "{}::NUMERIC".format(using)
+        changes.append('ALTER COLUMN "{0}" TYPE {1} USING ({2})::{1}'.format(col, typ, using))
+    if changes:
+        cursor.execute("ALTER TABLE {} {}".format(table, ', '.join(changes)))
+    add_derived_columns(cursor, table)
+    return types
+
+
+# Add any generated columns an older table is missing (one table rewrite)
+def add_derived_columns(cursor, table):
+    cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = [name for name in DERIVED_COLUMNS if name not in existing]
+    if missing:
+        cursor.execute("ALTER TABLE {} {}".format(
+            table, ', '.join('ADD COLUMN {}'.format(derived_column_sql(name)) for name in missing)))
+    return missing
+
+
+# ---------------------------------------------------------------------------
+# Staging tables
+# ---------------------------------------------------------------------------
+
+STAGING_SUFFIX = "_staging"
+
+
+# Swap each staging table in for its live counterpart. Must run inside a
+# single transaction: readers keep seeing the old tables until COMMIT and
+# then see every new table at once. Index and sequence names are moved
+# along so the next staging build can reuse them.
+def swap_tables(cursor, pairs, lock_timeout='10s'):
+    cursor.execute("SET LOCAL lock_timeout = %s", (lock_timeout,))
+    for live, staging in pairs:
+        cursor.execute("DROP TABLE IF EXISTS {}_old".format(live))
+        cursor.execute("ALTER TABLE IF EXISTS {0} RENAME TO {0}_old".format(live))
+        cursor.execute("ALTER TABLE {} RENAME TO {}".format(staging, live))
+        cursor.execute("DROP TABLE IF EXISTS {}_old".format(live))
+
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", (live,))
+        for (index,) in cursor.fetchall():
+            if index.startswith(staging):
+                cursor.execute('ALTER INDEX "{}" RENAME TO "{}"'.format(index, live + index[len(staging):]))
+
+        cursor.execute("""
+            SELECT s.relname
+            FROM pg_class s
+            JOIN pg_depend d ON d.objid = s.oid
+            JOIN pg_class t ON t.oid = d.refobjid
+            WHERE s.relkind = 'S' AND t.relname = %s
+        """, (live,))
+        for (sequence,) in cursor.fetchall():
+            if sequence.startswith(staging):
+                cursor.execute('ALTER SEQUENCE "{}" RENAME TO "{}"'.format(sequence, live + sequence[len(staging):]))
@@ -1,61 +1,124 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
-import psycopg2
 from psycopg2.extras import RealDictCursor
-from decimal import Decimal
-import os
-from dotenv import load_dotenv
+from db import pool, PoolTimeout
+import benchmarks
+import cache
+import columnar
+import http_cache
+import metrics
+import profiles
+import responses
+import warmup
 #from extra_endpoints import *
 
 
 app = Flask(__name__)
-CORS(app,origins=["http://localhost:5173","https://odi-da.netlify.app"])
-
-load_dotenv()
-# Database connection parameters
-db_params = {
-    "host": os.getenv("DB_HOST"),
-    "database": os.getenv("DB_DATABASE"),
-    "user": os.getenv("DB_USERNAME"),
-    "password": os.getenv("DB_PASSWORD"),
-    "port": os.getenv("DB_PORT"),
-    "sslmode": "require"
-}
-
-# Database connection function
+CORS_ORIGINS = ["http://localhost:5173", "https://odi-da.netlify.app"]
+CORS(app, origins=CORS_ORIGINS)
+benchmarks.init_app(app, pool)
+cache.init_app(app, pool)
+responses.init_app(app)
+http_cache.init_app(app)
+warmup.init_app(app, pool)
+
+# Database connection function. Connections come from the shared pool;
+# conn.close() returns them, and any a handler forgets to close are returned
+# when the request ends. With ODI_ENGINE=memory, queries built by
+# metrics.select() are answered in-process (see columnar.py).
 def get_db_connection():
-    conn=psycopg2.connect(**db_params)
-    conn.autocommit=True
-    return conn
+    conn = pool.connection()
+    g.setdefault('db_connections', []).append(conn)
+    return columnar.connection(conn)
+
+@app.teardown_appcontext
+def return_db_connections(exc):
+    for conn in g.pop('db_connections', []):
+        conn.close()
+
+@app.errorhandler(PoolTimeout)
+def pool_exhausted(exc):
+    return jsonify({"error": str(exc)}), 503
+
+@app.route('/api/pool-stats')
+def get_pool_stats():
+    return jsonify(pool.metrics())
+
+# p_match and year are integer columns: an argument for them that is not an
+# integer is a 400, not a failed query. None if missing or not an integer.
+def int_arg(name, default=None):
+    try:
+        return int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        return None
+
+# Phase labels as stored in the generated odi_db.phase column. Filters map the
+# user's value onto one of these so they stay case-insensitive while using a
+# plain equality predicate that an index can serve.
+PHASES = {label.lower(): label for label in ('Powerplay', 'Middle Overs', 'Death Overs')}
+
+def canonical_phase(phase):
+    return PHASES.get(phase.strip().lower(), phase)
+
+# Source, WHERE and params of a batter heatmap: the filter cube (see
+# rollups.py) with the bowler only when the request filters on one
+def heatmap_filters(cube, player):
+    where = ["player = %s"]
+    params = [player]
+
+    for name in ("bowl_kind", "bowl_style"):
+        value = request.args.get(name)
+        if value:
+            where.append("{} ILIKE %s".format(name))
+            params.append(value)
+
+    phase = request.args.get("phase")  # optional (Powerplay / Middle Overs / Death Overs)
+    if phase:
+        where.append("phase = %s")
+        params.append(canonical_phase(phase))
+
+    bowler = request.args.get("bowler")  # optional
+    if bowler:
+        where.append("bowler ILIKE %s")
+        params.append(bowler)
+        cube += "_bowler"
+    return cube, where, params
 
 # 1. Teams API
 @app.route('/api/teams')
+@cache.cached(ttl=cache.LIST_TTL)
 def get_teams():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT DISTINCT team_bat FROM odi_db AS teams ")
-    teams = [row['team_bat'] for row in cur.fetchall()]
+    cur.execute("SELECT team1 AS team FROM matches WHERE team1 IS NOT NULL "
+                "UNION SELECT team2 FROM matches WHERE team2 IS NOT NULL")
+    teams = [row['team'] for row in cur.fetchall()]
     cur.close()
     conn.close()
     return jsonify(teams)
 
 # 2. Players API
 @app.route('/api/players')
+@cache.cached(ttl=cache.LIST_TTL)
 def get_players():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT DISTINCT player FROM (SELECT bat AS player FROM odi_db UNION SELECT bowl AS player FROM odi_db) AS players ORDER BY player")
-    players = [row['player'] for row in cur.fetchall()]
+    cur.execute("SELECT name FROM players ORDER BY name")
+    players = [row['name'] for row in cur.fetchall()]
     cur.close()
     conn.close()
     return jsonify(players)
 
 # 3. Matches API
+# p_match and year are INTEGER columns, so they are JSON numbers here and in
+# every endpoint that returns them (they were strings while odi_db was all
+# VARCHAR)
 @app.route('/api/matches')
+@cache.cached(ttl=cache.LIST_TTL)
 def get_matches():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT DISTINCT p_match, team_bat || ' vs ' || team_bowl AS teams, date FROM odi_db ORDER BY date DESC LIMIT 100")
+    cur.execute("SELECT p_match, team1 || ' vs ' || team2 AS teams, date::TEXT AS date FROM matches ORDER BY date DESC LIMIT 100")
     matches = cur.fetchall()
     cur.close()
     conn.close()
@@ -63,10 +126,11 @@ def get_matches():
 
 # 4. Seasons API
 @app.route('/api/seasons')
+@cache.cached(ttl=cache.LIST_TTL)
 def get_seasons():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT DISTINCT year FROM odi_db ORDER BY year DESC")
+    cur.execute("SELECT DISTINCT year FROM matches ORDER BY year DESC")
     seasons = [row['year'] for row in cur.fetchall()]
     cur.close()
     conn.close()
@@ -74,6 +138,7 @@ def get_seasons():
 
 # 5. Team Performance API
 @app.route('/api/team-performance')
+@cache.cached()
 def get_team_performance():
     team = request.args.get('team')
     conn = get_db_connection()
@@ -83,117 +148,107 @@ def get_team_performance():
             COUNT(*) FILTER (WHERE winner = %s) AS wins,
             COUNT(*) FILTER (WHERE winner != %s AND winner != 'No Result') AS losses,
             COUNT(*) FILTER (WHERE winner = 'No Result') AS ties
-        FROM (
-            SELECT DISTINCT p_match, winner
-            FROM odi_db
-            WHERE team_bat = %s OR team_bowl = %s
-        ) AS team_matches
+        FROM matches
+        WHERE team1 = %s OR team2 = %s
     """, (team, team, team, team))
     performance = cur.fetchone()
     cur.close()
     conn.close()
     return jsonify(performance)
 
+PLAYER_BATTING_SQL = metrics.select(
+    'bat_rollup',
+    metrics=[('total_runs', 'runs'), 'balls_faced', 'strike_rate', 'average'],
+    where=['player = %s'])
+
+PLAYER_BOWLING_SQL = metrics.select(
+    'bowl_rollup',
+    metrics=[('runs_conceded', 'bowl_runs'), ('wickets', 'bowler_wickets'), ('economy_rate', 'economy'),
+             ('average', 'bowling_average'), ('strike_rate', 'bowling_strike_rate')],
+    where=['player = %s'])
+
+PLAYER_PROFILE_SQL = """
+        SELECT id, name, bat_hand, bowl_kind, bowl_style, teams, first_year, last_year
+        FROM players
+        WHERE name = %s
+    """
+
 # 6. Player Stats API
 @app.route('/api/player-stats')
+@cache.cached()
 def get_player_stats():
     player = request.args.get('player')
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     # Batting stats
-    cur.execute("""
-            SELECT 
-                SUM(CAST(batruns AS INTEGER)) AS total_runs,
-                SUM(CAST(ballfaced AS INTEGER)) AS balls_faced,
-                ROUND(
-                    CASE
-                        WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                        ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                    END, 2
-                ) AS strike_rate,
-                ROUND(
-                CAST(
-                    CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                    ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                    END AS NUMERIC
-                ), 2
-                ) AS average
-                FROM odi_db
-                WHERE bat = %s
-    """, (player,))
+    cur.execute(PLAYER_BATTING_SQL, (player,))
     batting_stats = cur.fetchone()
     
     # Bowling stats
-    cur.execute("""
-        SELECT 
-            SUM(CAST(bowlruns AS INTEGER)) AS runs_conceded,
-            COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END) AS wickets,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(*) / 6.0, 0) AS NUMERIC), 2) AS economy_rate,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS average,
-            ROUND(CAST(CAST(COUNT(*) AS FLOAT) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS strike_rate
-        FROM odi_db
-        WHERE bowl = %s;
-
-    """, (player,))
+    cur.execute(PLAYER_BOWLING_SQL, (player,))
     bowling_stats = cur.fetchone()
 
-    # Bat Hand
-    cur.execute("""
-        SELECT 
-            bat_hand
-            FROM odi_db
-        WHERE bat = %s;
-
-    """, (player,))
-    bat_hand = cur.fetchone()
+    # Profile header
+    cur.execute(PLAYER_PROFILE_SQL, (player,))
+    profile = cur.fetchone()
 
     cur.close()
     conn.close()
-    return jsonify({"batting": batting_stats, "bowling": bowling_stats,"bat_hand":bat_hand})
+    return jsonify(player_stats_payload(batting_stats, bowling_stats, profile))
 
-# 7. Match Summary API
-@app.route('/api/match-summary')
-def get_match_summary():
-    match_id = request.args.get('match_id')
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cur.execute("""
+def player_stats_payload(batting_stats, bowling_stats, profile):
+    bat_hand = {"bat_hand": profile["bat_hand"]} if profile else None
+    return {"batting": batting_stats, "bowling": bowling_stats, "bat_hand": bat_hand, "profile": profile}
+
+MATCH_INNINGS_SQL = """
         SELECT 
             p_match,
             team_bat,
             team_bowl,
-            SUM(CAST(score AS INTEGER)) AS total_runs,
+            SUM(score) AS total_runs,
             COUNT(CASE WHEN outcome = 'out' THEN 1 END) AS wickets,
-            date,
+            date::TEXT AS date,
             ground,
             winner
         FROM odi_db
         WHERE p_match = %s
         GROUP BY p_match, team_bat, team_bowl, date, ground, winner
         ORDER BY p_match, team_bat
-    """, (match_id,))
-    innings = cur.fetchall()
-    
-    cur.execute("""
+    """
+
+MATCH_KEY_PERFORMANCES_SQL = """
         SELECT 
             bat AS player,
-            SUM(CAST(batruns AS INTEGER)) AS runs,
+            SUM(batruns) AS runs,
             COUNT(CASE WHEN outcome = 'out' THEN 1 END) AS wickets,
             CASE 
-                WHEN SUM(CAST(batruns AS INTEGER)) >= 50 THEN 'Fifty'
+                WHEN SUM(batruns) >= 50 THEN 'Fifty'
                 WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) >= 3 THEN 'Three-fer'
                 ELSE 'Notable performance'
             END AS achievement
         FROM odi_db
         WHERE p_match = %s
         GROUP BY bat
-        HAVING SUM(CAST(batruns AS INTEGER)) >= 50 OR COUNT(CASE WHEN outcome = 'out' THEN 1 END) >= 3
-        ORDER BY SUM(CAST(batruns AS INTEGER)) DESC, COUNT(CASE WHEN outcome = 'out' THEN 1 END) DESC
+        HAVING SUM(batruns) >= 50 OR COUNT(CASE WHEN outcome = 'out' THEN 1 END) >= 3
+        ORDER BY SUM(batruns) DESC, COUNT(CASE WHEN outcome = 'out' THEN 1 END) DESC
         LIMIT 5
-    """, (match_id,))
+    """
+
+# 7. Match Summary API
+@app.route('/api/match-summary')
+@cache.cached()
+def get_match_summary():
+    match_id = int_arg('match_id')
+    if match_id is None:
+        return jsonify({"error": "match_id must be an integer"}), 400
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    cur.execute(MATCH_INNINGS_SQL, (match_id,))
+    innings = cur.fetchall()
+    
+    cur.execute(MATCH_KEY_PERFORMANCES_SQL, (match_id,))
     key_performances = cur.fetchall()
     
     cur.close()
@@ -204,78 +259,72 @@ def get_match_summary():
         "key_performances": key_performances
     })
 
-# 8. Season Overview API
-@app.route('/api/season-overview')
-def get_season_overview():
-    year = request.args.get('year')
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    # Team performance
-    cur.execute("""
+SEASON_TEAMS_SQL = """
         SELECT 
             team,
             COUNT(*) FILTER (WHERE winner = team) AS wins
         FROM (
-            SELECT DISTINCT p_match, team_bat AS team, winner
-            FROM odi_db
-            WHERE year = %s
-            UNION
-            SELECT DISTINCT p_match, team_bowl AS team, winner
-            FROM odi_db
-            WHERE year = %s
+            SELECT team1 AS team, winner FROM matches WHERE year = %s
+            UNION ALL
+            SELECT team2 AS team, winner FROM matches WHERE year = %s
         ) AS team_matches
         GROUP BY team
         ORDER BY wins DESC
         LIMIT 10
-    """, (year, year))
+    """
+
+SEASON_TOP_SCORERS_SQL = metrics.select(
+    'bat_rollup', ['player AS name'], ['runs'],
+    where=['year = %s'], order_by='runs DESC', limit=5)
+
+SEASON_TOP_BOWLERS_SQL = metrics.select(
+    'bowl_rollup', ['player AS name'], [('wickets', 'bowler_wickets')],
+    where=['year = %s'], order_by='wickets DESC', limit=5)
+
+# 8. Season Overview API
+@app.route('/api/season-overview')
+@cache.cached()
+def get_season_overview():
+    year = int_arg('year')
+    if year is None:
+        return jsonify({"error": "year must be an integer"}), 400
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    # Team performance
+    cur.execute(SEASON_TEAMS_SQL, (year, year))
     team_performance = cur.fetchall()
     
     # Top scorers
-    cur.execute("""
-        SELECT 
-            bat AS name,
-            SUM(CAST(batruns AS INTEGER)) AS runs
-            FROM odi_db
-            WHERE year = %s
-            GROUP BY bat
-            ORDER BY runs DESC
-            LIMIT 5
-    """, (year,))
+    cur.execute(SEASON_TOP_SCORERS_SQL, (year,))
     top_scorers = cur.fetchall()
 
     # Top Wicket-takers
-    cur.execute("""
-        SELECT 
-            bowl AS name,
-            COUNT(CASE WHEN outcome = 'out' THEN 1 END) AS wickets
-            FROM odi_db
-            WHERE year = %s
-            GROUP BY bowl
-            ORDER BY COUNT(CASE WHEN outcome = 'out' THEN 1 END) DESC
-            LIMIT 5
-    """, (year,))
+    cur.execute(SEASON_TOP_BOWLERS_SQL, (year,))
     top_bowlers = cur.fetchall()
     
+    cur.close()
+    conn.close()
+    
+    return jsonify(season_overview_payload(team_performance, top_scorers, top_bowlers))
+
+def season_overview_payload(team_performance, top_scorers, top_bowlers):
     # Season highlights (this is a placeholder - you might want to store this data separately)
     highlights = [
         f"Most runs: {top_scorers[0]['name']} ({top_scorers[0]['runs']} runs)",
         f"Most wickets: {top_bowlers[0]['name']} ({top_bowlers[0]['wickets']} wickets)",
         f"Most wins: {team_performance[0]['team']} ({team_performance[0]['wins']} wins)"
     ]
-    
-    cur.close()
-    conn.close()
-    
-    return jsonify({
+    return {
         "team_performance": team_performance,
         "top_scorers": top_scorers,
         "top_bowlers": top_bowlers,
         "highlights": highlights
-    })
+    }
 
     # Add this new endpoint
 @app.route('/api/team-season-performance')
+@cache.cached()
 def get_team_season_performance():
     team = request.args.get('team')
     if not team:
@@ -285,25 +334,17 @@ def get_team_season_performance():
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
     cur.execute("""
-        WITH team_matches AS (
-            SELECT DISTINCT p_match, year, winner,
-                CASE 
-                    WHEN team_bat = %s THEN team_bat
-                    WHEN team_bowl = %s THEN team_bowl
-                END AS team
-            FROM odi_db
-            WHERE team_bat = %s OR team_bowl = %s
-        )
         SELECT 
             year,
             COUNT(*) AS total_matches,
             COUNT(*) FILTER (WHERE winner = %s) AS wins,
             COUNT(*) FILTER (WHERE winner != %s AND winner != 'No Result') AS losses,
             COUNT(*) FILTER (WHERE winner = 'No Result') AS ties
-        FROM team_matches
+        FROM matches
+        WHERE team1 = %s OR team2 = %s
         GROUP BY year
         ORDER BY year
-    """, (team, team, team, team, team, team))
+    """, (team, team, team, team))
 
     seasons = cur.fetchall()
 
@@ -320,6 +361,7 @@ def get_team_season_performance():
     # Add this new endpoint to your Flask application
 
 @app.route('/api/player-matchup')
+@cache.cached()
 def get_player_matchup():
     batsman = request.args.get('batsman')
     bowler = request.args.get('bowler')
@@ -330,24 +372,11 @@ def get_player_matchup():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    cur.execute("""
-        SELECT 
-            COUNT(*) AS balls_faced,
-            SUM(CAST(batruns AS INTEGER)) AS runs_scored,
-            SUM(CASE WHEN outcome = 'out' THEN 1 ELSE 0 END) AS dismissals,
-            ROUND(CAST(SUM(CAST(batruns AS FLOAT)) / NULLIF(COUNT(*), 0) * 100 AS NUMERIC), 2) AS strike_rate,
-            ROUND(
-            CAST(
-                CASE 
-                WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                END AS NUMERIC
-            ), 2
-            ) AS average,
-            ROUND(CAST(SUM(CAST(batruns AS FLOAT)) / NULLIF(COUNT(*) / 6, 0) AS NUMERIC), 2) AS economy_rate
-        FROM odi_db
-        WHERE bat = %s AND bowl = %s
-    """, (batsman, bowler))
+    cur.execute(metrics.select(
+        'odi_db',
+        metrics=['balls_faced', ('runs_scored', 'runs'), ('dismissals', 'outs'), 'strike_rate', 'average',
+                 ('economy_rate', 'economy')],
+        where=['bat = %s', 'bowl = %s']), (batsman, bowler))
 
     matchup = cur.fetchone()
 
@@ -358,33 +387,15 @@ def get_player_matchup():
 
     # 6. Scat
 @app.route('/api/batscatter')
+@cache.cached()
 def get_batscatter_stats():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     # Batting Scatterplot
-    cur.execute("""
-        SELECT 
-            bat AS batsman,
-            ROUND(
-                CASE
-                    WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                    ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                END, 2
-            ) AS strike_rate,
-            ROUND(
-                CAST(
-                    CASE 
-                        WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                        ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                    END AS NUMERIC
-                ), 2
-            ) AS average
-        FROM odi_db
-        GROUP BY bat
-        HAVING COUNT(DISTINCT p_match) > 25
-        ORDER BY batsman;
-    """)
+    cur.execute(metrics.select(
+        'bat_rollup', ['player AS batsman'], ['strike_rate', 'average'],
+        having='{matches} > 25', order_by='batsman'))
     bat_stats = cur.fetchall()
     
     cur.close()
@@ -392,20 +403,15 @@ def get_batscatter_stats():
     return jsonify(bat_stats)
 
 @app.route('/api/bowlscatter')
+@cache.cached()
 def get_bowlscatter_stats():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
     # Bowling Scatterplot
-    cur.execute("""
-        SELECT 
-            bowl AS bowler,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(*) / 6.0, 0) AS NUMERIC), 2) AS economy,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS average
-        FROM odi_db
-        GROUP BY bowl
-        HAVING COUNT(DISTINCT p_match) > 25 
-    """)
+    cur.execute(metrics.select(
+        'bowl_rollup', ['player AS bowler'], ['economy', ('average', 'bowling_average')],
+        having='{matches} > 25'))
     bowl_stats = cur.fetchall()
     
     cur.close()
@@ -414,35 +420,16 @@ def get_bowlscatter_stats():
 
     # 6. Player Stats API
 @app.route('/api/player-performance')
+@cache.cached()
 def get_player_statsbyyear():
     player = request.args.get('player')
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     # Batting stats
-    cur.execute("""
-            SELECT 
-                year,
-                SUM(CAST(batruns as INTEGER)) as runs,
-                ROUND(
-                    CASE
-                        WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                        ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                    END, 2
-                ) AS strike_rate,
-                ROUND(
-                CAST(
-                    CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                    ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                    END AS NUMERIC
-                ), 2
-                ) AS average
-            FROM odi_db
-            WHERE bat = %s
-            GROUP BY year
-            ORDER BY year
-    """, (player,))
+    cur.execute(metrics.select(
+        'bat_rollup', ['year'], ['runs', 'strike_rate', 'average'],
+        where=['player = %s'], order_by='year'), (player,))
     stats = cur.fetchall()
     
     cur.close()
@@ -452,35 +439,28 @@ def get_player_statsbyyear():
 
 
 @app.route('/api/team-contributions')
+@cache.cached()
 def get_player_contri():
     # Extract the team and year from the request arguments
     team = request.args.get('team', 'India')  # default to 'India' if not provided
-    year = request.args.get('year', '2016')   # default to '2018' if not provided
+    year = int_arg('year', 2016)   # default to 2016 if not provided
+    if year is None:
+        return jsonify({"error": "year must be an integer"}), 400
 
     # Connect to the database
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     # Batting stats query
-    cur.execute("""
-        SELECT 
-            bat AS player_name,
-            SUM(CAST(batruns AS INTEGER)) AS runs
-        FROM odi_db
-        WHERE team_bat = %s AND year = %s
-        GROUP BY bat
-    """, (team, year))
+    cur.execute(metrics.select(
+        'odi_db', ['bat AS player_name'], ['runs'],
+        where=['team_bat = %s', 'year = %s']), (team, year))
     bat_stats = cur.fetchall()
 
     # Bowling stats query
-    cur.execute("""
-        SELECT 
-            bowl AS player_name,
-            COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END) AS wickets
-        FROM odi_db
-        WHERE team_bowl = %s AND year = %s
-        GROUP BY bowl
-    """, (team, year))
+    cur.execute(metrics.select(
+        'odi_db', ['bowl AS player_name'], [('wickets', 'bowler_wickets')],
+        where=['team_bowl = %s', 'year = %s']), (team, year))
     bowl_stats = cur.fetchall()
     
     # Combine batting and bowling stats
@@ -510,6 +490,7 @@ def get_player_contri():
 
 
 @app.route('/api/player-run-distribution')
+@cache.cached()
 def get_player_run_distribution():
     player = request.args.get('player')
     
@@ -522,7 +503,7 @@ def get_player_run_distribution():
     # Query to get player's run distribution, seasons, and opponents
     run_distribution_query = """
         SELECT 
-            SUM(CAST(batruns AS INTEGER)) AS runs,
+            SUM(batruns) AS runs,
             team_bowl AS opponent
         FROM odi_db
         WHERE bat = %s
@@ -550,6 +531,7 @@ def get_player_run_distribution():
     return jsonify(response)
 
 @app.route('/api/player-role-analysis')
+@cache.cached()
 def get_player_role_analysis():
     player = request.args.get('player')
     
@@ -559,51 +541,18 @@ def get_player_role_analysis():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    cur.execute("""
-        SELECT 
-            CASE 
-                WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-                ELSE 'Death Overs'
-            END AS role,
-            SUM(CAST(batruns AS INTEGER)) AS runs,
-            ROUND(
-                    CASE
-                        WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                        ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                    END, 2
-                ) AS strike_rate,
-                ROUND(
-                CAST(
-                    CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                    ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                    END AS NUMERIC
-                ), 2
-                ) AS average
-        FROM odi_db
-        WHERE bat = %s
-        GROUP BY role
-    """, (player,))
+    cur.execute(metrics.select(
+        'player_phase', ['phase AS role'], ['runs', 'strike_rate', 'average'],
+        where=['player = %s', "role = 'bat'"]), (player,))
 
     batting_data = cur.fetchall()
 
     # Query to get bowling role analysis with type casting
-    cur.execute("""
-        SELECT 
-            CASE 
-                WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-                ELSE 'Death Overs'
-            END AS role,
-            COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END) AS wickets,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(*) / 6.0, 0) AS NUMERIC), 2) AS economy_rate,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS average,
-            ROUND(CAST(CAST(COUNT(*) AS FLOAT) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS strike_rate
-        FROM odi_db
-        WHERE bowl = %s
-        GROUP BY role
-    """, (player,))
+    cur.execute(metrics.select(
+        'player_phase', ['phase AS role'],
+        [('wickets', 'bowler_wickets'), ('economy_rate', 'economy'), ('average', 'bowling_average'),
+         ('strike_rate', 'bowling_strike_rate')],
+        where=['player = %s', "role = 'bowl'"]), (player,))
 
     bowling_data = cur.fetchall()
 
@@ -619,6 +568,7 @@ def get_player_role_analysis():
     return jsonify(response)
 
 @app.route('/api/player-typeagainst-analysis')
+@cache.cached()
 def get_player_typeagainst_analysis():
     player = request.args.get('player')
     
@@ -628,45 +578,18 @@ def get_player_typeagainst_analysis():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    cur.execute("""
-        SELECT 
-            bowl_style as type,
-            SUM(CAST(batruns AS INTEGER)) AS runs,
-            ROUND(
-                    CASE
-                        WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                        ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                    END, 2
-                ) AS strike_rate,
-                ROUND(
-                CAST(
-                    CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                    ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                    END AS NUMERIC
-                ), 2
-                ) AS average
-        FROM odi_db
-        WHERE bat = %s
-        GROUP BY bowl_style
-        ORDER BY bowl_style
-    """, (player,))
+    cur.execute(metrics.select(
+        'player_phase', ['bowl_style AS type'], ['runs', 'strike_rate', 'average'],
+        where=['player = %s', "role = 'bat'"], order_by='type'), (player,))
 
     batting_data = cur.fetchall()
 
 
-    cur.execute("""
-        SELECT 
-            bat_hand as type,
-            COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END) AS wickets,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(*) / 6.0, 0) AS NUMERIC), 2) AS economy_rate,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS average,
-            ROUND(CAST(CAST(COUNT(*) AS FLOAT) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS strike_rate
-        FROM odi_db
-        WHERE bowl = %s
-        GROUP BY bat_hand
-        ORDER BY bat_hand
-    """, (player,))
+    cur.execute(metrics.select(
+        'odi_db', ['bat_hand AS type'],
+        [('wickets', 'bowler_wickets'), ('economy_rate', 'economy'), ('average', 'bowling_average'),
+         ('strike_rate', 'bowling_strike_rate')],
+        where=['bowl = %s'], order_by='type'), (player,))
     bowling_data = cur.fetchall()
 
     cur.close()
@@ -680,6 +603,7 @@ def get_player_typeagainst_analysis():
     return jsonify(response)
 
 @app.route('/api/batter-line-length')
+@cache.cached()
 def get_batter_line_length():
     player = request.args.get('player')
     if not player:
@@ -688,17 +612,9 @@ def get_batter_line_length():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    cur.execute("""
-        SELECT 
-            line,
-            length,
-            SUM(CAST(batruns AS INTEGER)) AS total_runs,
-            COUNT(*) AS balls_faced
-        FROM odi_db
-        WHERE bat = %s
-        GROUP BY line, length
-        ORDER BY total_runs DESC
-    """, (player,))
+    cur.execute(metrics.select(
+        'odi_db', ['line', 'length'], [('total_runs', 'runs'), 'balls_faced'],
+        where=['bat = %s'], order_by='total_runs DESC'), (player,))
 
     data = cur.fetchall()
     cur.close()
@@ -711,6 +627,7 @@ def get_batter_line_length():
 # 2️⃣ Batter Line-Length Strike Rate
 # ====================================
 @app.route('/api/batter-line-length-sr')
+@cache.cached()
 def get_batter_line_length_sr():
     player = request.args.get('player')
     if not player:
@@ -719,39 +636,10 @@ def get_batter_line_length_sr():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    cur.execute("""
-        SELECT 
-            line,
-            length,
-            SUM(CAST(batruns AS INTEGER)) AS total_runs,
-            COUNT(*) AS balls_faced,
-            ROUND(
-                CASE 
-                    WHEN COUNT(*) = 0 THEN 0
-                    ELSE CAST(SUM(CAST(batruns AS FLOAT)) / COUNT(*) * 100 AS NUMERIC)
-                END, 2
-            ) AS strike_rate,
-            ROUND(SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS dot_pct,
-            ROUND(SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS boundary_pct,
-            ROUND(
-                    CASE WHEN COUNT(control) > 0 
-                        THEN (
-                            SUM(
-                                COALESCE(
-                                    NULLIF(
-                                        NULLIF(LOWER(control), 'nan'),
-                                        ''
-                                    )::NUMERIC,
-                                    0
-                                )
-                            ) / COUNT(control) * 100
-                        )
-                        ELSE 0 END, 2
-                ) AS control_pct
-        FROM odi_db
-        WHERE bat = %s
-        GROUP BY line, length
-    """, (player,))
+    cur.execute(metrics.select(
+        'odi_db', ['line', 'length'],
+        [('total_runs', 'runs'), 'balls_faced', 'strike_rate', 'dot_pct', 'boundary_pct', 'control_pct'],
+        where=['bat = %s']), (player,))
 
     data = cur.fetchall()
     cur.close()
@@ -760,99 +648,24 @@ def get_batter_line_length_sr():
     return jsonify(data)
 
 @app.route("/api/batter-line-length-sr2")
+@cache.cached()
 def batter_line_length_sr2():
     player = request.args.get("player")
     if not player:
         return jsonify({"error": "Missing player"}), 400
 
-    where_clause = "WHERE bat = %s"
-    params = [player]
-
-    bowl_kind = request.args.get("bowl_kind")
-    if bowl_kind:
-        where_clause += " AND bowl_kind ILIKE %s"
-        params.append(bowl_kind)
-
-    bowl_style = request.args.get("bowl_style")
-    if bowl_style:
-        where_clause += " AND bowl_style ILIKE %s"
-        params.append(bowl_style)
-
-    phase = request.args.get("phase")  # optional (Powerplay / Middle Overs / Death Overs)
-    if phase:
-        where_clause += """ AND (
-            CASE 
-                WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-                ELSE 'Death Overs'
-            END
-        ) ILIKE %s"""
-        params.append(phase)
-
-    bowler = request.args.get("bowler")  # optional
-    if bowler:
-        where_clause += " AND bowl ILIKE %s"
-        params.append(bowler)
+    source, where, params = heatmap_filters("bat_line_length", player)
+    phase = request.args.get("phase")
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    #  Common SELECT fields
-    select_fields = """
-        line, 
-        length,
-        SUM(CAST(batruns AS FLOAT)) AS total_runs,
-        COUNT(*) AS balls_faced,
-        ROUND(
-            CASE 
-                WHEN COUNT(*) = 0 THEN 0
-                ELSE CAST(SUM(CAST(batruns AS FLOAT)) / COUNT(*) * 100 AS NUMERIC)
-            END, 2
-        ) AS strike_rate,
-        ROUND(SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS dot_pct,
-        ROUND(SUM(CASE WHEN outcome IN ('four','six') THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS boundary_pct,
-        ROUND(
-            CASE WHEN COUNT(control) > 0 
-                THEN (
-                    SUM(
-                        COALESCE(
-                            NULLIF(
-                                NULLIF(LOWER(control), 'nan'),
-                                ''
-                            )::NUMERIC,
-                            0
-                        )
-                    ) / COUNT(control) * 100
-                )
-                ELSE 0 END, 2
-        ) AS control_pct
-    """
-
     # ✅ If phase-based breakdown is needed (like for matchup/phase components)
-    if phase:
-        query = f"""
-            SELECT 
-                {select_fields},
-                CASE 
-                    WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                    WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-                    ELSE 'Death Overs'
-                END AS phase
-            FROM odi_db
-            {where_clause}
-            GROUP BY line, length, phase
-            ORDER BY line, length;
-        """
-    else:
-        # ✅ Global aggregation — no phase grouping
-        query = f"""
-            SELECT 
-                {select_fields}
-            FROM odi_db
-            {where_clause}
-            GROUP BY line, length
-            ORDER BY line, length;
-        """
+    dimensions = ["line", "length", "phase"] if phase else ["line", "length"]
+    query = metrics.select(
+        source, dimensions,
+        [("total_runs", "runs"), "balls_faced", "strike_rate", "dot_pct", "boundary_pct", "control_pct"],
+        where=where, order_by="line, length")
 
     cur.execute(query, tuple(params))
     data = cur.fetchall()
@@ -868,6 +681,7 @@ def batter_line_length_sr2():
 # 3️⃣ Batter Shot Type Analysis
 # ===============================
 @app.route('/api/batter-shot-types', methods=['GET'])
+@cache.cached()
 def get_batter_shot_types():
     try:
         player = request.args.get('player')
@@ -878,53 +692,11 @@ def get_batter_shot_types():
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # --- Fetch and cast numeric columns ---
-        query = """
-            SELECT 
-                shot,
-                SUM(CAST(batruns AS NUMERIC)) AS total_runs,
-                SUM(CAST(ballfaced AS NUMERIC)) AS total_balls,
-                SUM(CASE WHEN CAST("out" AS BOOLEAN) = TRUE THEN 1 ELSE 0 END) AS total_outs,
-                SUM(
-                COALESCE(
-                    NULLIF(NULLIF(LOWER(control), 'nan'), '')::NUMERIC, 
-                    0
-                )
-                ) AS control_sum,
-                COUNT(control) AS control_count,
-                ROUND(
-                    CASE
-                        WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                        ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                    END, 2
-                ) AS strike_rate,
-                ROUND(
-                CAST(
-                    CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                    ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                    END AS NUMERIC
-                ), 2
-                ) AS average,
-                 ROUND(
-                    CASE WHEN COUNT(control) > 0 
-                        THEN (
-                            SUM(
-                                COALESCE(
-                                    NULLIF(
-                                        NULLIF(LOWER(control), 'nan'),
-                                        ''
-                                    )::NUMERIC,
-                                    0
-                                )
-                            ) / COUNT(control) * 100
-                        )
-                        ELSE 0 END, 2
-                ) AS control_pct
-            FROM odi_db
-            WHERE bat = %s
-            GROUP BY shot
-            ORDER BY total_runs DESC;
-        """
+        query = metrics.select(
+            'odi_db', ['shot'],
+            [('total_runs', 'runs'), ('total_balls', 'balls_faced'), ('total_outs', 'out_flags'),
+             'control_sum', 'control_count', 'strike_rate', 'average', 'control_pct'],
+            where=['bat = %s'], order_by='total_runs DESC')
         cur.execute(query, (player,))
         results = cur.fetchall()
 
@@ -942,6 +714,7 @@ def get_batter_shot_types():
 # 4️⃣ Bowler Line-Length Analysis
 # ===============================
 @app.route('/api/bowler-line-length')
+@cache.cached()
 def get_bowler_line_length():
     player = request.args.get('player')
     if not player:
@@ -950,40 +723,11 @@ def get_bowler_line_length():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    cur.execute("""
-        SELECT 
-            line,
-            length,
-            COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END) AS wickets,
-            SUM(CAST(bowlruns AS INTEGER)) AS runs_conceded,
-            ROUND(
-                CASE 
-                    WHEN COUNT(*) = 0 THEN 0
-                    ELSE CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(*) / 6.0, 0) AS NUMERIC)
-                END, 2
-            ) AS economy,
-            ROUND(SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS dot_pct,
-            ROUND(SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS boundary_pct,
-            ROUND(
-                    CASE WHEN COUNT(control) > 0 
-                        THEN (
-                            SUM(
-                                COALESCE(
-                                    NULLIF(
-                                        NULLIF(LOWER(control), 'nan'),
-                                        ''
-                                    )::NUMERIC,
-                                    0
-                                )
-                            ) / COUNT(control) * 100
-                        )
-                        ELSE 0 END, 2
-                ) AS control_pct
-        FROM odi_db
-        WHERE bowl = %s
-        GROUP BY line, length
-        ORDER BY wickets DESC, economy ASC
-    """, (player,))
+    cur.execute(metrics.select(
+        'odi_db', ['line', 'length'],
+        [('wickets', 'bowler_wickets'), ('runs_conceded', 'bowl_runs'), 'economy', 'dot_pct', 'boundary_pct',
+         'control_pct'],
+        where=['bowl = %s'], order_by='wickets DESC, economy ASC'), (player,))
 
     data = cur.fetchall()
     cur.close()
@@ -996,6 +740,7 @@ def get_bowler_line_length():
 # 5️⃣ Extended Batting Stats
 # =================================
 @app.route('/api/batting-stats-extended')
+@cache.cached()
 def get_batting_stats_extended():
     player = request.args.get('player')
     if not player:
@@ -1004,28 +749,9 @@ def get_batting_stats_extended():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    cur.execute("""
-        SELECT 
-            team_bowl AS opponent,
-            SUM(CAST(batruns AS INTEGER)) AS total_runs,
-            COUNT(CASE WHEN outcome = 'out' THEN 1 END) AS dismissals,
-            ROUND(
-                CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                    ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                END, 2
-            ) AS average,
-            ROUND(
-                CASE 
-                    WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                    ELSE SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100
-                END, 2
-            ) AS strike_rate
-        FROM odi_db
-        WHERE bat = %s
-        GROUP BY team_bowl
-        ORDER BY total_runs DESC
-    """, (player,))
+    cur.execute(metrics.select(
+        'bat_rollup', ['opponent'], [('total_runs', 'runs'), ('dismissals', 'outs'), 'average', 'strike_rate'],
+        where=['player = %s'], order_by='total_runs DESC'), (player,))
 
     data = cur.fetchall()
     cur.close()
@@ -1038,6 +764,7 @@ def get_batting_stats_extended():
 # 6️⃣ Extended Bowling Stats
 # =================================
 @app.route('/api/bowling-stats-extended')
+@cache.cached()
 def get_bowling_stats_extended():
     player = request.args.get('player')
     if not player:
@@ -1046,28 +773,10 @@ def get_bowling_stats_extended():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    cur.execute("""
-        SELECT 
-            team_bat AS opponent,
-            COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END) AS wickets,
-            SUM(CAST(bowlruns AS INTEGER)) AS runs_conceded,
-            ROUND(
-                CASE 
-                    WHEN COUNT(*) = 0 THEN 0
-                    ELSE CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(*) / 6.0, 0) AS NUMERIC)
-                END, 2
-            ) AS economy,
-            ROUND(
-                CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END) = 0 THEN 0
-                    ELSE SUM(CAST(bowlruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END)
-                END, 2
-            ) AS bowling_average
-        FROM odi_db
-        WHERE bowl = %s
-        GROUP BY team_bat
-        ORDER BY wickets DESC
-    """, (player,))
+    cur.execute(metrics.select(
+        'bowl_rollup', ['opponent'],
+        [('wickets', 'bowler_wickets'), ('runs_conceded', 'bowl_runs'), 'economy', 'bowling_average'],
+        where=['player = %s'], order_by='wickets DESC'), (player,))
 
     data = cur.fetchall()
     cur.close()
@@ -1076,6 +785,7 @@ def get_bowling_stats_extended():
     return jsonify(data)
 
 @app.route('/api/batter-bowl-types', methods=['GET'])
+@cache.cached()
 def get_batter_bowl_types():
     try:
         player = request.args.get('player')
@@ -1086,36 +796,11 @@ def get_batter_bowl_types():
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # --- Fetch and cast numeric columns ---
-        query = """
-            SELECT 
-                bowl_style,
-                COUNT(*) AS total_balls,
-                SUM(CAST(batruns AS NUMERIC)) AS total_runs,
-                SUM(CASE WHEN CAST("out" AS BOOLEAN) = TRUE THEN 1 ELSE 0 END) AS total_outs,
-                SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END) AS dots,
-                ROUND(
-                CASE
-                    WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                    ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                END, 2
-            ) 	AS strike_rate,
-                ROUND(
-                CAST(
-                    CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                    ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                    END AS NUMERIC
-                ), 2
-                ) AS average,
-                ROUND(SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS dot_pct,
-                ROUND(SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS boundary_pct
-
-            FROM odi_db
-            WHERE bat = %s
-            GROUP BY bowl_style
-            ORDER BY total_runs DESC;
-
-        """
+        query = metrics.select(
+            'player_phase', ['bowl_style'],
+            [('total_balls', 'deliveries'), ('total_runs', 'runs'), ('total_outs', 'out_flags'), 'dots',
+             'strike_rate', 'average', 'dot_pct', 'boundary_pct'],
+            where=['player = %s', "role = 'bat'"], order_by='total_runs DESC')
         cur.execute(query, (player,))
         results = cur.fetchall()
 
@@ -1127,6 +812,7 @@ def get_batter_bowl_types():
         return jsonify({"error": str(e)}), 500
     
 @app.route('/api/batter-bowl-phase-types', methods=['GET'])
+@cache.cached()
 def get_batter_bowl_phase_types():
     try:
         player = request.args.get('player')
@@ -1137,41 +823,11 @@ def get_batter_bowl_phase_types():
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # --- Fetch and cast numeric columns ---
-        query = """
-            SELECT
-                CASE 
-                WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-                ELSE 'Death Overs'
-                END AS phase,
-                bowl_style,
-                COUNT(*) AS total_balls,
-                SUM(CAST(batruns AS NUMERIC)) AS total_runs,
-                SUM(CASE WHEN CAST("out" AS BOOLEAN) = TRUE THEN 1 ELSE 0 END) AS total_outs,
-                SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END) AS dots,
-                ROUND(
-                CASE
-                    WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                    ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                END, 2
-            ) 	AS strike_rate,
-                ROUND(
-                CAST(
-                    CASE 
-                    WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                    ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                    END AS NUMERIC
-                ), 2
-                ) AS average,
-                ROUND(SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS dot_pct,
-                ROUND(SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS boundary_pct
-
-            FROM odi_db
-            WHERE bat = %s
-            GROUP BY bowl_style,phase
-            ORDER BY total_runs DESC;
-
-        """
+        query = metrics.select(
+            'player_phase', ['phase', 'bowl_style'],
+            [('total_balls', 'deliveries'), ('total_runs', 'runs'), ('total_outs', 'out_flags'), 'dots',
+             'strike_rate', 'average', 'dot_pct', 'boundary_pct'],
+            where=['player = %s', "role = 'bat'"], order_by='total_runs DESC')
         cur.execute(query, (player,))
         results = cur.fetchall()
 
@@ -1183,101 +839,26 @@ def get_batter_bowl_phase_types():
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/batter-wagon")
+@cache.cached()
 def batter_wagon():
     player = request.args.get("player")
     if not player:
         return jsonify({"error": "Missing player"}), 400
 
-    # --- Build dynamic WHERE clause ---
-    where_clause = "WHERE bat = %s"
-    params = [player]
-
-    bowl_kind = request.args.get("bowl_kind")
-    if bowl_kind:
-        where_clause += " AND bowl_kind ILIKE %s"
-        params.append(bowl_kind)
-
-    bowl_style = request.args.get("bowl_style")
-    if bowl_style:
-        where_clause += " AND bowl_style ILIKE %s"
-        params.append(bowl_style)
-
-    bowler = request.args.get("bowler")
-    if bowler:
-        where_clause += " AND bowl ILIKE %s"
-        params.append(bowler)
-
+    source, where, params = heatmap_filters("bat_wagon", player)
     phase = request.args.get("phase")
-    if phase:
-        where_clause += """ AND (
-            CASE 
-                WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-                ELSE 'Death Overs'
-            END
-        ) ILIKE %s"""
-        params.append(phase)
+    bowl_style = request.args.get("bowl_style")
 
     # --- Query ---
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-     #  Common SELECT fields
-    select_fields = """
-            wagonZone,
-            COUNT(*) AS balls_faced,
-            SUM(CAST(batruns AS FLOAT)) AS total_runs,
-            ROUND(
-                CASE 
-                    WHEN COUNT(*) = 0 THEN 0
-                    ELSE CAST(SUM(CAST(batruns AS FLOAT)) / COUNT(*) * 100 AS NUMERIC)
-                END, 2
-            ) AS strike_rate,
-            ROUND(SUM(CASE WHEN outcome IN ('four','six') THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS boundary_pct,
-            ROUND(SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100, 2) AS dot_pct,
-            ROUND(
-                CASE WHEN COUNT(control) > 0 
-                    THEN (
-                        SUM(
-                            COALESCE(
-                                NULLIF(
-                                    NULLIF(LOWER(control), 'nan'),
-                                    ''
-                                )::NUMERIC,
-                                0
-                            )
-                        ) / COUNT(control) * 100
-                    )
-                    ELSE 0 END, 2
-            ) AS control_pct
-    """
-
     # ✅ If phase-based breakdown is needed (like for matchup/phase components)
-    if phase and bowl_style:
-        query = f"""
-            SELECT 
-                {select_fields},
-                CASE 
-                    WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                    WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-                    ELSE 'Death Overs'
-                END AS phase,
-                bowl_style
-            FROM odi_db
-            {where_clause}
-            GROUP BY wagonZone, phase,bowl_style
-            ORDER BY wagonZone;
-        """
-    else:
-        # ✅ Global aggregation — no phase grouping
-        query = f"""
-            SELECT 
-                {select_fields}
-            FROM odi_db
-            {where_clause}
-            GROUP BY wagonZone
-            ORDER BY wagonZone;
-        """
+    dimensions = ["wagonZone", "phase", "bowl_style"] if phase and bowl_style else ["wagonZone"]
+    query = metrics.select(
+        source, dimensions,
+        ["balls_faced", ("total_runs", "runs"), "strike_rate", "boundary_pct", "dot_pct", "control_pct"],
+        where=where, order_by="wagonZone")
 
     cur.execute(query, tuple(params))
     data = cur.fetchall()
@@ -1290,133 +871,22 @@ def batter_wagon():
 
 
 @app.route("/api/batter-skill-profile")
+@cache.cached()
 def player_skill_profile():
     player = request.args.get("player")
     if not player:
         return jsonify({"error": "Missing player"}), 400
     
     conn = get_db_connection()
-    conn.autocommit = True
     cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    query = f"""
-        SELECT
-            CASE 
-            WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-            WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-            ELSE 'Death Overs'
-            END AS phase, 
-            ROUND(
-                CASE
-                    WHEN SUM(CAST(ballfaced AS FLOAT)) = 0 THEN 0
-                    ELSE CAST(SUM(CAST(batruns AS FLOAT)) / SUM(CAST(ballfaced AS FLOAT)) * 100 AS NUMERIC)
-                END, 2
-            ) AS strike_rate,
-            ROUND(
-            CAST(
-                CASE 
-                WHEN COUNT(CASE WHEN outcome = 'out' THEN 1 END) = 0 THEN SUM(CAST(batruns AS FLOAT))
-                ELSE SUM(CAST(batruns AS FLOAT)) / COUNT(CASE WHEN outcome = 'out' THEN 1 END)
-                END AS NUMERIC
-            ), 2
-            ) AS average
-            FROM odi_db
-            WHERE bat = %s
-            GROUP BY phase
-    """
-
-    cur.execute(query, (player,))
-    sr_data = cur.fetchall()
-
-    query2 = f"""
-        SELECT
-            ROUND(
-                (SUM(CASE WHEN POSITION('no run' IN LOWER(TRIM(outcome))) > 0 THEN 1 ELSE 0 END)::NUMERIC 
-                / NULLIF(COUNT(*),0)) * 100, 2
-            ) AS dot_pct,
-            ROUND(
-                (SUM(CASE WHEN LOWER(TRIM(outcome)) IN ('four', '6', 'six') THEN 1 ELSE 0 END)::NUMERIC 
-                / NULLIF(COUNT(*),0)) * 100, 2
-            ) AS boundary_pct,
-            ROUND(
-                CAST(
-                    (
-                        (
-                            SUM(CAST(batruns AS NUMERIC))
-                            - SUM(CASE WHEN outcome IN ('four', 'six') THEN CAST(batruns AS NUMERIC) ELSE 0 END)
-                        )
-                        / NULLIF(
-                            (COUNT(*) - SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END))
-                        , 0)
-                    ) * 100
-                AS NUMERIC), 2
-            ) AS nbsr,
-            ROUND(
-                CAST(
-                    (SUM(CASE WHEN CAST(batruns AS INT) = 1 THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100)
-                AS NUMERIC), 2
-            ) AS singles_pct,
-            ROUND(
-                CAST(
-                    (
-                        (0.4 * 
-                            (
-                                (
-                                    (
-                                        (SUM(CAST(batruns AS NUMERIC))
-                                        - SUM(CASE WHEN outcome IN ('four', 'six') THEN CAST(batruns AS NUMERIC) ELSE 0 END))
-                                        / NULLIF(
-                                            (COUNT(*) - SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END))
-                                        , 0)
-                                    ) * 100
-                                )
-                            )
-                        )
-                        + (0.4 * 
-                            (SUM(CASE WHEN CAST(batruns AS INT) = 1 THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100)
-                        )
-                        + (0.2 *
-                            (100 - (SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100))
-                        )
-                    )
-                AS NUMERIC), 2
-            ) AS sri
-        FROM odi_db
-        WHERE LOWER(bat) = LOWER(%s);
-    """
-
-    cur.execute(query2, (player,))
-    row = cur.fetchone()
-
-    pct_data = {}
-    if row:
-        pct_data["dot_pct"] = float(row.get("dot_pct") or 0)
-        pct_data["boundary_pct"] = float(row.get("boundary_pct") or 0)
-        pct_data["nbsr"] = float(row.get("nbsr") or 0)
-        pct_data["singles_pct"] = float(row.get("singles_pct") or 0)
-        pct_data["sri"] = float(row.get("sri") or 0)
-    else:
-        pct_data["dot_pct"] = 0
-        pct_data["boundary_pct"] = 0
-        pct_data["nbsr"] = 0
-        pct_data["singles_pct"] = 0
-        pct_data["sri"] = 0
-
-    conn.commit()
+    profile = profiles.batter_profile(cur, player)
     cur.close()
     conn.close()
 
-    return jsonify({"pp_sr": next((row["strike_rate"] for row in sr_data if row["phase"] == "Powerplay"), 0),
-                    "middle_sr": next((row["strike_rate"] for row in sr_data if row["phase"] == "Middle Overs"), 0),
-                    "death_sr": next((row["strike_rate"] for row in sr_data if row["phase"] == "Death Overs"), 0),
-                    "boundary_pct": pct_data["boundary_pct"] or 0,
-                    "dot_pct": pct_data["dot_pct"] or 0,
-                    "nbsr":pct_data["nbsr"] or 0,
-                    "singles_pct":pct_data["singles_pct"] or 0,
-                    "sri":pct_data["sri"]
-                    })
+    return jsonify(profile)
 
 @app.route("/api/bowler-skill-profile")
+@cache.cached()
 def bowler_skill_profile():
     player = request.args.get("player")
     if not player:
@@ -1424,270 +894,44 @@ def bowler_skill_profile():
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Phase-wise economy
-    phase_query = """
-        SELECT
-            CASE 
-                WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle Overs'
-                ELSE 'Death Overs'
-            END AS phase,
-            ROUND(
-                CAST(
-                    (SUM(CAST(score AS NUMERIC)) / NULLIF(COUNT(ball_id), 0)) * 6 
-                AS NUMERIC), 2
-            ) AS economy
-        FROM odi_db
-        WHERE bowl = %s
-        GROUP BY phase
-        ORDER BY phase;
-    """
-
-    cur.execute(phase_query, (player,))
-    phase_data = cur.fetchall()
-
-    # Overall skill metrics
-    skill_query = """
-        SELECT
-            ROUND(
-                CAST(
-                    (SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*)) * 100
-                AS NUMERIC), 2
-            ) AS dot_pct,
-            ROUND(
-                CAST(
-                    (SUM(CASE WHEN CAST("out" AS BOOLEAN) = TRUE THEN 1 ELSE 0 END)::NUMERIC / COUNT(*)) * 100
-                AS NUMERIC), 2
-            ) AS wicket_pct,
-            ROUND(CAST(SUM(CAST(bowlruns AS FLOAT)) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS average,
-            ROUND(CAST(CAST(COUNT(*) AS FLOAT) / NULLIF(COUNT(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 END), 0) AS NUMERIC), 2) AS strike_rate,
-            ROUND(
-                CAST(
-                    (SUM(CAST(score AS NUMERIC)) / NULLIF(COUNT(ball_id),0)) * 6
-                AS NUMERIC), 2
-            ) AS overall_econ
-        FROM odi_db
-        WHERE bowl = %s;
-    """
-
-    cur.execute(skill_query, (player,))
-    skill_data = cur.fetchone()
-
-    # Compute Bowler Efficiency Index (BEI)
-    bei_query = """
-        SELECT
-            ROUND(
-                CAST(
-                    (
-                        (0.3 * (100 - ((SUM(CAST(score AS NUMERIC)) / NULLIF(COUNT(ball_id),0)) * 6))) +
-                        (0.3 * ((SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100))) +
-                        (0.2 * ((SUM(CASE WHEN CAST("out" AS BOOLEAN) = TRUE THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100))) +
-                        (0.2 * (100 - (SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100)))
-                    )
-                AS NUMERIC), 2
-            ) AS bei
-        FROM odi_db
-        WHERE bowl = %s;
-    """
-
-    cur.execute(bei_query, (player,))
-    bei_data = cur.fetchone()
-
+    profile = profiles.bowler_profile(cur, player)
     cur.close()
     conn.close()
 
-    return jsonify({
-        "phase_data": phase_data,
-        "skills": skill_data,
-        "bei": bei_data
-    })
+    return jsonify(profile)
+
+# Benchmarks are precomputed per dataset version (see benchmarks.py). Until
+# the refresher has caught up with a load the previous version's payload is
+# served, so the cache key carries the stored version: the newer payload is
+# a miss rather than an hour away.
+def benchmark_revision(name):
+    def revision():
+        conn = get_db_connection()
+        version = benchmarks.stored_version(conn, name)
+        conn.close()
+        return "b{}".format(version)
+    return revision
 
 @app.route("/api/global-phase-benchmarks")
+@cache.cached(revision=benchmark_revision("batting"))
 def global_phase_benchmarks():
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    query = """
-        WITH player_phase_stats AS (
-            SELECT 
-                bat,
-                CASE 
-                    WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                    WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle'
-                    ELSE 'Death'
-                END AS phase,
-                SUM(CAST(batruns AS FLOAT)) AS total_runs,
-                SUM(CAST(ballfaced AS FLOAT)) AS total_balls,
-                SUM(CASE WHEN LOWER(outcome) IN ('four', 'six') THEN 1 ELSE 0 END)::FLOAT AS boundaries,
-                SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::FLOAT AS dots,
-                SUM(CASE WHEN CAST("out" AS BOOLEAN) = TRUE THEN 1 ELSE 0 END)::FLOAT AS outs,
-                COUNT(*)::FLOAT AS total_balls_faced
-            FROM odi_db
-            WHERE bat IS NOT NULL
-            GROUP BY bat, phase
-        ),
-        aggregated AS (
-            SELECT
-                bat,
-                phase,
-                (total_runs / NULLIF(total_balls, 0)) * 100 AS sr,
-                (boundaries / NULLIF(total_balls_faced, 0)) * 100 AS boundary_pct,
-                (dots / NULLIF(total_balls_faced, 0)) * 100 AS dot_pct,
-                ((total_balls_faced - boundaries - dots) / NULLIF(total_balls_faced, 0)) * 100 AS sri,
-                (total_runs / NULLIF(outs, 0)) AS average
-            FROM player_phase_stats
-        )
-        SELECT 
-            phase,
-            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY sr)::NUMERIC, 2) AS sr_95,
-            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY boundary_pct)::NUMERIC, 2) AS boundary_95,
-            ROUND(PERCENTILE_CONT(0.05) WITHIN GROUP (ORDER BY dot_pct)::NUMERIC, 2) AS dot_95,
-            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY sri)::NUMERIC, 2) AS sri_95,
-            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY average)::NUMERIC, 2) AS avg_95
-        FROM aggregated
-        GROUP BY phase
-        ORDER BY 
-            CASE 
-                WHEN phase = 'Powerplay' THEN 1
-                WHEN phase = 'Middle' THEN 2
-                WHEN phase = 'Death' THEN 3
-            END;
-    """
-
-    cur.execute(query)
-    rows = cur.fetchall()
-
-    global_query = """
-    WITH player_agg AS (
-        SELECT 
-            bat,
-            SUM(CAST(batruns AS NUMERIC)) AS total_runs,
-            COUNT(*)::NUMERIC AS total_balls,
-            SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END)::NUMERIC AS boundaries,
-            SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC AS dots,
-            SUM(CASE WHEN CAST(batruns AS INT) = 1 THEN 1 ELSE 0 END)::NUMERIC AS singles,
-            SUM(CASE WHEN outcome IN ('four', 'six') THEN CAST(batruns AS NUMERIC) ELSE 0 END)::NUMERIC AS boundary_runs
-        FROM odi_db
-        WHERE bat IS NOT NULL
-        GROUP BY bat
-    ),
-    derived AS (
-        SELECT
-            bat,
-            ROUND(
-                CAST(
-                    (
-                        (0.4 * 
-                            (
-                                (
-                                    (
-                                        (total_runs - boundary_runs)
-                                        / NULLIF((total_balls - boundaries), 0)
-                                    ) * 100
-                                )
-                            )
-                        )
-                        + (0.4 * (singles / NULLIF(total_balls, 0) * 100))
-                        + (0.2 * (100 - (dots / NULLIF(total_balls, 0) * 100)))
-                    )
-                AS NUMERIC), 2
-            ) AS sri,
-            ROUND((boundaries / NULLIF(total_balls, 0)) * 100, 2) AS boundary_pct
-        FROM player_agg
-    )
-    SELECT 
-        ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY sri)::NUMERIC, 2) AS sri_95_global,
-        ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY boundary_pct)::NUMERIC, 2) AS boundary_95_global
-    FROM derived;
-"""
-    cur.execute(global_query)
-    dataaa = cur.fetchone()
-    cur.close()
-    conn.close()
-
-    benchmarks = {row["phase"]: row for row in rows}
-    return jsonify({"phase":benchmarks,"global":dataaa})
+    return benchmark_response("batting")
 
 @app.route("/api/bowlers-global-benchmarks")
+@cache.cached(revision=benchmark_revision("bowling"))
 def bowlers_global_benchmarks():
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Phase-based 95th percentiles (Powerplay, Middle, Death)
-    phase_query = """
-        SELECT
-            phase,
-            ROUND(PERCENTILE_CONT(0.05) WITHIN GROUP (
-                ORDER BY economy
-            )::NUMERIC, 2) AS econ_95,
-            ROUND(PERCENTILE_CONT(0.05) WITHIN GROUP (
-                ORDER BY strike_rate
-            )::NUMERIC, 2) AS sr_95,
-            ROUND(PERCENTILE_CONT(0.05) WITHIN GROUP (
-                ORDER BY average
-            )::NUMERIC, 2) AS avg_95
-        FROM (
-            SELECT
-                CASE 
-                    WHEN CAST(over AS INTEGER) <= 10 THEN 'Powerplay'
-                    WHEN CAST(over AS INTEGER) BETWEEN 11 AND 40 THEN 'Middle'
-                    ELSE 'Death'
-                END AS phase,
-                (SUM(CAST(score AS FLOAT)) / NULLIF(COUNT(ball_id), 0)) * 6 AS economy,
-                (CAST(COUNT(ball_id) AS FLOAT) / NULLIF(SUM(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 ELSE 0 END), 0)) AS strike_rate,
-                (SUM(CAST(bowlruns AS FLOAT)) / NULLIF(SUM(CASE WHEN outcome = 'out' AND dismissal != 'run out' THEN 1 ELSE 0 END), 0)) AS average
-            FROM odi_db
-            WHERE bowl IS NOT NULL
-            GROUP BY phase, bowl
-        ) sub
-        GROUP BY phase
-        ORDER BY phase;
-    """
-
-    cur.execute(phase_query)
-    phase_rows = cur.fetchall()
+    return benchmark_response("bowling")
 
-    # Global metrics (dot%, wicket%, BEI)
-    global_query = """
-        SELECT
-        ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY dot_pct)::NUMERIC, 2) AS dot_95_global,
-        ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY wicket_pct)::NUMERIC, 2) AS wicket_95_global,
-        ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY bei)::NUMERIC, 2) AS bei_95_global
-        FROM (
-            SELECT
-                bowl,
-                (SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*)) * 100 AS dot_pct,
-
-                (SUM(CASE WHEN CAST("out" AS BOOLEAN) = TRUE THEN 1 ELSE 0 END)::NUMERIC / COUNT(*)) * 100 AS wicket_pct,
-
-                (
-                    (0.3 * (100 - ((SUM(CAST(score AS NUMERIC)) / NULLIF(COUNT(ball_id), 0)) * 6))) +
-                    (0.3 * ((SUM(CASE WHEN LOWER(outcome) = 'no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100))) +
-                    (0.2 * ((SUM(CASE WHEN CAST("out" AS BOOLEAN) = TRUE THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100))) +
-                    (0.2 * (100 - (SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100)))
-                ) AS bei
-            FROM odi_db
-            WHERE bowl IS NOT NULL
-            GROUP BY bowl
-        ) sub;
-    """
-
-    cur.execute(global_query)
-    global_row = cur.fetchone()
-
-    cur.close()
+def benchmark_response(name):
+    conn = get_db_connection()
+    payload = benchmarks.get(conn, name)
     conn.close()
-
-    # Convert list to dict
-    phase_dict = {row["phase"]: row for row in phase_rows}
-
-    return jsonify({
-        "phase": phase_dict,
-        "global": global_row
-    })
+    if payload is None:
+        return jsonify({"error": "Benchmarks are being computed, try again shortly"}), 503
+    return jsonify(payload)
 
 @app.route("/api/batter-zone-summary")
+@cache.cached()
 def batter_zone_summary():
     player = request.args.get("player")
     bowl_style = request.args.get("bowl_style")
@@ -1698,47 +942,13 @@ def batter_zone_summary():
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    query = f"""
-        SELECT
-            ROUND(SUM(CAST(batruns AS NUMERIC))/NULLIF(COUNT(ball_id),0)*100,2) AS strike_rate,
-            ROUND(SUM(CASE WHEN outcome IN ('four','six') THEN 1 ELSE 0 END)::NUMERIC/COUNT(*)*100,2) AS boundary_pct,
-            ROUND(SUM(CASE WHEN LOWER(outcome)='no run' THEN 1 ELSE 0 END)::NUMERIC/COUNT(*)*100,2) AS dot_pct,
-            ROUND(
-                    CASE WHEN COUNT(control) > 0 
-                        THEN (
-                            SUM(
-                                COALESCE(
-                                    NULLIF(
-                                        NULLIF(LOWER(control), 'nan'),
-                                        ''
-                                    )::NUMERIC,
-                                    0
-                                )
-                            ) / COUNT(control) * 100
-                        )
-                        ELSE 0 END, 2
-                ) AS ctrl_pct,
-            ROUND(
-                CAST(
-                    (
-                        (0.4 * 
-                            (
-                                ((SUM(CAST(batruns AS NUMERIC)) - 
-                                SUM(CASE WHEN outcome IN ('four', 'six') THEN CAST(batruns AS NUMERIC) ELSE 0 END))
-                                / NULLIF(
-                                    (COUNT(*) - SUM(CASE WHEN outcome IN ('four', 'six') THEN 1 ELSE 0 END))
-                                , 0)) * 100
-                            )
-                        )
-                        + (0.4 * (SUM(CASE WHEN CAST(batruns AS INT)=1 THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100))
-                        + (0.2 * (100 - (SUM(CASE WHEN LOWER(outcome)='no run' THEN 1 ELSE 0 END)::NUMERIC / COUNT(*) * 100)))
-                    ) AS NUMERIC
-                ), 2
-            ) AS sri
-        FROM odi_db
-        WHERE bat=%s
-        { "AND bowl_kind ILIKE %s" if bowl_style else "" }
-    """
+    where = ["player = %s", "role = 'bat'"]
+    if bowl_style:
+        where.append("bowl_kind ILIKE %s")
+    query = metrics.select(
+        "player_phase",
+        metrics=["strike_rate", "boundary_pct", "dot_pct", ("ctrl_pct", "control_pct"), "sri"],
+        where=where)
 
     params = [player]
     if bowl_style:
@@ -1753,4 +963,5 @@ def batter_zone_summary():
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    pool.fill()
+    app.run(debug=True, threaded=True)
\ No newline at end of file
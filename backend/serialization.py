@@ -0,0 +1,93 @@
+import datetime
+import gzip
+import json
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# JSON encoding and compression for API responses, kept free of Flask so that
+# bench_json.py can time it on its own (responses.py plugs it into the app).
+#
+# Output matches what Flask's default encoder has always produced for our
+# rows: sorted keys and Decimal as a string ("142.86"). orjson is used when
+# installed; its C encoder handles the Decimal hook without the per-value
+# Python dispatch of json.JSONEncoder. Dates are ISO 8601 on both paths.
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if hasattr(value, "tolist"):
+        # NumPy scalars and arrays
+        return value.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+if orjson is not None:
+    ENCODER = "orjson"
+    _OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+else:
+    ENCODER = "json"
+    _encoder = json.JSONEncoder(default=_default, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode()
+
+
+# Compact form of a list of rows that share their keys:
+#     [{"a": 1, "b": 2}, {"a": 3, "b": 4}]  ->  {"columns": ["a", "b"], "rows": [[1, 2], [3, 4]]}
+# Anything else is returned unchanged.
+def to_columns(obj):
+    if not isinstance(obj, list) or not obj or not all(isinstance(row, dict) for row in obj):
+        return obj
+    columns = sorted(obj[0])
+    if any(len(row) != len(columns) for row in obj):
+        return obj
+    try:
+        return {"columns": columns, "rows": [[row[name] for name in columns] for row in obj]}
+    except KeyError:
+        return obj
+
+
+# Content codings in order of preference, with their compressors
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSORS = {}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+COMPRESSORS["gzip"] = lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+# The preferred coding the client accepts (q > 0) for an Accept-Encoding value
+def negotiate(accept_encoding):
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for coding in COMPRESSORS:
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def compress(data, coding):
+    return COMPRESSORS[coding](data)
@@ -1,47 +1,283 @@
+import argparse
+import io
+import re
+import resource
+import time
+
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
-import re
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-# Database connection parameters
-db_params = {
-    "host": os.getenv("DB_HOST"),
-    "database": os.getenv("DB_DATABASE"),
-    "user": os.getenv("DB_USERNAME"),
-    "password": os.getenv("DB_PASSWORD"),
-    "port": os.getenv("DB_PORT"),
-    "sslmode": "require"
-}
-
-# Read the CSV file
-df = pd.read_csv('new_odi_bbb2.csv')
+
+import columnar
+import derived
+import indexes
+import schema
+# Imported for their derived-table registrations
+import dimensions
+import rollups
+from db import db_params
+
+CSV_PATH = 'new_odi_bbb2.csv'
+TABLE = 'odi_db'
+STAGING_TABLE = TABLE + schema.STAGING_SUFFIX
+# Rows per chunk; peak memory is bounded by this, not by the size of the CSV
+CHUNK_SIZE = 50_000
+
 
 # Clean column names (replace invalid characters with underscores)
-df.columns = [re.sub(r'\W+', '', col).strip('').lower() for col in df.columns]
+def clean_column(col):
+    return re.sub(r'\W+', '', col).strip('').lower()
+
+
+# Read the CSV file lazily, one bounded chunk at a time
+def read_chunks(csv_path, chunksize):
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, low_memory=False, na_values=schema.NULL_TOKENS):
+        chunk.columns = [clean_column(col) for col in chunk.columns]
+        yield chunk
+
+
+# Use the types of an existing table, otherwise infer them with a first
+# streaming pass over the CSV and create the table
+def prepare_table(cursor, csv_path, chunksize):
+    column_types = schema.table_column_types(cursor, TABLE)
+    if column_types:
+        return column_types
+    print("Inferring column types...")
+    column_types = schema.infer_column_types(read_chunks(csv_path, chunksize))
+    cursor.execute(schema.create_table_sql(TABLE, column_types))
+    return column_types
+
+
+def build_indexes(cursor, table, column_types):
+    schema.ensure_natural_key(cursor, table, column_types)
+    indexes.create_indexes(cursor, table)
+
+
+# Stream one chunk into Postgres through COPY. Missing values are written as
+# empty fields, which COPY stores as NULL.
+def copy_chunk(cursor, table, chunk):
+    buf = io.StringIO()
+    chunk.to_csv(buf, header=False, index=False, na_rep='')
+    buf.seek(0)
+    column_names = ', '.join('"{}"'.format(col) for col in chunk.columns)
+    cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(table, column_names), buf)
+
+
+def peak_memory_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# COPY the CSV into `table`, skipping rows whose match is in `skip_matches`.
+# Returns (rows copied, matches copied).
+def stream_csv(cursor, table, csv_path, chunksize, column_types, skip_matches=()):
+    start = time.perf_counter()
+    total = 0
+    matches = set()
+    for chunk in read_chunks(csv_path, chunksize):
+        chunk = schema.coerce_chunk(chunk, column_types)
+        if skip_matches:
+            chunk = chunk[~chunk['p_match'].astype(str).isin(skip_matches)]
+        if chunk.empty:
+            continue
+        copy_chunk(cursor, table, chunk)
+        total += len(chunk)
+        matches.update(chunk['p_match'].astype(str).unique())
+        elapsed = time.perf_counter() - start
+        print("  {:>10,} rows  {:>10,.0f} rows/sec  peak {:.0f} MB".format(
+            total, total / elapsed, peak_memory_mb()))
+
+    elapsed = time.perf_counter() - start
+    print("Copied {:,} rows from {:,} matches in {:.1f}s ({:,.0f} rows/sec, peak {:.0f} MB)".format(
+        total, len(matches), elapsed, total / elapsed if elapsed else 0, peak_memory_mb()))
+    return total, len(matches)
+
+
+# Full reload: replace the contents of odi_db with the CSV
+def load(csv_path=CSV_PATH, chunksize=CHUNK_SIZE):
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+
+    column_types = prepare_table(cursor, csv_path, chunksize)
+    cursor.execute("TRUNCATE {} RESTART IDENTITY".format(TABLE))
+    rows, matches = stream_csv(cursor, TABLE, csv_path, chunksize, column_types)
+    build_indexes(cursor, TABLE, column_types)
+    derived.refresh(cursor, TABLE)
+    version = schema.record_ingest(cursor, 'full', rows, matches)
+
+    # Commit the transaction and close the connection
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print("Data imported successfully! (dataset version {})".format(version))
+
+
+# Incremental load: only matches not yet in odi_db are read from the CSV.
+# They are staged in a temp table and upserted on the natural key, so the
+# run is idempotent and its cost is proportional to the new data.
+def load_incremental(csv_path=CSV_PATH, chunksize=CHUNK_SIZE):
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+
+    column_types = prepare_table(cursor, csv_path, chunksize)
+    build_indexes(cursor, TABLE, column_types)
+    key = schema.natural_key(column_types)
+
+    cursor.execute("SELECT DISTINCT p_match FROM {}".format(TABLE))
+    existing = {str(row[0]) for row in cursor.fetchall()}
+    print("{:,} matches already loaded".format(len(existing)))
+
+    columns = ', '.join('"{}"'.format(col) for col in column_types)
+    cursor.execute("CREATE TEMP TABLE incoming ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA".format(columns, TABLE))
+    rows, matches = stream_csv(cursor, 'incoming', csv_path, chunksize, column_types, skip_matches=existing)
+
+    if rows:
+        key_columns = ', '.join('"{}"'.format(col) for col in key)
+        updates = ', '.join('"{0}" = EXCLUDED."{0}"'.format(col) for col in column_types if col not in key)
+        cursor.execute("""
+            INSERT INTO {table} ({columns})
+            SELECT DISTINCT ON ({key}) {columns} FROM incoming ORDER BY {key}
+            ON CONFLICT ({key}) DO UPDATE SET {updates}
+        """.format(table=TABLE, columns=columns, key=key_columns, updates=updates))
+        upserted = cursor.rowcount
+        # Only the rows of the matches and players in `incoming` change
+        derived.update(cursor, TABLE, 'incoming')
+        version = schema.record_ingest(cursor, 'incremental', rows, matches)
+        print("Upserted {:,} rows from {:,} new matches (dataset version {})".format(upserted, matches, version))
+    else:
+        print("No new matches")
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+# Zero-downtime reload: build a complete new odi_db (plus its indexes and
+# derived tables) next to the live one, check it, then swap it in with
+# renames in one short transaction. The API keeps reading the old table
+# until the swap commits.
+def load_swap(csv_path=CSV_PATH, chunksize=CHUNK_SIZE, allow_shrink=False):
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+
+    column_types = schema.table_column_types(cursor, TABLE)
+    if not column_types:
+        print("Inferring column types...")
+        column_types = schema.infer_column_types(read_chunks(csv_path, chunksize))
+    cursor.execute("DROP TABLE IF EXISTS {}".format(STAGING_TABLE))
+    cursor.execute(schema.create_table_sql(STAGING_TABLE, column_types))
+    rows, matches = stream_csv(cursor, STAGING_TABLE, csv_path, chunksize, column_types)
+    build_indexes(cursor, STAGING_TABLE, column_types)
+    cursor.execute("ANALYZE {}".format(STAGING_TABLE))
+    pairs = [(TABLE, STAGING_TABLE)] + derived.build_all(cursor, STAGING_TABLE)
+    conn.commit()
+
+    # Validate before touching the live table
+    cursor.execute("SELECT COUNT(*) FROM {}".format(STAGING_TABLE))
+    staged = cursor.fetchone()[0]
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (TABLE,))
+    live = 0
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT COUNT(*) FROM {}".format(TABLE))
+        live = cursor.fetchone()[0]
+    conn.commit()
+    problem = None
+    if staged != rows or staged == 0:
+        problem = "staging has {:,} rows, expected {:,}".format(staged, rows)
+    elif staged < live and not allow_shrink:
+        problem = "staging has {:,} rows but live has {:,} (use --allow-shrink)".format(staged, live)
+    if problem:
+        cursor.close()
+        conn.close()
+        raise SystemExit("Not swapping: " + problem + "; {} left in place for inspection".format(STAGING_TABLE))
+
+    start = time.perf_counter()
+    schema.swap_tables(cursor, pairs)
+    version = schema.record_ingest(cursor, 'swap', rows, matches)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print("Swapped in {:,} rows ({:+,} vs previous) in {:.0f} ms (dataset version {})".format(
+        staged, staged - live, (time.perf_counter() - start) * 1000, version))
+
+
+# Rebuild only the derived tables from the live odi_db
+def refresh_derived():
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    derived.refresh(cursor, TABLE)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print("Rebuilt {} in {:.1f}s".format(', '.join(derived.DERIVED_TABLES), time.perf_counter() - start))
 
-# Create a connection to the database
-conn = psycopg2.connect(**db_params)
-cursor = conn.cursor()
 
-# Create the table
-column_definitions = ', '.join('"{}" VARCHAR'.format(col) for col in df.columns)
-create_table_query = "CREATE TABLE IF NOT EXISTS odi_db (id SERIAL PRIMARY KEY, {})".format(column_definitions)
-cursor.execute(create_table_query)
+# Snapshot of the live odi_db for the API workers to map (see columnar.py),
+# written after a load when the API serves from memory or on --snapshot.
+# A version that already has one is left alone.
+def write_snapshot():
+    if columnar.np is None:
+        print("numpy is not installed; no columnar snapshot written")
+        return
+    start = time.perf_counter()
+    table = columnar.load()
+    path = columnar.save_snapshot(table)
+    print("Wrote columnar snapshot {} ({:,} rows, {:.0f} MB) in {:.1f}s".format(
+        path, table.rows, table.nbytes() / 2 ** 20, time.perf_counter() - start))
 
-# Prepare the data for insertion
-data = [tuple(x) for x in df.to_numpy()]
 
-# Insert the data
-column_names = ', '.join('"{}"'.format(col) for col in df.columns)
-insert_query = "INSERT INTO odi_db ({}) VALUES %s".format(column_names)
-execute_values(cursor, insert_query, data)
+# Upgrade an existing odi_db in place: retype VARCHAR columns, add derived
+# columns, then build what a load would (natural key, indexes, derived
+# tables) and record it as a new dataset version, so the API's tables and
+# caches follow the retyped data
+def migrate():
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+    types = schema.migrate_table(cursor, TABLE)
+    build_indexes(cursor, TABLE, schema.table_column_types(cursor, TABLE))
+    derived.refresh(cursor, TABLE)
+    cursor.execute("SELECT COUNT(*), COUNT(DISTINCT p_match) FROM {}".format(TABLE))
+    rows, matches = cursor.fetchone()
+    version = schema.record_ingest(cursor, 'migrate', rows, matches)
+    conn.commit()
+    # ALTER ... TYPE rewrote the table; refresh planner statistics for the new types
+    cursor.execute("ANALYZE {}".format(TABLE))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    for col, typ in types.items():
+        print("  {:<20} {}".format(col, typ))
+    print("Migrated {} columns of {} (dataset version {})".format(len(types), TABLE, version))
 
-# Commit the transaction and close the connection
-conn.commit()
-cursor.close()
-conn.close()
 
-print("Data imported successfully!")
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load the ball-by-ball CSV into Postgres")
+    parser.add_argument('csv', nargs='?', default=CSV_PATH)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--mode', choices=['full', 'incremental', 'swap'], default='full',
+                        help="full replaces odi_db; incremental appends matches not loaded yet; "
+                             "swap rebuilds in a staging table and swaps it in without blocking the API")
+    parser.add_argument('--allow-shrink', action='store_true', help="let swap mode replace odi_db with fewer rows")
+    parser.add_argument('--migrate', action='store_true', help="upgrade an existing odi_db (column types, derived columns, indexes and tables) instead of loading")
+    parser.add_argument('--refresh', action='store_true', help="rebuild the derived tables from the live odi_db instead of loading")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="write the columnar snapshot after loading (default when ODI_ENGINE=memory)")
+    parser.add_argument('--snapshot-only', action='store_true', help="only write the columnar snapshot of the live odi_db")
+    args = parser.parse_args()
+    if args.migrate:
+        migrate()
+        if args.snapshot or columnar.ENGINE == 'memory':
+            write_snapshot()
+    elif args.refresh:
+        refresh_derived()
+    elif args.snapshot_only:
+        write_snapshot()
+    else:
+        if args.mode == 'incremental':
+            load_incremental(args.csv, args.chunksize)
+        elif args.mode == 'swap':
+            load_swap(args.csv, args.chunksize, args.allow_shrink)
+        else:
+            load(args.csv, args.chunksize)
+        if args.snapshot or columnar.ENGINE == 'memory':
+            write_snapshot()
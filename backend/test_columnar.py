@@ -0,0 +1,228 @@
+import random
+import sqlite3
+from decimal import Decimal
+
+import pytest
+
+import columnar
+import derived
+import metrics
+import profiles
+import rollups  # noqa: F401 (registers the summary table builders)
+
+# columnar.execute() against SQL on a small fixed table. The reference runs
+# the SQL metrics.select() generates, and builds the summary tables with the
+# builders the loader uses, on SQLite: the same queries on another engine,
+# so a divergence in the in-memory evaluation (NULL rules, FILTER, HAVING,
+# the summary-table views) shows up without a Postgres server. parity.py
+# remains the end-to-end check against the real database.
+
+TYPES = {
+    "p_match": "integer", "year": "integer", "wagonzone": "integer", "batruns": "integer", "ballfaced": "integer",
+    "bowlruns": "integer", "score": "integer", "ball_id": "integer", "control": "numeric", "out": "boolean",
+    "is_dot": "boolean", "is_boundary": "boolean", "is_bowler_wicket": "boolean",
+}
+# The rollups' grain assumes one opponent per player and match
+TEAMS = [("India", "Australia"), ("Australia", "England"), ("England", None), (None, "India")]
+TEXT = {
+    "bat_hand": ["RHB", "LHB"],
+    "bowl_kind": ["pace bowler", "spin bowler", "mixture/unknown"],
+    "bowl_style": ["RF", "RM", "OB", "SLA"],
+    "phase": ["Powerplay", "Middle Overs", "Death Overs"],
+    "line": ["ON_THE_STUMPS", "OUTSIDE_OFFSTUMP", "DOWN_LEG", None],
+    "length": ["FULL", "GOOD_LENGTH", "SHORT", None],
+    "shot": ["DEFENDED", "DRIVE", "CUT", None],
+}
+PLAYERS = ["A. Batter", "B. Batter", "C. Allrounder", "D. Bowler", "E. Bowler", None]
+# Bats, but never dismissed and never has a control value
+NOT_OUT = "F. Tailender"
+
+
+def balls(rows=3000, seed=7):
+    rng = random.Random(seed)
+    data = {name: [] for name in columnar.COLUMNS}
+    for i in range(rows):
+        for name, values in TEXT.items():
+            data[name].append(rng.choice(values))
+        data["team_bat"].append(TEAMS[i // 120 % len(TEAMS)][0])
+        data["team_bowl"].append(TEAMS[i // 120 % len(TEAMS)][1])
+        tail = i % 97 == 0
+        data["bat"].append(NOT_OUT if tail else rng.choice(PLAYERS))
+        data["bowl"].append(rng.choice(PLAYERS))
+        data["p_match"].append(i // 120)
+        data["year"].append(2015 + i // 600)
+        data["wagonzone"].append(rng.choice([0, 1, 2, 3, 4, None]))
+        runs = rng.choice([0, 0, 0, 1, 1, 2, 4, 6, None])
+        data["batruns"].append(runs)
+        data["ballfaced"].append(rng.choice([1, 1, 1, 0]))
+        data["bowlruns"].append(runs or 0)
+        data["score"].append((runs or 0) + rng.choice([0, 0, 1]))
+        data["ball_id"].append(rng.choice([i, i, None]))
+        data["control"].append(None if tail else rng.choice([Decimal("0.0"), Decimal("1.0"), None]))
+        out = not tail and rng.random() < 0.05
+        data["out"].append(out)
+        data["outcome"].append("out" if out else rng.choice(["no run", "run", "four", "six", "wide"]))
+        data["is_dot"].append(runs == 0)
+        data["is_boundary"].append(runs is not None and runs >= 4)
+        data["is_bowler_wicket"].append(out and rng.random() < 0.8)
+    return data
+
+
+# Postgres-only syntax in the generated SQL and the builders -> SQLite
+def _sqlite(sql):
+    for old, new in (("::NUMERIC", " * 1.0"), ("::INT", ""), ("::VARCHAR", ""), (" ILIKE ", " LIKE "),
+                     ("%s", "?")):
+        sql = sql.replace(old, new)
+    return sql
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(_sqlite(sql), params)
+
+
+@pytest.fixture(scope="module")
+def engines():
+    data = balls()
+    conn = sqlite3.connect(":memory:")
+    names = list(data)
+    affinity = {"integer": "INTEGER", "boolean": "INTEGER", "numeric": "REAL"}
+    conn.execute("CREATE TABLE odi_db ({})".format(", ".join(
+        '"{}" {}'.format(name, affinity.get(TYPES.get(name), "TEXT")) for name in names)))
+    conn.executemany(
+        "INSERT INTO odi_db VALUES ({})".format(", ".join("?" * len(names))),
+        [[float(v) if isinstance(v, Decimal) else v for v in row] for row in zip(*(data[n] for n in names))])
+    for name, build in derived.DERIVED_TABLES.items():
+        if name in metrics.SUMMARY_TABLES:
+            build(_Cursor(conn), "odi_db", name)
+
+    types = {name: TYPES.get(name, "character varying") for name in names}
+    for name in names:
+        if name not in TYPES:
+            encoder = columnar._Encoder()
+            encoder.extend(data[name])
+            data[name] = encoder
+    yield columnar.from_values(data, types, 1), conn
+    conn.close()
+
+
+def reference(conn, query, params):
+    cursor = conn.execute(_sqlite(query), params)
+    names = [column[0].lower() for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def _same(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    # ROUND() on SQLite's floats may land a cent away from numeric's half-up
+    return abs(Decimal(a) - Decimal(str(b))) <= Decimal("0.01")
+
+
+def _key(row, dimensions):
+    return tuple((row[d] is not None, row[d] if row[d] is not None else 0) for d in dimensions)
+
+
+def check(engines, query, params=(), ordered=False):
+    table, conn = engines
+    got = columnar.execute(table, query.spec, params)
+    want = reference(conn, query, params)
+    assert len(got) == len(want), (got, want)
+    dimensions = [d.split()[-1].lower() for d in query.spec["dimensions"]]
+    if not ordered:
+        got = sorted(got, key=lambda row: _key(row, dimensions))
+        want = sorted(want, key=lambda row: _key(row, dimensions))
+    for g, w in zip(got, want):
+        assert set(g) == set(w)
+        assert all(_same(g[column], w[column]) for column in w), (g, w)
+    return got
+
+
+RATES = [("total_runs", "runs"), "balls_faced", "deliveries", "outs", "strike_rate", "average", "dot_pct",
+         "boundary_pct", "control_pct", "control_sum", "control_count"]
+
+
+def test_balls_by_dimension(engines):
+    rows = check(engines, metrics.select(
+        "odi_db", ["line", "length"], RATES + ["nbsr", "sri", "economy_total", "bei", "matches"],
+        where=["bat = %s"]), ("A. Batter",))
+    # NULL line and length are groups of their own
+    assert any(row["line"] is None for row in rows) and any(row["length"] is None for row in rows)
+
+
+def test_null_groups_and_counters(engines):
+    check(engines, metrics.select("odi_db", ["wagonZone", "team_bowl AS opponent"], RATES))
+    # Balls with no batter, and a batter with no control data
+    check(engines, metrics.select("odi_db", ["bat"], RATES))
+    check(engines, metrics.select("odi_db", [], RATES, where=["bat = %s"]), (NOT_OUT,))
+    # No matching rows: one row of NULLs and zero counts
+    check(engines, metrics.select("odi_db", [], RATES, where=["bat = %s"]), ("Nobody",))
+
+
+def test_filter_predicates(engines):
+    check(engines, metrics.select(
+        "odi_db", ["bowl_kind"],
+        [("pp_runs", "runs", "phase = 'Powerplay'"), ("death_sr", "strike_rate", "phase = 'Death Overs'"),
+         ("off_dots", "dot_pct", "line = 'OUTSIDE_OFFSTUMP'"), ("zone_runs", "runs", "wagonzone = '3'"),
+         "strike_rate"],
+        where=["bowl ILIKE %s"]), ("%bowler",))
+
+
+def test_having_order_and_limit(engines):
+    check(engines, metrics.select(
+        "odi_db", ["bat", "phase"], ["runs", "strike_rate"], having="{deliveries} >= 60"))
+    # SQLite sorts NULL first, Postgres (and the engine) last: rank named bowlers
+    check(engines, metrics.select(
+        "odi_db", ["bowl AS name"], ["bowler_wickets", "economy"], where=["bowl ILIKE %s"],
+        having="{bowler_wickets} > 3", order_by="name", limit=3), ("%",), ordered=True)
+
+
+@pytest.mark.parametrize("source", ["bat_rollup", "bowl_rollup"])
+def test_rollups(engines, source):
+    runs = "runs" if source == "bat_rollup" else "bowl_runs"
+    check(engines, metrics.select(
+        source, ["opponent", "year"],
+        [runs, "deliveries", "matches", "dots", "control_pct", "average" if runs == "runs" else "economy"],
+        where=["player = %s"]), ("C. Allrounder",))
+    check(engines, metrics.select(
+        source, ["player AS name"], [(runs + "_2016", runs, "year = '2016'"), "matches"],
+        having="{matches} > 4", order_by="name", limit=4), ordered=True)
+    check(engines, metrics.select(source, [], [runs, "matches"], where=["year = %s"]), (2016,))
+    # A summary counter over no rows is NULL even for counts
+    check(engines, metrics.select(source, [], [runs, "deliveries"], where=["player = %s"]), ("Nobody",))
+
+
+@pytest.mark.parametrize("query", [profiles.BATTER_PROFILE_SQL, profiles.BOWLER_PROFILE_SQL])
+@pytest.mark.parametrize("player", ["A. Batter", "D. Bowler", NOT_OUT, "Nobody"])
+def test_player_phase_profiles(engines, query, player):
+    check(engines, query, (player,))
+
+
+@pytest.mark.parametrize("role", ["bat", "bowl"])
+def test_player_phase_breakdown(engines, role):
+    check(engines, metrics.select(
+        "player_phase", ["phase", "bowl_kind"], ["deliveries", "runs", "economy", "dot_pct", "control_pct"],
+        where=["player = %s", "role = '{}'".format(role)], having="{deliveries} > 20"), ("C. Allrounder",))
+
+
+@pytest.mark.parametrize("cells", [["line", "length"], ["wagonzone"]])
+@pytest.mark.parametrize("bowler", [False, True])
+def test_cubes(engines, cells, bowler):
+    source = "bat_line_length" if cells == ["line", "length"] else "bat_wagon"
+    where = ["player = %s", "bowl_kind = %s"]
+    params = ("B. Batter", "pace bowler")
+    if bowler:
+        source += "_bowler"
+        where.append("bowler = %s")
+        params += ("E. Bowler",)
+    check(engines, metrics.select(
+        source, cells, [("total_runs", "runs"), "balls_faced", "strike_rate", "dot_pct", "boundary_pct",
+                        "control_pct"], where=where), params)
+    check(engines, metrics.select(
+        source, cells + ["phase"], ["runs", ("pp_runs", "runs", "phase = 'Powerplay'")],
+        where=["player = %s"], having="{deliveries} >= 5"), ("A. Batter",))
@@ -0,0 +1,238 @@
+import collections
+import os
+import threading
+import time
+
+from flask import current_app, jsonify, request
+
+import benchmarks
+import cache
+
+# Cache warm-up. Each process replays, through the app itself, the requests
+# its first visitors would otherwise wait on:
+#   1. the pick-lists and the global benchmarks (once computed for the
+#      current dataset version)
+#   2. every recorded request for the WARMUP_PLAYERS most requested players
+# then replays them once more to check that they are now served warm.
+# /api/ready answers 503 until that check passes, so a load balancer using it
+# as the health check only sends traffic to warm workers. A new dataset
+# version empties the cache, and warm-up runs again in the background.
+#
+# Requests to cached routes for a known player are counted per normalized
+# request key in api_request_stats, buffered in memory and flushed every
+# WARMUP_INTERVAL seconds; the player ranking comes from there. Each flush
+# drops keys not requested for WARMUP_STATS_DAYS and all but the
+# WARMUP_STATS_MAX most requested, so arbitrary query strings cannot grow
+# the table.
+
+WARMUP_PLAYERS = int(os.getenv("WARMUP_PLAYERS", 25))
+# At most this many recorded player requests are replayed
+WARMUP_MAX_REQUESTS = int(os.getenv("WARMUP_MAX_REQUESTS", 500))
+# Warm responses must come back within this p99, in milliseconds
+WARMUP_P99_MS = float(os.getenv("WARMUP_P99_MS", 50))
+# Passes before giving up on the p99 and reporting ready anyway
+WARMUP_PASSES = int(os.getenv("WARMUP_PASSES", 3))
+# Seconds between stats flushes and dataset version checks
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", 60))
+# Whether the first request starts the warm-up (off in the index advisor)
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# Request keys kept in api_request_stats, and for how long since last seen
+WARMUP_STATS_MAX = int(os.getenv("WARMUP_STATS_MAX", 10000))
+WARMUP_STATS_DAYS = int(os.getenv("WARMUP_STATS_DAYS", 30))
+
+STATIC_REQUESTS = [
+    "/api/teams?",
+    "/api/players?",
+    "/api/seasons?",
+    "/api/matches?",
+]
+# Benchmark name -> route. Warmed only once the benchmarks of the current
+# dataset version are stored: before that they would cache the previous
+# version's payload (see benchmarks.get).
+BENCHMARK_REQUESTS = {
+    "batting": "/api/global-phase-benchmarks?",
+    "bowling": "/api/bowlers-global-benchmarks?",
+}
+
+# Marks the warm-up's own requests so they are not counted
+WARMUP_HEADER = "X-Warmup"
+
+REQUEST_STATS_SQL = """
+    CREATE TABLE IF NOT EXISTS api_request_stats (
+        request_key VARCHAR PRIMARY KEY,
+        path VARCHAR NOT NULL,
+        player VARCHAR,
+        hits BIGINT NOT NULL DEFAULT 0,
+        last_requested TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+def p99(latencies):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else 0.0
+
+
+class Warmup(threading.Thread):
+    def __init__(self, app, pool, interval=WARMUP_INTERVAL):
+        super().__init__(name="cache-warmup", daemon=True)
+        self.app = app
+        self.pool = pool
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()   # (request_key, path, player) -> hits
+        self.status = {
+            "state": "pending",
+            "version": None,
+            "requests": 0,
+            "warmed": 0,
+            "failed": 0,
+            "passes": 0,
+            "p99_ms": None,
+            "seconds": None,
+        }
+
+    @property
+    def ready(self):
+        return self.status["state"] == "ready"
+
+    def record(self, key, path, player):
+        if not player:
+            return
+        with self._lock:
+            self._counts[(key, path, player)] += 1
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+        if not counts:
+            return
+        conn = self.pool.connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(REQUEST_STATS_SQL)
+                for (key, path, player), hits in counts.items():
+                    cur.execute("""
+                        INSERT INTO api_request_stats (request_key, path, player, hits)
+                        SELECT %s, %s, %s, %s
+                        WHERE EXISTS (SELECT 1 FROM players WHERE name = %s)
+                        ON CONFLICT (request_key) DO UPDATE
+                        SET hits = api_request_stats.hits + EXCLUDED.hits, last_requested = now()
+                    """, (key, path, player, hits, player))
+                cur.execute("""
+                    DELETE FROM api_request_stats
+                    WHERE last_requested < now() - make_interval(days => %s)
+                       OR request_key NOT IN (
+                           SELECT request_key FROM api_request_stats ORDER BY hits DESC LIMIT %s)
+                """, (WARMUP_STATS_DAYS, WARMUP_STATS_MAX))
+        finally:
+            conn.close()
+
+    # The static requests and current benchmarks, then the recorded requests
+    # of the top players
+    def targets(self):
+        conn = self.pool.connection()
+        try:
+            # Computes the new version's benchmarks unless another process
+            # already is
+            benchmarks.refresh(conn)
+            version = cache.dataset_version()
+            static = STATIC_REQUESTS + [key for name, key in BENCHMARK_REQUESTS.items()
+                                        if benchmarks.stored_version(conn, name) == version]
+            with conn.cursor() as cur:
+                cur.execute(REQUEST_STATS_SQL)
+                cur.execute("""
+                    WITH top_players AS (
+                        SELECT player
+                        FROM api_request_stats
+                        WHERE player <> ''
+                        GROUP BY player
+                        ORDER BY SUM(hits) DESC
+                        LIMIT %s
+                    )
+                    SELECT request_key
+                    FROM api_request_stats
+                    WHERE player IN (SELECT player FROM top_players)
+                    ORDER BY hits DESC
+                    LIMIT %s
+                """, (WARMUP_PLAYERS, WARMUP_MAX_REQUESTS))
+                recorded = [row[0] for row in cur.fetchall()]
+        finally:
+            conn.close()
+        return static + recorded
+
+    # Replay every target; returns the latency of each in milliseconds
+    def replay(self, targets, count=False):
+        client = self.app.test_client()
+        latencies = []
+        for key in targets:
+            start = time.perf_counter()
+            response = client.get(key, headers={WARMUP_HEADER: "1"})
+            latencies.append((time.perf_counter() - start) * 1000)
+            if count:
+                self.status["warmed" if response.status_code == 200 else "failed"] += 1
+        return latencies
+
+    def warm(self):
+        start = time.perf_counter()
+        targets = self.targets()
+        # A worker that is already serving stays ready while it re-warms
+        if not self.ready:
+            self.status["state"] = "warming"
+        self.status.update(version=cache.dataset_version(), requests=len(targets), warmed=0, failed=0, passes=0)
+        self.replay(targets, count=True)
+        for _ in range(WARMUP_PASSES):
+            self.status["passes"] += 1
+            self.status["p99_ms"] = round(p99(self.replay(targets)), 2)
+            if self.status["p99_ms"] <= WARMUP_P99_MS:
+                break
+        self.status.update(state="ready", seconds=round(time.perf_counter() - start, 2))
+        print("Cache warm-up done: {requests} requests, p99 {p99_ms} ms".format(**self.status))
+
+    def run(self):
+        while True:
+            try:
+                if not self.ready or cache.dataset_version() != self.status["version"]:
+                    self.warm()
+                self.flush()
+            except Exception as e:
+                print("Cache warm-up failed:", e)
+                # Never hold a worker out of rotation over a warm-up error
+                self.status["state"] = "ready"
+            time.sleep(self.interval)
+
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+
+def start(app, pool, interval=WARMUP_INTERVAL):
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None:
+            _warmup = Warmup(app, pool, interval)
+            _warmup.start()
+    return _warmup
+
+
+# Warm-up starts with the first request (normally the load balancer's first
+# readiness check) in whichever process serves it
+def init_app(app, pool):
+    @app.before_request
+    def start_warmup():
+        if _warmup is None and WARMUP_ENABLED:
+            start(app, pool)
+
+    @app.after_request
+    def record_request(response):
+        view = current_app.view_functions.get(request.endpoint)
+        if (_warmup is not None and getattr(view, "cacheable", False)
+                and response.status_code in (200, 304) and WARMUP_HEADER not in request.headers):
+            _warmup.record(cache.request_key(), request.path, request.args.get("player"))
+        return response
+
+    @app.route('/api/ready')
+    def get_ready():
+        status = dict(_warmup.status) if _warmup is not None else {"state": "pending"}
+        return jsonify(status), 200 if status["state"] == "ready" else 503